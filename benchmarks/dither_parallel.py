@@ -0,0 +1,75 @@
+"""
+Speedup of the dithering modes by thread count and how far they are from
+serial Floyd-Steinberg. The difference is reported as the share of pixels
+with another palette color and as the PSNR after a blur, which is closer
+to what is seen from a distance on the panel.
+
+    python benchmarks/dither_parallel.py --repeat 10
+"""
+
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from models import DitherMode, ImageEntry  # noqa: E402
+from suite import synthetic_image  # noqa: E402
+
+
+def blurred_psnr(reference: Image.Image, other: Image.Image, radius: float = 2.0) -> float:
+    blur = ImageFilter.GaussianBlur(radius)
+    difference = ImageChops.difference(
+        reference.convert("RGB").filter(blur), other.convert("RGB").filter(blur)
+    )
+    rms = math.sqrt(statistics.mean(value**2 for value in ImageStat.Stat(difference).rms))
+    return float("inf") if rms == 0 else 20 * math.log10(255 / rms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    processor = ImageProcessor()
+    # the quantize stage works on the already fitted frame
+    image = synthetic_image(processor.target_size)
+    reference = processor.dither(image, ImageEntry(id="ref", name="ref"))
+
+    print(f"{'mode':18} {'threads':>7} {'median':>10} {'speedup':>8} {'changed':>8} {'blurred PSNR':>13}")
+    serial = None
+    for mode in DitherMode:
+        entry = ImageEntry(id="bench", name="bench", dither_mode=mode)
+        for threads in range(1, args.max_threads + 1):
+            processor = ImageProcessor(threads=threads)
+            processor.dither(image, entry)
+            times = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = processor.dither(image, entry)
+                times.append(time.perf_counter() - started)
+            median = statistics.median(times)
+            if serial is None:
+                serial = median
+            changed = sum(a != b for a, b in zip(reference.tobytes(), result.tobytes())) / (
+                image.width * image.height
+            )
+            print(
+                f"{mode.value:18} {threads:7d} {median * 1000:8.2f}ms {serial / median:7.2f}x "
+                f"{changed:8.1%} {blurred_psnr(reference, result):11.1f}dB"
+            )
+            if mode == DitherMode.FloydSteinberg:
+                # the serial mode ignores the thread count
+                break
+
+
+if __name__ == "__main__":
+    main()
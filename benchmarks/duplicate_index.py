@@ -0,0 +1,89 @@
+"""
+Near-duplicate lookups in the multi-index hash of the duplicate index against a
+linear scan over all pHashes.
+
+Generates random 64 bit hashes plus a few near-duplicates of some of them,
+then times building the index, single lookups as done on upload and the
+full duplicate report, and checks that the index finds what the scan finds.
+Exits non-zero if they disagree.
+
+    python benchmarks/duplicate_index.py --entries 50000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from perceptual_hash import DUPLICATE_DISTANCE, DuplicateIndex, hamming  # noqa: E402
+
+
+def flip(rng: random.Random, hash: int, bits: int) -> int:
+    for bit in rng.sample(range(64), bits):
+        hash ^= 1 << bit
+    return hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--duplicates", type=int, default=500, help="Entries with a near-duplicate")
+    parser.add_argument("--radius", type=int, default=DUPLICATE_DISTANCE)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    hashes = {f"{index:08d}": rng.getrandbits(64) for index in range(args.entries)}
+    originals = rng.sample(sorted(hashes), args.duplicates)
+    for index, id in enumerate(originals):
+        hashes[f"dup-{index:06d}"] = flip(rng, hashes[id], rng.randint(1, args.radius))
+    rows = [(id, f"{hash:016x}") for id, hash in hashes.items()]
+
+    index = DuplicateIndex(lambda: rows)
+    started = time.perf_counter()
+    index.build()
+    print(f"built index of {len(rows)} hashes in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    failures = []
+    index_times, scan_times = [], []
+    for id in rng.sample(sorted(hashes), args.lookups):
+        phash = f"{hashes[id]:016x}"
+        started = time.perf_counter()
+        found = index.similar(phash, args.radius, exclude=id)
+        index_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        hash = int(phash, 16)
+        scanned = sorted(
+            (distance, other)
+            for other, other_hash in hashes.items()
+            if other != id and (distance := hamming(hash, other_hash)) <= args.radius
+        )
+        scan_times.append(time.perf_counter() - started)
+        if found != scanned:
+            failures.append(f"{id}: index found {found}, scan found {scanned}")
+
+    for label, durations in (("index lookup", index_times), ("linear scan", scan_times)):
+        print(
+            f"{label:16} median={statistics.median(durations) * 1000:8.3f}ms "
+            f"max={max(durations) * 1000:8.3f}ms"
+        )
+
+    started = time.perf_counter()
+    groups = index.groups(args.radius)
+    print(f"duplicate report: {len(groups)} groups in {time.perf_counter() - started:.2f}s")
+    if len(groups) < args.duplicates * 0.9:
+        failures.append(f"only {len(groups)} groups for {args.duplicates} near-duplicates")
+
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
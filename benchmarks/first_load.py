@@ -0,0 +1,123 @@
+"""
+First load of the web UI with an empty browser cache, as a browser on the
+LAN of a frame without internet access sees it.
+
+Fetches the page from a running server, then every stylesheet, script and
+font it references, the way a browser does: fonts once the stylesheets are
+in, everything with brotli and gzip accepted. Prints the time and bytes on
+the wire per asset and in total. Fails if the page references anything not
+served by the frame itself, if an asset is not compressed where that helps
+or if it can not be cached forever.
+
+    python src/assets.py
+    python src/main.py &
+    python benchmarks/first_load.py --server http://<RASPBERRY_PI_IP>:8000
+
+Run it on a machine without internet access to confirm nothing waits on a CDN.
+"""
+
+import argparse
+import gzip
+import re
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# what the server may answer with is what can be decoded here
+ACCEPT_ENCODING = "br, gzip" if brotli is not None else "gzip"
+
+
+class References(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "script" and attrs.get("src"):
+            self.urls.append(attrs["src"])
+        elif tag == "link" and attrs.get("rel") in ("stylesheet", "preload") and attrs.get("href"):
+            self.urls.append(attrs["href"])
+
+
+def fetch(url: str, timeout: float) -> tuple[bytes, dict, float]:
+    request = urllib.request.Request(url, headers={"Accept-Encoding": ACCEPT_ENCODING})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read()
+        headers = {key.lower(): value for key, value in response.headers.items()}
+    return body, headers, time.perf_counter() - started
+
+
+def decode(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        return brotli.decompress(body)
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://localhost:8000")
+    parser.add_argument("--page", default="/")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    failures = []
+    origin = urlsplit(args.server).netloc
+    started = time.perf_counter()
+    page, _, duration = fetch(urljoin(args.server, args.page), args.timeout)
+    print(f"{args.page:52} {len(page):>8} bytes {duration * 1000:>8.1f}ms")
+    references = References()
+    references.feed(page.decode())
+    urls = [urljoin(args.server, url) for url in dict.fromkeys(references.urls)]
+    external = [url for url in urls if urlsplit(url).netloc != origin]
+    for url in external:
+        failures.append(f"{url} is not served by the frame")
+    local = [url for url in urls if url not in external]
+
+    def load(url: str) -> list[tuple[str, bytes, dict, float]]:
+        body, headers, duration = fetch(url, args.timeout)
+        loaded = [(url, body, headers, duration)]
+        # fonts referenced by a stylesheet load only once it arrived
+        if "text/css" in headers.get("content-type", ""):
+            css = decode(body, headers.get("content-encoding", "identity")).decode()
+            for font in re.findall(r"url\(([^)]+\.woff2)\)", css):
+                font = urljoin(url, font.strip("\"'"))
+                if font not in local:
+                    loaded += load(font)
+        return loaded
+
+    # browsers open about six connections per host
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        loaded = [item for items in executor.map(load, local) for item in items]
+    total = time.perf_counter() - started
+
+    wire = len(page)
+    for url, body, headers, duration in loaded:
+        wire += len(body)
+        encoding = headers.get("content-encoding", "identity")
+        print(f"{urlsplit(url).path:52} {len(body):>8} bytes {duration * 1000:>8.1f}ms {encoding}")
+        if "immutable" not in headers.get("cache-control", ""):
+            failures.append(f"{url} is served with Cache-Control: {headers.get('cache-control')}")
+        if not url.endswith(".woff2") and encoding == "identity":
+            failures.append(f"{url} is served uncompressed")
+    print(f"first load: {len(loaded) + 1} requests, {wire / 1024:.1f}KiB on the wire in {total * 1000:.0f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+End to end check of fleet mode on one machine.
+
+Starts the server against a temporary data directory, seeds it with
+synthetic images and starts thin clients as separate processes with the
+dummy display. Checks that every panel gets frames, that unchanged frames
+are answered with 304, and that the clients keep cycling through their
+cached frames after the server is stopped. Exits non-zero on failure.
+
+    python benchmarks/fleet_check.py --clients 3 --cycle 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlencode
+
+from loadtest import Server, multipart, synthetic_png
+
+CLIENT = Path(__file__).parent.parent / "src" / "fleet_client.py"
+
+
+def start_client(url: str, panel: str, cache: Path, log: Path, offline_interval: float) -> subprocess.Popen:
+    env = dict(os.environ, PRISMBERRY_DISPLAY="dummy")
+    return subprocess.Popen(
+        [
+            sys.executable,
+            str(CLIENT),
+            "--server", url,
+            "--panel", panel,
+            "--cache", str(cache),
+            "--poll", "1",
+            "--offline-interval", str(offline_interval),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=log.open("w"),
+    )
+
+
+def panels(url: str) -> dict[str, dict]:
+    with urllib.request.urlopen(url + "/fleet") as response:
+        return {panel["panel"]: panel for panel in json.loads(response.read())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--clients", type=int, default=3)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--cycle", type=int, default=5, help="Seconds a panel shows a frame")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run with the server up")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as root:
+        server = Server(args.port, root)
+        clients = []
+        try:
+            server.wait_ready()
+            for seed in range(args.images):
+                data, content_type = multipart(
+                    {"name": f"fleet-{seed}", "dithering": "on", "background_color": "black"},
+                    synthetic_png(1600, 1200, seed * 32),
+                )
+                request = urllib.request.Request(server.url + "/add", data=data, method="POST")
+                request.add_header("Content-Type", content_type)
+                urllib.request.urlopen(request).read()
+            settings = urlencode({"cycle": "on", "cycle_seconds": args.cycle}).encode()
+            urllib.request.urlopen(server.url + "/settings", data=settings).read()
+
+            names = [f"panel-{index}" for index in range(args.clients)]
+            for name in names:
+                clients.append(
+                    start_client(
+                        server.url,
+                        name,
+                        Path(root) / "clients",
+                        Path(root) / f"{name}.log",
+                        offline_interval=args.cycle,
+                    )
+                )
+            time.sleep(args.duration)
+
+            state = panels(server.url)
+            for name in names:
+                panel = state.get(name)
+                if panel is None or panel["etag"] is None:
+                    failures.append(f"{name} never received a frame")
+                    continue
+                cached = len(list((Path(root) / "clients" / name).glob("*.frame")))
+                print(
+                    f"{name}: pulls={panel['pulls']} not_modified={panel['not_modified']} "
+                    f"cached={cached} showing {panel['frame']}"
+                )
+                if panel["not_modified"] == 0:
+                    failures.append(f"{name} was never answered with 304")
+                if cached < 2:
+                    failures.append(f"{name} cached {cached} frames, expected the panel to advance")
+        finally:
+            server.stop()
+
+        if not failures:
+            # the clients must survive the outage and fall back to their cache
+            time.sleep(2 * args.cycle + 2)
+            for name, client in zip(names, clients):
+                log = (Path(root) / f"{name}.log").read_text()
+                if client.poll() is not None:
+                    failures.append(f"{name} exited while the server was down")
+                elif "cached frame" not in log:
+                    failures.append(f"{name} did not show cached frames while offline")
+        for client in clients:
+            client.terminate()
+            client.wait()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Rendering one frame of an animated GIF through the frame index against
+decoding the GIF up to that frame.
+
+Generates a GIF with --frames frames, stores it like an upload, then times
+decoding and rendering frame N from the stored frames and from the GIF,
+where reaching frame N means decoding every frame before it.
+
+    python benchmarks/frame_seek.py --frames 500 --size 640 480
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from frame_index import open_frame  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from models import ImageEntry  # noqa: E402
+from render_pool import render_png, store_upload  # noqa: E402
+
+
+def write_gif(path: Path, frames: int, size: tuple[int, int]):
+    from PIL import Image, ImageDraw
+
+    images = []
+    for index in range(frames):
+        image = Image.new("P", size, 0)
+        image.putpalette([channel for color in range(256) for channel in (color, 255 - color, color // 2)])
+        draw = ImageDraw.Draw(image)
+        x = index * 7 % size[0]
+        draw.rectangle((x, 0, x + size[0] // 4, size[1]), fill=index % 255 + 1)
+        draw.ellipse((size[0] // 2 - x // 2, size[1] // 4, size[0] // 2 + x // 3, size[1] // 2), fill=200)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], duration=100, loop=0)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def main():
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480), metavar=("W", "H"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "animation.gif"
+        write_gif(source, args.frames, tuple(args.size))
+        stored = Path(tmp) / "stored.png"
+        started = time.perf_counter()
+        _, frames = store_upload(source.read_bytes(), str(stored)).value
+        print(
+            f"stored {len(frames)} frames in {time.perf_counter() - started:.1f}s, "
+            f"gif {source.stat().st_size / 2**20:.1f}MiB, stored {stored.stat().st_size / 2**20:.1f}MiB"
+        )
+
+        processor = ImageProcessor()
+
+        def decode_gif(index: int):
+            with Image.open(source) as image:
+                image.seek(index)
+                image.load()
+
+        def render_gif(index: int):
+            with Image.open(source) as image:
+                image.seek(index)
+                processor(image, ImageEntry(id="bench", name="bench")).save(
+                    Path(tmp) / "frame.png"
+                )
+
+        print(f"{'frame':>6} {'decode index':>13} {'decode gif':>11} {'render index':>13} {'render gif':>11}")
+        for index in sorted({0, len(frames) // 2, len(frames) - 1}):
+            frame = frames[index]
+            options = {
+                **ImageEntry(id="bench", name="bench", frame=index).model_dump(),
+                "frame_span": (frame.offset, frame.length),
+            }
+            timings = [
+                measure(lambda: open_frame(str(stored), frame.offset, frame.length).load(), args.repeat),
+                measure(lambda: decode_gif(index), args.repeat),
+                measure(lambda: render_png(str(stored), options), args.repeat),
+                measure(lambda: render_gif(index), args.repeat),
+            ]
+            print(f"{index:>6} " + " ".join(f"{timing * 1000:>11.1f}ms" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
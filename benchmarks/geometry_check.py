@@ -0,0 +1,98 @@
+"""
+Compares ImageProcessor with the previous rotate-then-contain pipeline:
+timing per case and whether the output frames are pixel-identical.
+Exits with status 1 if an unrotated frame differs.
+
+    python benchmarks/geometry_check.py --size 4032 3024 --repeat 3
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from PIL import Image, ImageOps  # noqa: E402
+from PIL.Image import Dither, Quantize  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from models import BackgroundColor, ImageEntry, Rotation  # noqa: E402
+from suite import synthetic_image  # noqa: E402
+
+
+def previous(processor: ImageProcessor, image: Image.Image, entry: ImageEntry) -> Image.Image:
+    """
+    The pipeline before the fused geometry stage
+    """
+    if entry.rotation != Rotation._None:
+        image = image.rotate(entry.rotation.value, expand=True)
+    image = ImageOps.contain(image, processor.target_size)
+    palette = processor.gray_image if entry.grayscale else processor.color_image
+    quantized = image.convert("RGB").quantize(
+        palette=palette,
+        method=Quantize.FASTOCTREE,
+        dither=Dither.FLOYDSTEINBERG if entry.dither else Dither.NONE,
+        kmeans=32,
+    )
+    left = (processor.target_size[0] - quantized.width) // 2
+    top = (processor.target_size[1] - quantized.height) // 2
+    return ImageOps.expand(
+        quantized,
+        (
+            left,
+            top,
+            processor.target_size[0] - quantized.width - left,
+            processor.target_size[1] - quantized.height - top,
+        ),
+        fill=entry.background_color.value,
+    )
+
+
+def timed(run, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=(4032, 3024), metavar=("W", "H"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    processor = ImageProcessor()
+    image = synthetic_image(tuple(args.size))
+    image.load()
+    mismatches = 0
+    print(f"{'case':28} {'previous':>10} {'fused':>10} {'speedup':>8} {'differing pixels':>17}")
+    for rotation in Rotation:
+        for dither in (True, False):
+            entry = ImageEntry(
+                id="check",
+                name="check",
+                dither=dither,
+                rotation=rotation,
+                background_color=BackgroundColor.White,
+            )
+            old = previous(processor, image, entry)
+            new = processor(image, entry)
+            differing = sum(a != b for a, b in zip(old.tobytes(), new.tobytes()))
+            if rotation == Rotation._None and differing:
+                mismatches += 1
+            before = timed(lambda: previous(processor, image, entry), args.repeat)
+            after = timed(lambda: processor(image, entry), args.repeat)
+            case = f"rot{rotation.value}-{'dither' if dither else 'nodither'}"
+            print(
+                f"{case:28} {before * 1000:8.1f}ms {after * 1000:8.1f}ms "
+                f"{before / after:7.2f}x {differing:17d}"
+            )
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
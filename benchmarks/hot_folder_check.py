@@ -0,0 +1,154 @@
+"""
+Drops a burst of files into a watched hot folder and checks that every file
+is imported exactly once, only after it was completely written, and that
+threads and memory stay bounded while the workers catch up. Deleting the
+files afterwards has to remove every one of them. Exits non-zero on failure.
+
+    python benchmarks/hot_folder_check.py --files 1000 --ingest-ms 20
+
+Only the watcher is exercised, imports are simulated by reading the file and
+sleeping for --ingest-ms instead of running the image pipeline.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from hot_folder import HotFolder  # noqa: E402
+
+
+def rss() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def expected_size(path: Path) -> int:
+    return int(path.stem.split("-")[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="Largest file size in bytes")
+    parser.add_argument("--ingest-ms", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--settle", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    lock = threading.Lock()
+    ingested: dict[str, int] = {}
+    removed: set[str] = set()
+    failures: list[str] = []
+
+    def ingest(source: str, path: Path):
+        data = path.read_bytes()
+        time.sleep(args.ingest_ms / 1000)
+        with lock:
+            ingested[source] = ingested.get(source, 0) + 1
+            if len(data) != expected_size(path):
+                failures.append(f"{source} imported with {len(data)} of {expected_size(path)} bytes")
+
+    def remove(source: str):
+        with lock:
+            removed.add(source)
+
+    def rename(old: str, new: str):
+        failures.append(f"unexpected rename {old} -> {new}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "hot"
+        folder = HotFolder(
+            directory,
+            known=lambda: set(),
+            ingest=ingest,
+            remove=remove,
+            rename=rename,
+            settle=args.settle,
+            workers=args.workers,
+        )
+        folder.start()
+        baseline_threads = threading.active_count()
+        baseline_rss = rss()
+        peak = {"threads": baseline_threads, "rss": baseline_rss}
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                peak["threads"] = max(peak["threads"], threading.active_count())
+                peak["rss"] = max(peak["rss"], rss())
+                stop.wait(0.05)
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+
+        started = time.perf_counter()
+        chunk = os.urandom(64 * 1024)
+        for index in range(args.files):
+            size = 1024 + (index * 7919) % args.size
+            path = directory / (f"sub{index % 4}" if index % 10 == 0 else "") / f"img{index}-{size}.jpg"
+            path.parent.mkdir(exist_ok=True)
+            # written in chunks, a partially written file must not be imported
+            with open(path, "wb") as f:
+                written = 0
+                while written < size:
+                    written += f.write(chunk[: min(len(chunk), size - written)])
+                    f.flush()
+        dropped = time.perf_counter() - started
+
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            with lock:
+                if len(ingested) >= args.files:
+                    break
+            time.sleep(0.1)
+        imported = time.perf_counter() - started
+
+        for path in directory.rglob("*.jpg"):
+            path.unlink()
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and len(removed) < args.files:
+            time.sleep(0.1)
+
+        stop.set()
+        sampler.join()
+        folder.stop()
+
+    duplicates = [source for source, count in ingested.items() if count > 1]
+    print(
+        f"dropped {args.files} files in {dropped:.1f}s, imported {len(ingested)} in {imported:.1f}s, "
+        f"removed {len(removed)}"
+    )
+    print(
+        f"threads: baseline {baseline_threads} peak {peak['threads']}, "
+        f"rss: baseline {baseline_rss / 2**20:.1f}MiB peak {peak['rss'] / 2**20:.1f}MiB"
+    )
+    if len(ingested) != args.files:
+        failures.append(f"imported {len(ingested)} of {args.files} files")
+    if duplicates:
+        failures.append(f"{len(duplicates)} files imported more than once, e.g. {duplicates[0]}")
+    if len(removed) != args.files:
+        failures.append(f"removed {len(removed)} of {args.files} files")
+    # the workers are started on demand, besides them only the sampler is allowed
+    if peak["threads"] > baseline_threads + args.workers + 1:
+        failures.append(f"thread count grew from {baseline_threads} to {peak['threads']}")
+    # the workers hold at most a few files in memory at once
+    if peak["rss"] - baseline_rss > 64 * 2**20:
+        failures.append(f"rss grew by {(peak['rss'] - baseline_rss) / 2**20:.1f}MiB")
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Gallery filtering, search and cycling candidates on a large library.
+
+Fills a temporary database with synthetic entries, tags and albums and
+times the queries behind the gallery pages, the search field and picking
+the next image to cycle to.
+
+    python benchmarks/library_bench.py --entries 50000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from sqlmodel import Session, select  # noqa: E402
+from library import (  # noqa: E402
+    CandidateSet,
+    gallery_page,
+    load_albums,
+    search_query,
+    set_labels,
+)
+from models import ImageEntry  # noqa: E402
+from storage import create_storage_engine, init_db  # noqa: E402
+
+WORDS = ["beach", "mountain", "city", "family", "forest", "snow", "sunset", "garden", "lake", "dog"]
+
+
+def fill(engine, entries: int, albums: int):
+    rng = random.Random(0)
+    with Session(engine) as session:
+        for index in range(entries):
+            id = f"{index:08d}"
+            session.add(ImageEntry(id=id, name=f"{rng.choice(WORDS)} {index}"))
+            session.flush()
+            set_labels(
+                session,
+                id,
+                rng.sample(WORDS, 2),
+                [f"album-{rng.randrange(albums)}"],
+            )
+            if index % 1000 == 999:
+                session.commit()
+        session.commit()
+
+
+def measure(label: str, fn: Callable[[], object], repeat: int):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    print(f"{label:32} median={statistics.median(durations) * 1000:8.3f}ms max={max(durations) * 1000:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--albums", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_storage_engine(Path(tmp) / "library.db")
+        init_db(engine)
+        started = time.perf_counter()
+        fill(engine, args.entries, args.albums)
+        print(f"filled {args.entries} entries in {time.perf_counter() - started:.1f}s")
+
+        with Session(engine) as session:
+            album = load_albums(session)[0].id
+            middle = session.exec(
+                select(ImageEntry).order_by(ImageEntry.name, ImageEntry.id).offset(args.entries // 2)
+            ).first()
+
+            measure("gallery first page", lambda: gallery_page(session), args.repeat)
+            measure(
+                "gallery middle page",
+                lambda: gallery_page(session, after=(middle.name, middle.id)),
+                args.repeat,
+            )
+            measure("gallery album", lambda: gallery_page(session, album=album), args.repeat)
+            measure("gallery search prefix", lambda: gallery_page(session, search_query("sun")), args.repeat)
+            measure(
+                "gallery search tags",
+                lambda: gallery_page(session, search_query("tag:beach tag:dog")),
+                args.repeat,
+            )
+            measure(
+                "all ids per tick (before)",
+                lambda: random.choice(session.exec(select(ImageEntry.id)).all()),
+                args.repeat,
+            )
+
+        candidates = CandidateSet(engine)
+
+        def reload():
+            candidates.set_scope(None, None)
+            candidates.set_scope(album, "tag:beach")
+            len(candidates)
+
+        measure("candidates load", reload, 5)
+        measure("candidates pick", candidates.pick, args.repeat)
+
+        def relabel():
+            with Session(engine) as session:
+                set_labels(session, middle.id, [random.choice(WORDS)], ["album-0"])
+                session.commit()
+            candidates.changed(middle.id)
+
+        measure("relabel and update candidates", relabel, args.repeat)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Load test for the web UI and upload paths.
+
+Starts the app against a temporary data directory with the dummy display,
+seeds it with synthetic images and drives a weighted mix of gallery
+browsing, option updates, previews, uploads and display requests.
+
+    python benchmarks/loadtest.py --concurrency 8 --duration 60
+    python benchmarks/loadtest.py --mix browse=1,preview=1 --concurrency 4
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlencode
+
+MAIN = Path(__file__).parent.parent / "src" / "main.py"
+
+DEFAULT_MIX = {"browse": 50, "update": 20, "preview": 15, "upload": 10, "display": 5}
+# the values the options form sends
+ROTATIONS = ("0", "90", "180", "270")
+
+
+def synthetic_png(width: int, height: int, seed: int) -> bytes:
+    """
+    Deterministic RGB gradient PNG, encoded without Pillow
+    """
+    ramp = bytes(i % 256 for i in range(width + 256))
+    rows = []
+    for y in range(height):
+        row = bytearray(3 * width)
+        row[0::3] = ramp[seed % 256 : seed % 256 + width]
+        row[1::3] = bytes(((y * 2 + seed) % 256,)) * width
+        row[2::3] = ramp[y % 256 : y % 256 + width]
+        rows.append(b"\x00" + bytes(row))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def multipart(fields: dict[str, str], file: bytes) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="load.png"\r\n'
+        f"Content-Type: image/png\r\n\r\n".encode()
+        + file
+        + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Server:
+    def __init__(self, port: int, root: str):
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(
+            os.environ,
+            PRISMBERRY_ROOT=root,
+            PRISMBERRY_PORT=str(port),
+            PRISMBERRY_DISPLAY="dummy",
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, str(MAIN)],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.peak_rss = 0
+
+    def wait_ready(self, timeout: float = 60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                with urllib.request.urlopen(self.url + "/"):
+                    return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+        raise RuntimeError("Server did not start in time")
+
+    def _pids(self) -> list[int]:
+        pids = [self.process.pid]
+        try:
+            with open(f"/proc/{self.process.pid}/task/{self.process.pid}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def rss(self) -> int:
+        """
+        Resident memory of the server and its render workers in bytes
+        """
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+        return total
+
+    def sample_rss(self, stop: threading.Event):
+        while not stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.rss())
+            stop.wait(0.1)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class LoadTest:
+    def __init__(self, server: Server, mix: dict[str, int], upload_size: tuple[int, int]):
+        self.server = server
+        self.mix = mix
+        self.upload_size = upload_size
+        self.ids: list[str] = []
+        self.images: dict[int, bytes] = {}
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def request(
+        self,
+        route: str,
+        path: str,
+        method: str = "GET",
+        data: bytes = None,
+        content_type: str = None,
+        expect: str = None,
+    ) -> str:
+        request = urllib.request.Request(self.server.url + path, data=data, method=method)
+        request.add_header("HX-Request", "true")
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                body = response.read().decode(errors="replace")
+            failed = expect is not None and expect not in body
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            body, failed = "", True
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            if failed:
+                self.errors[route] += 1
+        return body
+
+    def refresh_ids(self, body: str):
+        ids = re.findall(r'id="article-([0-9a-f-]{36})"', body)
+        if ids:
+            with self.lock:
+                self.ids = ids
+
+    def upload(self, seed: int):
+        # a few distinct images are enough, generating them is not free
+        variant = seed % 8
+        if variant not in self.images:
+            self.images[variant] = synthetic_png(*self.upload_size, variant * 32)
+        data, content_type = multipart(
+            {"name": f"load-{seed}", "dithering": "on", "background_color": "black"},
+            self.images[variant],
+        )
+        self.request("upload", "/add", "POST", data, content_type, expect="Success")
+
+    def random_id(self) -> str:
+        with self.lock:
+            return random.choice(self.ids) if self.ids else None
+
+    def step(self, action: str):
+        if action == "browse":
+            self.refresh_ids(self.request("browse", "/images"))
+            return
+        if action == "upload":
+            self.upload(random.randrange(1 << 16))
+            return
+        id = self.random_id()
+        if id is None:
+            self.refresh_ids(self.request("browse", "/images"))
+        elif action == "update":
+            form = {
+                "background_color": random.choice(("black", "white")),
+                "rotation": random.choice(ROTATIONS),
+            }
+            if random.random() < 0.5:
+                form["dithering"] = "on"
+            self.request("update", f"/update/{id}", "PATCH", urlencode(form).encode(), "application/x-www-form-urlencoded")
+        elif action == "preview":
+            self.request("preview", f"/preview/{id}", expect="data:image/png")
+        elif action == "display":
+            self.request("display", f"/display/{id}", "POST", b"")
+
+    def worker(self, deadline: float):
+        actions = list(self.mix.keys())
+        weights = list(self.mix.values())
+        while time.monotonic() < deadline:
+            self.step(random.choices(actions, weights)[0])
+
+    def run(self, concurrency: int, duration: float, seed_images: int) -> float:
+        for seed in range(seed_images):
+            self.upload(seed)
+        self.refresh_ids(self.request("browse", "/images"))
+        self.latencies.clear()
+        self.errors.clear()
+
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=self.worker, args=(deadline,)) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown action {name}, choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed-images", type=int, default=10)
+    parser.add_argument("--upload-size", type=int, nargs=2, default=(1600, 1200), metavar=("W", "H"))
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="prismberry-load-") as root:
+        server = Server(args.port, root)
+        stop = threading.Event()
+        try:
+            server.wait_ready()
+            sampler = threading.Thread(target=server.sample_rss, args=(stop,), daemon=True)
+            sampler.start()
+            test = LoadTest(server, args.mix, tuple(args.upload_size))
+            elapsed = test.run(args.concurrency, args.duration, args.seed_images)
+        finally:
+            stop.set()
+            server.stop()
+
+    total = sum(len(values) for values in test.latencies.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s at concurrency {args.concurrency}")
+    print(f"{'route':10} {'count':>7} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, values in sorted(test.latencies.items()):
+        print(
+            f"{route:10} {len(values):7d} {test.errors[route]:7d} "
+            f"{statistics.median(values) * 1000:7.1f}ms "
+            f"{percentile(values, 0.95) * 1000:7.1f}ms "
+            f"{percentile(values, 0.99) * 1000:7.1f}ms"
+        )
+    print(f"peak RSS {server.peak_rss / 1024 / 1024:.1f} MiB (server and render workers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Processes large images concurrently through the render pool with a memory
+budget and checks that this process and the workers stay under a ceiling.
+Exits with status 1 if the ceiling is exceeded or a job fails.
+
+    python benchmarks/memory_budget.py --budget 192 --ceiling 384
+    python benchmarks/memory_budget.py --size 6000 4000 --jobs 16
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SRC = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from memory_budget import MemoryBudget  # noqa: E402
+from models import ImageEntry, Rotation  # noqa: E402
+from render_pool import RenderPool, render_buffer, render_png  # noqa: E402
+from display.edp import pack_image  # noqa: E402
+
+
+def rss(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def write_images(directory: Path, size: tuple[int, int]) -> list[Path]:
+    from PIL import Image
+
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = Image.effect_noise(size, 64)
+    image = Image.merge("RGB", (red, green, blue))
+    paths = [directory / "large.jpg", directory / "large.png"]
+    image.save(paths[0], quality=90)
+    image.save(paths[1], compress_level=1)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=192, help="Memory budget in MiB")
+    parser.add_argument("--ceiling", type=int, default=384, help="Allowed peak RSS in MiB")
+    parser.add_argument("--size", type=int, nargs=2, default=(4032, 3024), metavar=("W", "H"))
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args()
+
+    pool = RenderPool(
+        max_workers=args.workers,
+        max_pending=args.jobs,
+        budget=MemoryBudget(args.budget * 2**20),
+    )
+    with tempfile.TemporaryDirectory(prefix="prismberry-memory-") as directory:
+        paths = write_images(Path(directory), tuple(args.size))
+        pool.start()
+        time.sleep(1)
+        peak = 0
+        stop = threading.Event()
+
+        def sample():
+            nonlocal peak
+            while not stop.is_set():
+                # a worker that died is replaced, sample whichever are running
+                peak = max(peak, rss([os.getpid(), *pool.worker_pids]))
+                stop.wait(0.02)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+
+        def job(i: int):
+            entry = ImageEntry(id=str(i), name=str(i), rotation=Rotation((i % 4) * 90))
+            path = str(paths[i % len(paths)])
+            if i % 2:
+                return pool.call(render_png, path, entry.model_dump())
+            return pool.call(render_buffer, path, entry.model_dump(), pack_image)
+
+        started = time.perf_counter()
+        failures = []
+        with ThreadPoolExecutor(args.jobs) as executor:
+            for future in [executor.submit(job, i) for i in range(args.jobs)]:
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append(f"job failed: {e}")
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+        pool.shutdown()
+
+    print(
+        f"{args.jobs} jobs on {args.size[0]}x{args.size[1]} images in {elapsed:.1f}s, "
+        f"peak RSS {peak / 2**20:.0f} MiB (budget {args.budget} MiB, ceiling {args.ceiling} MiB)"
+    )
+    if peak > args.ceiling * 2**20:
+        failures.append(f"peak RSS {peak / 2**20:.0f} MiB is over the {args.ceiling} MiB ceiling")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Cost of recording metrics, enabled vs disabled.
+
+    python benchmarks/metrics_overhead.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from metrics import REGISTRY, PIPELINE_SECONDS, HTTP_SECONDS, CACHE_REQUESTS  # noqa: E402
+
+
+def timed_block():
+    with PIPELINE_SECONDS.time(stage="quantize"):
+        pass
+
+
+CASES = {
+    "histogram observe": lambda: PIPELINE_SECONDS.observe(0.3, stage="quantize"),
+    "histogram time()": timed_block,
+    "http observe": lambda: HTTP_SECONDS.observe(
+        0.01, method="GET", route="/images", status="200"
+    ),
+    "counter inc": lambda: CACHE_REQUESTS.inc(cache="fragment", result="hit"),
+}
+
+
+def main(number: int = 200_000):
+    for enabled in (True, False):
+        REGISTRY.set_enabled(enabled)
+        for name, case in CASES.items():
+            seconds = timeit.timeit(case, number=number) / number
+            print(f"{'enabled' if enabled else 'disabled':8} {name:18} {seconds * 1e6:6.2f}us")
+    REGISTRY.set_enabled(True)
+    started = timeit.default_timer()
+    REGISTRY.exposition()
+    print(f"exposition {(timeit.default_timer() - started) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
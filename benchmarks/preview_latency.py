@@ -0,0 +1,57 @@
+"""
+p99 latency of `GET /images` while previews are rendering.
+
+Start the server first, then:
+    python benchmarks/preview_latency.py --url http://raspberrypi:8000 --id <image id>
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import urllib.request
+
+
+def fetch(url: str) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--id", required=True, help="Image id to preview")
+    parser.add_argument("--previews", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    stop = time.perf_counter() + args.duration
+
+    def preview():
+        while time.perf_counter() < stop:
+            fetch(f"{args.url}/preview/{args.id}")
+
+    threads = [threading.Thread(target=preview) for _ in range(args.previews)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    while time.perf_counter() < stop:
+        latencies.append(fetch(f"{args.url}/images"))
+
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+    print(
+        f"/images n={len(latencies)} "
+        f"p50={statistics.median(latencies) * 1000:.1f}ms p99={p99 * 1000:.1f}ms "
+        f"with {args.previews} previews in flight"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Sends bursts of render requests through the render coordinator and checks
+that identical requests share one job, that the number of jobs running at
+once stays at the configured limit and that requests beyond the queue are
+rejected right away. Exits with status 1 if any of that fails.
+
+    python benchmarks/render_coordinator_check.py --tabs 20 --entries 30
+
+The jobs sleep for --job-ms in the render workers instead of rendering, so
+only the coordination is measured.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from render_pool import RenderCoordinator, RenderPool, RenderPoolFull, RenderResult  # noqa: E402
+
+
+def fake_render(key: str, delay: float) -> RenderResult:
+    time.sleep(delay)
+    return RenderResult(f"frame {key}", {"render": delay})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tabs", type=int, default=20, help="Identical requests at once")
+    parser.add_argument("--entries", type=int, default=30, help="Distinct requests at once")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=8)
+    parser.add_argument("--job-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    delay = args.job_ms / 1000
+    pool = RenderPool(max_workers=args.concurrency, max_pending=args.queue)
+    pool.start()
+    coordinator = RenderCoordinator(pool, args.concurrency, args.queue)
+    failures = []
+    peak = {"running": 0}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            peak["running"] = max(peak["running"], coordinator.in_flight)
+            stop.wait(0.005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+
+    async def identical():
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(coordinator.run("same", fake_render, "same", delay) for _ in range(args.tabs))
+        )
+        return results, time.perf_counter() - started
+
+    results, duration = asyncio.run(identical())
+    print(
+        f"{args.tabs} identical requests: {duration * 1000:.0f}ms, "
+        f"{coordinator.deduplicated} shared the first one"
+    )
+    if set(results) != {"frame same"}:
+        failures.append(f"identical requests returned {set(results)}")
+    if coordinator.deduplicated != args.tabs - 1:
+        failures.append(f"{coordinator.deduplicated} of {args.tabs - 1} requests were shared")
+    if duration > 2 * delay + 0.5:
+        failures.append(f"identical requests took {duration:.2f}s for one {delay:.2f}s job")
+
+    async def distinct():
+        async def request(index: int):
+            started = time.perf_counter()
+            try:
+                await coordinator.run(index, fake_render, str(index), delay)
+                return "ok", time.perf_counter() - started
+            except RenderPoolFull:
+                return "rejected", time.perf_counter() - started
+
+        return await asyncio.gather(*(request(index) for index in range(args.entries)))
+
+    outcomes = asyncio.run(distinct())
+    stop.set()
+    sampler.join()
+    pool.shutdown()
+
+    served = [duration for outcome, duration in outcomes if outcome == "ok"]
+    rejected = [duration for outcome, duration in outcomes if outcome == "rejected"]
+    print(
+        f"{args.entries} distinct requests: {len(served)} served, {len(rejected)} rejected "
+        f"in median {statistics.median(rejected) * 1000 if rejected else 0:.2f}ms, "
+        f"peak {peak['running']} running"
+    )
+    if len(served) != min(args.entries, args.concurrency + args.queue):
+        failures.append(f"served {len(served)} requests, expected {args.concurrency + args.queue}")
+    if rejected and max(rejected) > 0.05:
+        failures.append(f"a rejection took {max(rejected) * 1000:.0f}ms")
+    if peak["running"] > args.concurrency:
+        failures.append(f"{peak['running']} jobs ran at once, the limit is {args.concurrency}")
+    if coordinator.in_flight or coordinator.queued:
+        failures.append(f"{coordinator.in_flight} running and {coordinator.queued} queued after the burst")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Time from launching `src/main.py` until the first request is answered.
+Fails if the server does not come up, if the answer takes longer than the
+budget or if the server does not log its startup timing report with the
+time of the first request, which is also held to the budget.
+
+    python benchmarks/startup_time.py --budget 10
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+MAIN = Path(__file__).parent.parent / "src" / "main.py"
+FIRST_REQUEST = re.compile(r"^\s+first request\s+([\d.]+)ms$", re.MULTILINE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=10.0, help="Seconds until the first request is answered")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    failures = []
+    elapsed = None
+    with tempfile.TemporaryDirectory() as root:
+        env = dict(os.environ, PRISMBERRY_ROOT=root, PRISMBERRY_PORT=str(args.port))
+        log = Path(root) / "server.log"
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, str(MAIN)], env=env, stdout=subprocess.DEVNULL, stderr=log.open("w")
+        )
+        try:
+            while time.perf_counter() - started < args.budget * 3 and server.poll() is None:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{args.port}/") as response:
+                        response.read()
+                    elapsed = time.perf_counter() - started
+                    break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.05)
+        finally:
+            server.terminate()
+            server.wait()
+        output = log.read_text()
+
+    if elapsed is None:
+        failures.append("server did not come up")
+        print(output[-2000:])
+    else:
+        print(f"First request answered after {elapsed:.2f}s (budget {args.budget:.2f}s)")
+        if elapsed > args.budget:
+            failures.append(f"first request answered after {elapsed:.2f}s, budget is {args.budget:.2f}s")
+        report = output[output.find("Startup timing:") :] if "Startup timing:" in output else ""
+        first_request = FIRST_REQUEST.search(report)
+        if first_request is None:
+            failures.append("server did not log its startup timing report")
+        else:
+            print(report[: first_request.end()])
+            reported = float(first_request.group(1)) / 1000
+            if reported > args.budget:
+                failures.append(f"server reports its first request after {reported:.2f}s")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Read/write latency of the SQLite storage layer under concurrent access.
+
+Run with `--dir` pointing at the SD card to measure the real device:
+    python benchmarks/storage_bench.py --dir /home/pi/bench
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from sqlmodel import Session, select  # noqa: E402
+from models import ImageEntry  # noqa: E402
+from storage import SQLITE_PRAGMAS, create_storage_engine, init_db  # noqa: E402
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(db_file: Path, pragmas: dict, entries: int, readers: int, duration: float):
+    engine = create_storage_engine(db_file, pragmas=pragmas)
+    init_db(engine)
+    with Session(engine) as session:
+        for i in range(entries):
+            session.add(ImageEntry(id=str(uuid.uuid4()), name=f"image-{i:05d}"))
+        session.commit()
+        ids = session.exec(select(ImageEntry.id)).all()
+
+    reads: list[float] = []
+    writes: list[float] = []
+    stop = time.perf_counter() + duration
+
+    def reader():
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            with Session(engine) as session:
+                session.exec(select(ImageEntry).order_by(ImageEntry.name)).all()
+            reads.append(time.perf_counter() - started)
+
+    def writer():
+        i = 0
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            with Session(engine) as session:
+                entry = session.get(ImageEntry, ids[i % len(ids)])
+                entry.dither = not entry.dither
+                session.add(entry)
+                session.commit()
+            writes.append(time.perf_counter() - started)
+            i += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return reads, writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dir", type=Path, default=None)
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for label, pragmas in (("default", {}), ("tuned", SQLITE_PRAGMAS)):
+            reads, writes = run(
+                Path(tmp) / f"{label}.db",
+                pragmas,
+                args.entries,
+                args.readers,
+                args.duration,
+            )
+            for kind, values in (("read", reads), ("write", writes)):
+                print(
+                    f"{label:8} {kind:5} n={len(values):6d} "
+                    f"p50={statistics.median(values) * 1000:7.2f}ms "
+                    f"p99={percentile(values, 0.99) * 1000:7.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
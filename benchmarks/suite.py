@@ -0,0 +1,321 @@
+"""
+Microbenchmarks for the image pipeline, buffer packing, the display path
+and gallery rendering. Runs on plain Linux, the panel is simulated.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --save-baseline
+    python benchmarks/suite.py --check --threshold 0.2
+
+Baselines are only comparable on the machine they were recorded on,
+record them on the reference device with --save-baseline. Without a
+baseline --check warns and passes.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Callable
+
+SRC = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+BASELINE = Path(__file__).parent / "baseline.json"
+SIZES = {"vga": (640, 480), "fullhd": (1920, 1080), "12mp": (4032, 3024)}
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark. The decorated function does the setup and returns the callable to time.
+    """
+
+    def decorator(setup: Callable[[], Callable[[], object]]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+def synthetic_image(size: tuple[int, int]):
+    """
+    Deterministic test image with gradients and fine detail for the ditherer
+    """
+    from PIL import Image
+
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = Image.effect_mandelbrot(size, (-2.0, -1.5, 1.0, 1.5), 64)
+    return Image.merge("RGB", (red, green, blue))
+
+
+class SimulatedBus:
+    """
+    Stand-in for RaspberryPi in edpconfig, the panel is always idle and delays are skipped
+    """
+
+    RST_PIN = 17
+    DC_PIN = 25
+    CS_PIN = 8
+    BUSY_PIN = 24
+    PWR_PIN = 18
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def digital_write(self, pin, value):
+        pass
+
+    def digital_read(self, pin):
+        return 1
+
+    def delay_ms(self, delaytime):
+        pass
+
+    def spi_writebyte(self, data):
+        self.bytes_written += len(data)
+
+    def spi_writebyte2(self, data):
+        self.bytes_written += len(data)
+
+    def module_init(self):
+        return 0
+
+    def module_exit(self):
+        pass
+
+
+def _encoded(size: tuple[int, int], format: str) -> bytes:
+    buffered = BytesIO()
+    synthetic_image(size).save(buffered, format=format)
+    return buffered.getvalue()
+
+
+def _register_decode(label: str, size: tuple[int, int], format: str):
+    @benchmark(f"decode/{format.lower()}/{label}")
+    def setup():
+        from PIL import Image
+
+        data = _encoded(size, format)
+        return lambda: Image.open(BytesIO(data)).load()
+
+
+def _register_processor(label: str, size: tuple[int, int], dither: bool, grayscale: bool, rotation: int):
+    name = (
+        f"process/{label}/"
+        f"{'dither' if dither else 'nodither'}-{'gray' if grayscale else 'color'}-rot{rotation}"
+    )
+
+    @benchmark(name)
+    def setup():
+        from image_processor import ImageProcessor
+        from models import ImageEntry, Rotation
+
+        processor = ImageProcessor()
+        image = synthetic_image(size)
+        entry = ImageEntry(
+            id="bench",
+            name="bench",
+            dither=dither,
+            grayscale=grayscale,
+            rotation=Rotation(rotation),
+        )
+        return lambda: processor(image.copy(), entry)
+
+
+for label, size in SIZES.items():
+    for format in ("JPEG", "PNG"):
+        _register_decode(label, size, format)
+    for dither in (True, False):
+        for grayscale in (False, True):
+            for rotation in (0, 90, 180, 270):
+                _register_processor(label, size, dither, grayscale, rotation)
+
+
+def _processed_frame():
+    from image_processor import ImageProcessor
+    from models import ImageEntry
+
+    return ImageProcessor()(synthetic_image(SIZES["fullhd"]), ImageEntry(id="bench", name="bench"))
+
+
+@benchmark("pack/4bpp")
+def setup_pack():
+    from display.edp import pack_image
+
+    frame = _processed_frame()
+    return lambda: pack_image(frame)
+
+
+@benchmark("display/simulated-bus")
+def setup_display():
+    from display.edp import EPD7IN3F
+
+    frame = _processed_frame()
+    display = EPD7IN3F(driver=SimulatedBus())
+
+    def run():
+        display.init()
+        display.display(display.get_buffer(frame))
+        display.sleep()
+
+    return run
+
+
+DASHBOARDS = Path(__file__).parent.parent / "dashboards"
+
+
+@benchmark("dashboard/cold")
+def setup_dashboard_cold():
+    from dashboard import Dashboards
+
+    def run():
+        # new caches every time: rasterize all glyphs and draw the static layer
+        return Dashboards(DASHBOARDS).render_buffer("clock")
+
+    return run
+
+
+@benchmark("dashboard/warm")
+def setup_dashboard_warm():
+    from datetime import datetime, timedelta
+    from dashboard import Dashboards
+
+    dashboards = Dashboards(DASHBOARDS)
+    minutes = iter(range(10**9))
+    start = datetime(2024, 1, 1)
+    dashboards.render_buffer("clock", start)
+
+    # a refresh where only the clock changed
+    return lambda: dashboards.render_buffer("clock", start + timedelta(minutes=next(minutes) + 1))
+
+
+def _gallery_entries(count: int):
+    from models import ImageEntry
+
+    return [ImageEntry(id=f"{i:08d}", name=f"Image {i}") for i in range(count)]
+
+
+def _import_main():
+    # main creates its data directories on import, keep them out of the repo
+    os.environ.setdefault("PRISMBERRY_ROOT", tempfile.mkdtemp(prefix="prismberry-bench-"))
+    import main
+
+    return main
+
+
+@benchmark("gallery/render-500")
+def setup_gallery():
+    from fasthtml.common import Div, to_xml
+
+    main = _import_main()
+    entries = _gallery_entries(500)
+    return lambda: to_xml(Div(*[main.render_image(entry) for entry in entries]))
+
+
+@benchmark("gallery/cached-500")
+def setup_gallery_cached():
+    from fasthtml.common import Div, to_xml
+    from fragment_cache import FragmentCache
+
+    main = _import_main()
+    cache = FragmentCache()
+    entries = _gallery_entries(500)
+
+    def run():
+        version = cache.version("images")
+        return to_xml(
+            Div(
+                *[
+                    cache.fragment("images", version, entry.id, lambda e=entry: main.render_image(e))
+                    for entry in entries
+                ]
+            )
+        )
+
+    return run
+
+
+def measure(run: Callable[[], object], repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def check(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result["median"] / reference["median"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {reference['median'] * 1000:.2f}ms -> {result['median'] * 1000:.2f}ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run benchmarks containing this string")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Fail if a benchmark regressed")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.repeat, args.warmup)
+        print(f"{name:48} {results[name]['median'] * 1000:10.2f}ms")
+
+    report = {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())["results"] if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps({**report, "results": baseline}, indent=2))
+        print(f"Saved baseline to {args.baseline}")
+    if args.check:
+        if not args.baseline.exists():
+            # baselines are per device, a fresh checkout has nothing to compare against yet
+            print(f"WARNING: no baseline at {args.baseline}, nothing checked. Record one with --save-baseline")
+            return
+        regressions = check(results, json.loads(args.baseline.read_text())["results"], args.threshold)
+        if regressions:
+            print("Regressions:")
+            print("\n".join(f"  {line}" for line in regressions))
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -48,6 +48,11 @@ else
     echo "Requirements file not found!"
 fi
 
+# Download the UI assets once and build them, the UI must load without internet access
+echo "Building UI assets..."
+pip install "brotli>=1.1.0" "fonttools>=4.47.0" || echo "Building UI assets without brotli and font subsetting"
+python ./src/assets.py || echo "Building UI assets failed, the UI loads them from CDNs"
+
 # Run the Python script
 echo "Running Python script..."
 python $PYTHON_SCRIPT
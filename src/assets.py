@@ -0,0 +1,287 @@
+"""
+Builds the UI assets served by the Pi itself, so the UI loads on networks
+without internet access.
+
+    python src/assets.py
+
+Downloads the pinned htmx, htmx SSE extension, Pico CSS and Font Awesome
+files into assets/vendor once, then builds assets/dist from them: Font
+Awesome reduced to the icons used in src, every file fingerprinted with its
+content hash and precompressed with gzip and, if the brotli package is
+installed, brotli. Subsetting the icon fonts needs fonttools and brotli,
+without them the full fonts are used. Nothing is rebuilt while the sources
+and the icons are unchanged.
+"""
+
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    subset = None
+
+logger = logging.getLogger("uvicorn.error")
+
+ROOT = Path(os.environ.get("PRISMBERRY_ROOT", Path(__file__).parent.parent))
+VENDOR_DIR = ROOT / "assets" / "vendor"
+DIST_DIR = ROOT / "assets" / "dist"
+MANIFEST = "manifest.json"
+
+FONT_AWESOME = "https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@6.6.0"
+# name in the vendor directory -> pinned upstream URL, also used while no build exists
+SOURCES = {
+    "htmx.js": "https://cdn.jsdelivr.net/npm/htmx.org@2.0.7/dist/htmx.min.js",
+    "sse.js": "https://cdn.jsdelivr.net/npm/htmx-ext-sse@2.2.2/sse.js",
+    "pico.css": "https://cdn.jsdelivr.net/npm/@picocss/pico@2.0.6/css/pico.min.css",
+    "fontawesome.css": f"{FONT_AWESOME}/css/all.min.css",
+    "fa-solid-900.woff2": f"{FONT_AWESOME}/webfonts/fa-solid-900.woff2",
+    "fa-brands-400.woff2": f"{FONT_AWESOME}/webfonts/fa-brands-400.woff2",
+}
+# font family and weight of the @font-face rules that are kept, the icons use no other styles
+FONTS = {
+    ("Font Awesome 6 Free", "900"): "fa-solid-900.woff2",
+    ("Font Awesome 6 Brands", "400"): "fa-brands-400.woff2",
+}
+MEDIA_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".woff2": "font/woff2",
+}
+# fonts are already compressed
+PRECOMPRESS = {".css", ".js"}
+
+_ICON = re.compile(r"\bfa-[a-z0-9-]+")
+_GLYPH = re.compile(r"\.(fa-[a-z0-9-]+):(?:before|after)")
+_CONTENT = re.compile(r'content:\s*"\\([0-9a-f]+)"')
+
+
+def fetch(vendor: Path = VENDOR_DIR):
+    """
+    Download the sources that are not in `vendor` yet, needs internet access once
+    """
+    vendor.mkdir(parents=True, exist_ok=True)
+    for name, url in SOURCES.items():
+        path = vendor / name
+        if path.exists():
+            continue
+        logger.info(f"Downloading {url}")
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        partial = path.with_suffix(".part")
+        partial.write_bytes(data)
+        partial.replace(path)
+
+
+def used_icons(source: Path) -> set[str]:
+    """
+    Every fa-* class named in the code and templates below `source`
+    """
+    icons = set()
+    for path in source.rglob("*"):
+        if path.suffix in (".py", ".html") and "__pycache__" not in path.parts:
+            icons.update(_ICON.findall(path.read_text(errors="ignore")))
+    return icons
+
+
+def _blocks(css: str) -> list[str]:
+    """
+    Top level rules and at-rules of minified CSS, nested blocks stay in their parent
+    """
+    blocks = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(css):
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append(css[start : index + 1].strip())
+                start = index + 1
+    return blocks
+
+
+def subset_css(css: str, icons: set[str], fonts: dict[str, str]) -> tuple[str, set[int]]:
+    """
+    Font Awesome CSS with only the glyph rules of `icons` and the @font-face
+    rules of FONTS pointing at `fonts`, returns it with the used code points
+    """
+    kept = []
+    codepoints = set()
+    header = css[: css.index("*/") + 2] if css.startswith("/*") else ""
+    for block in _blocks(css[len(header) :]):
+        selectors, _, body = block.partition("{")
+        if selectors.startswith("@font-face"):
+            family = re.search(r'font-family:\s*"([^"]+)"', body)
+            weight = re.search(r"font-weight:\s*(\d+)", body)
+            font = FONTS.get((family and family.group(1), weight and weight.group(1)))
+            if font is not None and font in fonts:
+                body = re.sub(r"src:[^;}]+", f'src:url({fonts[font]}) format("woff2")', body)
+                kept.append(f"{selectors}{{{body}")
+            continue
+        names = _GLYPH.findall(selectors)
+        content = _CONTENT.search(body)
+        # a glyph rule names its icon and aliases, each with their own code point
+        if content and names and len(names) == len(selectors.split(",")):
+            used = [selector for selector, name in zip(selectors.split(","), names) if name in icons]
+            if used:
+                kept.append(f"{','.join(used)}{{{body}")
+                codepoints.add(int(content.group(1), 16))
+            continue
+        kept.append(block)
+    return header + "\n" + "".join(kept), codepoints
+
+
+def subset_font(data: bytes, codepoints: set[int]) -> bytes:
+    """
+    The woff2 font reduced to `codepoints`, unchanged without fonttools and brotli
+    """
+    # woff2 is brotli compressed
+    if subset is None or brotli is None:
+        return data
+    font = TTFont(BytesIO(data))
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = []
+    options.name_IDs = []
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    output = BytesIO()
+    font.flavor = "woff2"
+    font.save(output)
+    return output.getvalue()
+
+
+def fingerprint(name: str, data: bytes) -> str:
+    stem, suffix = name.rsplit(".", 1)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}.{suffix}"
+
+
+def _write(dist: Path, name: str, data: bytes) -> str:
+    file = fingerprint(name, data)
+    (dist / file).write_bytes(data)
+    if Path(name).suffix in PRECOMPRESS:
+        (dist / f"{file}.gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            (dist / f"{file}.br").write_bytes(brotli.compress(data, quality=11))
+    return file
+
+
+def build(vendor: Path = VENDOR_DIR, dist: Path = DIST_DIR, icons: Optional[set[str]] = None) -> dict:
+    """
+    Build `dist` from the sources in `vendor`, returns the manifest mapping
+    asset names to fingerprinted files
+    """
+    icons = used_icons(Path(__file__).parent) if icons is None else icons
+    sources = {name: (vendor / name).read_bytes() for name in SOURCES}
+    digest = hashlib.sha256()
+    for name, data in sorted(sources.items()):
+        digest.update(name.encode() + data)
+    digest.update(" ".join(sorted(icons)).encode())
+    # brotli or fonttools being installed later changes the output too
+    digest.update(f"{brotli is not None} {subset is not None}".encode())
+    stamp = digest.hexdigest()
+
+    manifest_path = dist / MANIFEST
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("stamp") == stamp:
+            return manifest
+
+    staging = dist.with_name(dist.name + ".new")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    # the glyphs come from the CSS, the CSS needs the names of the fonts
+    css, codepoints = subset_css(
+        sources["fontawesome.css"].decode(), icons, {font: font for font in FONTS.values()}
+    )
+    files = {}
+    for font in FONTS.values():
+        files[font] = _write(staging, font, subset_font(sources[font], codepoints))
+    css, _ = subset_css(sources["fontawesome.css"].decode(), icons, files)
+    files["fontawesome.css"] = _write(staging, "fontawesome.css", css.encode())
+    for name in ("htmx.js", "sse.js", "pico.css"):
+        files[name] = _write(staging, name, sources[name])
+    manifest = {"stamp": stamp, "files": files}
+    (staging / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    # swapped in whole, a running server never sees a partial build
+    shutil.rmtree(dist, ignore_errors=True)
+    staging.replace(dist)
+    logger.info(f"Built {len(files)} assets with {len(codepoints)} icons into {dist}")
+    return manifest
+
+
+class Assets:
+    """
+    The built assets by name. Without a build the pinned upstream URLs are
+    used, which needs internet access in the browser.
+    """
+
+    def __init__(self, dist: Path = DIST_DIR):
+        self.dist = dist
+        manifest = dist / MANIFEST
+        self.files: dict[str, str] = (
+            json.loads(manifest.read_text())["files"] if manifest.exists() else {}
+        )
+        self._served = set(self.files.values())
+        if not self.files:
+            logger.warning("UI assets are not built, loading them from CDNs. Run src/assets.py")
+
+    @property
+    def built(self) -> bool:
+        return bool(self.files)
+
+    def url(self, name: str) -> str:
+        if name in self.files:
+            return f"/assets/{self.files[name]}"
+        return SOURCES[name]
+
+    def resolve(self, file: str, accept_encoding: str) -> Optional[tuple[Path, str, Optional[str]]]:
+        """
+        Path, media type and content encoding of the best variant of a built
+        file for the client, None for files that are not part of the build
+        """
+        if file not in self._served:
+            return None
+        path = self.dist / file
+        media_type = MEDIA_TYPES.get(path.suffix, "application/octet-stream")
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accept_encoding and path.with_name(file + suffix).exists():
+                return path.with_name(file + suffix), media_type, encoding
+        return path, media_type, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vendor", type=Path, default=VENDOR_DIR, help="Downloaded upstream files")
+    parser.add_argument("--dist", type=Path, default=DIST_DIR, help="Output directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+    fetch(args.vendor)
+    manifest = build(args.vendor, args.dist)
+    for name, file in manifest["files"].items():
+        print(f"{name:20} {file:36} {(args.dist / file).stat().st_size:>8} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Optional
+import json
+
+# Pillow is imported when the first dashboard is rendered
+if TYPE_CHECKING:
+    from PIL import Image
+    from PIL.ImageFont import FreeTypeFont
+
+# palette indices of the panel, see image_processor.PALETTE
+COLORS = {
+    "black": 0,
+    "white": 1,
+    "green": 2,
+    "blue": 3,
+    "red": 4,
+    "yellow": 5,
+    "orange": 6,
+}
+
+Box = tuple[int, int, int, int]
+
+
+@dataclass
+class Glyph:
+    # 1 bit mask, None for blank characters like spaces
+    mask: Optional["Image.Image"]
+    offset: tuple[int, int]
+    advance: float
+
+
+def _union(a: Box, b: Box) -> Box:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class GlyphCache:
+    """
+    Rasterized glyphs per font, size and character. Glyphs are thresholded
+    to 1 bit so text is drawn in pure panel colors without dithering.
+    """
+
+    def __init__(self, max_glyphs: int = 4096):
+        self.max_glyphs = max_glyphs
+        self._fonts: dict[tuple[Optional[str], int], "FreeTypeFont"] = {}
+        self._glyphs: OrderedDict[tuple[Optional[str], int, str], Glyph] = OrderedDict()
+
+    def font(self, path: Optional[str], size: int) -> "FreeTypeFont":
+        from PIL import ImageFont
+
+        key = (path, size)
+        if key not in self._fonts:
+            self._fonts[key] = (
+                ImageFont.truetype(path, size) if path else ImageFont.load_default(size)
+            )
+        return self._fonts[key]
+
+    def glyph(self, path: Optional[str], size: int, char: str) -> Glyph:
+        from PIL import Image, ImageDraw
+
+        key = (path, size, char)
+        glyph = self._glyphs.get(key)
+        if glyph is not None:
+            self._glyphs.move_to_end(key)
+            return glyph
+        font = self.font(path, size)
+        left, top, right, bottom = font.getbbox(char)
+        mask = None
+        if right > left and bottom > top:
+            mask = Image.new("L", (right - left, bottom - top))
+            ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+            mask = mask.point(lambda value: 255 if value >= 128 else 0, "1")
+        glyph = Glyph(mask, (left, top), font.getlength(char))
+        self._glyphs[key] = glyph
+        if len(self._glyphs) > self.max_glyphs:
+            self._glyphs.popitem(last=False)
+        return glyph
+
+    def measure(self, xy: tuple[int, int], text: str, path: Optional[str], size: int) -> Box:
+        x, y = xy
+        box = None
+        for char in text:
+            glyph = self.glyph(path, size, char)
+            if glyph.mask is not None:
+                left, top = round(x) + glyph.offset[0], y + glyph.offset[1]
+                glyph_box = (left, top, left + glyph.mask.width, top + glyph.mask.height)
+                box = glyph_box if box is None else _union(box, glyph_box)
+            x += glyph.advance
+        return box or (xy[0], xy[1], xy[0], xy[1])
+
+    def draw(
+        self,
+        canvas: "Image.Image",
+        xy: tuple[int, int],
+        text: str,
+        path: Optional[str],
+        size: int,
+        color: int,
+    ):
+        x, y = xy
+        for char in text:
+            glyph = self.glyph(path, size, char)
+            if glyph.mask is not None:
+                canvas.paste(
+                    color, (round(x) + glyph.offset[0], y + glyph.offset[1]), glyph.mask
+                )
+            x += glyph.advance
+
+
+class Dashboard:
+    """
+    Template driven frame drawn directly in the panel palette. Elements
+    without placeholders are drawn once into a static layer, on every
+    render only the regions of changed text are restored and redrawn.
+
+    Template, a JSON file:
+
+        {
+            "background": "white",
+            "data": "data/weather.json",
+            "elements": [
+                {"type": "box", "box": [0, 0, 800, 80], "fill": "black"},
+                {"type": "text", "xy": [20, 10], "text": "{now:%A %d %B}", "size": 48, "color": "white"},
+                {"type": "text", "xy": [20, 120], "text": "{data[temperature]} C", "size": 96, "color": "red"},
+                {"type": "icon", "xy": [720, 8], "path": "sun.png"}
+            ]
+        }
+
+    Text is formatted with `now`, the current time, and `data`, the content
+    of the optional JSON data file, relative to the template. Text with
+    placeholders is always drawn on top of the static elements.
+    """
+
+    def __init__(self, path: Path, glyphs: GlyphCache, size: tuple[int, int] = (800, 480)):
+        self.path = path
+        self.glyphs = glyphs
+        self.size = size
+        self._mtime: Optional[float] = None
+        self._template: dict[str, Any] = {}
+        self._data: tuple[Optional[float], Any] = (None, {})
+        self._static: Optional["Image.Image"] = None
+        self._frame: Optional["Image.Image"] = None
+        # element index -> drawn text and its bounding box
+        self._drawn: dict[int, tuple[str, Box]] = {}
+
+    def _load(self):
+        mtime = self.path.stat().st_mtime
+        if mtime != self._mtime:
+            self._template = json.loads(self.path.read_text())
+            self._mtime = mtime
+            self._static = None
+
+    def _load_data(self) -> Any:
+        name = self._template.get("data")
+        if not name:
+            return {}
+        path = self.path.parent / name
+        mtime = path.stat().st_mtime if path.exists() else None
+        if mtime != self._data[0]:
+            self._data = (mtime, json.loads(path.read_text()) if mtime else {})
+        return self._data[1]
+
+    @staticmethod
+    def _dynamic(element: dict[str, Any]) -> bool:
+        return element.get("type") == "text" and "{" in element.get("text", "")
+
+    def _icon(self, element: dict[str, Any]) -> "Image.Image":
+        from PIL import Image
+        from image_processor import PALETTE
+
+        palette = Image.new("P", (1, 1))
+        palette.putpalette(PALETTE)
+        with Image.open(self.path.parent / element["path"]) as icon:
+            return icon.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE)
+
+    def _draw_static(self) -> "Image.Image":
+        from PIL import Image, ImageDraw
+        from image_processor import PALETTE
+
+        static = Image.new("P", self.size, COLORS[self._template.get("background", "white")])
+        static.putpalette(PALETTE)
+        draw = ImageDraw.Draw(static)
+        for element in self._template.get("elements", []):
+            if self._dynamic(element):
+                continue
+            kind = element.get("type")
+            if kind == "box":
+                draw.rectangle(
+                    element["box"],
+                    fill=COLORS[element["fill"]] if "fill" in element else None,
+                    outline=COLORS[element["outline"]] if "outline" in element else None,
+                    width=element.get("width", 1),
+                )
+            elif kind == "text":
+                self.glyphs.draw(
+                    static,
+                    tuple(element["xy"]),
+                    element["text"],
+                    element.get("font"),
+                    element.get("size", 24),
+                    COLORS[element.get("color", "black")],
+                )
+            elif kind == "icon":
+                static.paste(self._icon(element), tuple(element["xy"]))
+        return static
+
+    def render(self, now: Optional[datetime] = None) -> tuple["Image.Image", list[Box]]:
+        """
+        The current frame and the regions redrawn for it
+        """
+        self._load()
+        if self._static is None:
+            self._static = self._draw_static()
+            self._frame = self._static.copy()
+            self._drawn = {}
+        context = {"now": now or datetime.now(), "data": self._load_data()}
+
+        elements = [
+            (index, element)
+            for index, element in enumerate(self._template.get("elements", []))
+            if self._dynamic(element)
+        ]
+        texts: dict[int, tuple[str, Box]] = {}
+        dirty: list[Box] = []
+        for index, element in elements:
+            text = element["text"].format_map(context)
+            drawn = self._drawn.get(index)
+            if drawn is not None and drawn[0] == text:
+                texts[index] = drawn
+                continue
+            box = self.glyphs.measure(
+                tuple(element["xy"]), text, element.get("font"), element.get("size", 24)
+            )
+            texts[index] = (text, box)
+            dirty.append(box if drawn is None else _union(box, drawn[1]))
+
+        width, height = self.size
+        dirty = [
+            (max(0, box[0]), max(0, box[1]), min(width, box[2]), min(height, box[3]))
+            for box in dirty
+        ]
+        dirty = [box for box in dirty if box[2] > box[0] and box[3] > box[1]]
+        for box in dirty:
+            self._frame.paste(self._static.crop(box), box[:2])
+        # overlapping text has to be redrawn as well, restoring a region erased it
+        for index, element in elements:
+            text, box = texts[index]
+            if self._drawn.get(index) == texts[index] and not any(
+                _intersects(box, region) for region in dirty
+            ):
+                continue
+            self.glyphs.draw(
+                self._frame,
+                tuple(element["xy"]),
+                text,
+                element.get("font"),
+                element.get("size", 24),
+                COLORS[element.get("color", "black")],
+            )
+        self._drawn = texts
+        return self._frame, dirty
+
+
+class Dashboards:
+    """
+    The dashboard templates in `directory`, sharing one glyph cache
+    """
+
+    def __init__(self, directory: Path, size: tuple[int, int] = (800, 480)):
+        self.directory = directory
+        self.size = size
+        self.glyphs = GlyphCache()
+        self._lock = Lock()
+        self._dashboards: dict[str, Dashboard] = {}
+
+    def names(self) -> list[str]:
+        """
+        Templates are the JSON files directly in the directory, keep data files in a subdirectory
+        """
+        if not self.directory.exists():
+            return []
+        return sorted(path.stem for path in self.directory.glob("*.json"))
+
+    def _dashboard(self, name: str) -> Dashboard:
+        if name not in self._dashboards:
+            path = self.directory / f"{name}.json"
+            if not path.is_file():
+                raise KeyError(f"No dashboard named {name}")
+            self._dashboards[name] = Dashboard(path, self.glyphs, self.size)
+        return self._dashboards[name]
+
+    def render(self, name: str, now: Optional[datetime] = None) -> "Image.Image":
+        with self._lock:
+            frame, _ = self._dashboard(name).render(now)
+            return frame.copy()
+
+    def render_buffer(self, name: str, now: Optional[datetime] = None) -> bytes:
+        """
+        The dashboard packed to 4 bits per pixel, two pixels per byte with the first in the high nibble
+        """
+        with self._lock:
+            frame, _ = self._dashboard(name).render(now)
+            return frame.tobytes("raw", "P;4")
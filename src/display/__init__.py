@@ -1 +1,18 @@
 from .base import Display, DummyDisplay
+import os
+
+
+def load_display() -> Display:
+    """
+    Initialize the e-paper display, falls back to a dummy display if the hardware is unavailable.
+    Set PRISMBERRY_DISPLAY=dummy to always use the dummy display.
+    """
+    if os.environ.get("PRISMBERRY_DISPLAY") == "dummy":
+        return DummyDisplay()
+    try:
+        from .edp import EPD7IN3F
+
+        return EPD7IN3F()
+    except Exception as e:
+        print(f"Error loading display: {e}")
+        return DummyDisplay()
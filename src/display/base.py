@@ -1,7 +1,15 @@
 from abc import ABC, abstractmethod
-from PIL import Image
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Sequence
 import logging
 
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+def blank_buffer(image: "Image", width: int, height: int) -> list[int]:
+    return [0] * width * height
+
 
 class Display(ABC):
     def __init__(self, width: int, height: int):
@@ -23,19 +31,25 @@ class Display(ABC):
         pass
 
     @abstractmethod
-    def display(self, image_data: list[int]):
+    def display(self, image_data: Sequence[int]):
         """
         Display the image on the display
         """
         pass
 
     @abstractmethod
-    def get_buffer(self, image: Image) -> list[int]:
+    def get_buffer(self, image: "Image") -> list[int]:
         """
         Convert the image to the display buffer
         """
         pass
 
+    def buffer_packer(self) -> Callable[["Image"], list[int]]:
+        """
+        Picklable equivalent of `get_buffer` for use in worker processes
+        """
+        return self.get_buffer
+
     @abstractmethod
     def sleep(self):
         """
@@ -55,12 +69,15 @@ class DummyDisplay(Display):
     def clear(self):
         self.logger.info("Dummy display cleared")
 
-    def display(self, image_data: list[int]):
+    def display(self, image_data: Sequence[int]):
         self.logger.info("Dummy display showing image")
 
-    def get_buffer(self, image: Image) -> list[int]:
+    def get_buffer(self, image: "Image") -> list[int]:
         self.logger.info("Dummy display getting buffer")
-        return [0] * self.width * self.height
+        return blank_buffer(image, self.width, self.height)
+
+    def buffer_packer(self) -> Callable[["Image"], list[int]]:
+        return partial(blank_buffer, width=self.width, height=self.height)
 
     def sleep(self):
         self.logger.info("Dummy display going to sleep")
@@ -30,10 +30,14 @@
 #
 
 import logging
+from typing import TYPE_CHECKING, Callable, Sequence
 from .base import Display
 from .edpconfig import RaspberryPi
+from profiling import span
 
-from PIL import Image
+# Pillow is only needed for the annotations, thin fleet clients run without it
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Display resolution
 EPD_WIDTH = 800
@@ -42,14 +46,28 @@ EPD_HEIGHT = 480
 logger = logging.getLogger("uvicorn.error")
 
 
+def pack_image(image: "Image") -> list[int]:
+    buf_7color = bytearray(image.tobytes("raw"))
+
+    # PIL does not support 4 bit color, so pack the 4 bits of color
+    # into a single byte to transfer to the panel
+    buf = [0x00] * int(EPD_WIDTH * EPD_HEIGHT / 2)
+    idx = 0
+    for i in range(0, len(buf_7color), 2):
+        buf[idx] = (buf_7color[i] << 4) + buf_7color[i + 1]
+        idx += 1
+
+    return buf
+
+
 class EPD7IN3F(Display):
     """e-Paper 7.3" (800x480) display driver
     Wiki: https://www.waveshare.com/wiki/7.3inch_e-Paper_HAT_(F)
     """
 
-    def __init__(self):
+    def __init__(self, driver=None):
         super().__init__(EPD_WIDTH, EPD_HEIGHT)
-        self.driver = RaspberryPi()
+        self.driver = driver or RaspberryPi()
         self.reset_pin = self.driver.RST_PIN
         self.dc_pin = self.driver.DC_PIN
         self.busy_pin = self.driver.BUSY_PIN
@@ -87,7 +105,8 @@ class EPD7IN3F(Display):
     def send_data2(self, data):
         self.driver.digital_write(self.dc_pin, 1)
         self.driver.digital_write(self.cs_pin, 0)
-        self.driver.spi_writebyte2(data)
+        with span("spi"):
+            self.driver.spi_writebyte2(data)
         self.driver.digital_write(self.cs_pin, 1)
 
     def ReadBusyH(self):
@@ -98,15 +117,18 @@ class EPD7IN3F(Display):
 
     def TurnOnDisplay(self):
         self.send_command(0x04)  # POWER_ON
-        self.ReadBusyH()
+        with span("busy_power_on"):
+            self.ReadBusyH()
 
         self.send_command(0x12)  # DISPLAY_REFRESH
         self.send_data(0x00)
-        self.ReadBusyH()
+        with span("busy_refresh"):
+            self.ReadBusyH()
 
         self.send_command(0x02)  # POWER_OFF
         self.send_data(0x00)
-        self.ReadBusyH()
+        with span("busy_power_off"):
+            self.ReadBusyH()
 
     def init(self):
         if self.driver.module_init() != 0:
@@ -202,20 +224,14 @@ class EPD7IN3F(Display):
         self.send_data(0x00)
         return 0
 
-    def get_buffer(self, image: Image) -> list[int]:
-        buf_7color = bytearray(image.tobytes("raw"))
-
-        # PIL does not support 4 bit color, so pack the 4 bits of color
-        # into a single byte to transfer to the panel
-        buf = [0x00] * int(self.width * self.height / 2)
-        idx = 0
-        for i in range(0, len(buf_7color), 2):
-            buf[idx] = (buf_7color[i] << 4) + buf_7color[i + 1]
-            idx += 1
+    def get_buffer(self, image: "Image") -> list[int]:
+        with span("pack"):
+            return pack_image(image)
 
-        return buf
+    def buffer_packer(self) -> Callable[["Image"], list[int]]:
+        return pack_image
 
-    def display(self, image_data: list[int]):
+    def display(self, image_data: Sequence[int]):
         self.send_command(0x10)
         self.send_data2(image_data)
         self.TurnOnDisplay()
@@ -227,11 +243,12 @@ class EPD7IN3F(Display):
         self.TurnOnDisplay()
 
     def sleep(self):
-        self.send_command(0x07)  # DEEP_SLEEP
-        self.send_data(0xA5)
+        with span("sleep"):
+            self.send_command(0x07)  # DEEP_SLEEP
+            self.send_data(0xA5)
 
-        self.driver.delay_ms(2000)
-        self.driver.module_exit()
+            self.driver.delay_ms(2000)
+            self.driver.module_exit()
 
 
 ### END OF FILE ###
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import asyncio
+
+
+class EventBusFull(Exception):
+    pass
+
+
+class _Client:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.ready = asyncio.Event()
+        # key -> preformatted message, oldest first
+        self.pending: OrderedDict[str, str] = OrderedDict()
+
+
+class EventBus:
+    """
+    Fans out server-sent events to connected browsers. Each client buffers
+    at most `max_buffered` messages and keeps only the latest one per key,
+    a slow client skips intermediate states instead of growing the buffer.
+    """
+
+    def __init__(self, max_buffered: int = 16, max_clients: int = 32, keepalive: float = 15.0):
+        self.max_buffered = max_buffered
+        self.max_clients = max_clients
+        self.keepalive = keepalive
+        self._lock = Lock()
+        self._clients: list[_Client] = []
+        self._closed = False
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    def publish(self, message: str, key: str):
+        """
+        Queue a formatted SSE message for every client, safe to call from any thread
+        """
+        with self._lock:
+            clients = list(self._clients)
+            for client in clients:
+                client.pending.pop(key, None)
+                client.pending[key] = message
+                while len(client.pending) > self.max_buffered:
+                    client.pending.popitem(last=False)
+        for client in clients:
+            client.loop.call_soon_threadsafe(client.ready.set)
+
+    def close(self):
+        """
+        End all streams, called on shutdown so open connections don't block it
+        """
+        with self._lock:
+            self._closed = True
+            clients = list(self._clients)
+        for client in clients:
+            client.loop.call_soon_threadsafe(client.ready.set)
+
+    def _attach(self) -> _Client:
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                raise EventBusFull("Too many open event streams")
+            client = _Client(asyncio.get_running_loop())
+            self._clients.append(client)
+            return client
+
+    def _detach(self, client: _Client):
+        with self._lock:
+            self._clients.remove(client)
+
+    def _drain(self, client: _Client) -> list[str]:
+        with self._lock:
+            messages = list(client.pending.values())
+            client.pending.clear()
+            client.ready.clear()
+            return messages
+
+    def stream(
+        self,
+        disconnected: Callable[[], Awaitable[bool]],
+        initial: Optional[list[str]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Messages for a new client starting with `initial`. Raises EventBusFull
+        right away, before the response has started.
+        """
+        client = self._attach()
+
+        async def messages() -> AsyncIterator[str]:
+            try:
+                for message in initial or []:
+                    yield message
+                while not self._closed and not await disconnected():
+                    try:
+                        await asyncio.wait_for(client.ready.wait(), self.keepalive)
+                    except asyncio.TimeoutError:
+                        # comment line, keeps proxies from closing the connection
+                        yield ": keepalive\n\n"
+                        continue
+                    for message in self._drain(client):
+                        yield message
+            finally:
+                self._detach(client)
+
+        return messages()
@@ -0,0 +1,117 @@
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Optional
+import asyncio
+import math
+import time
+import zlib
+
+
+class FleetFull(Exception):
+    pass
+
+
+@dataclass
+class PanelFrame:
+    """
+    A packed frame published for one panel, kept both raw and zlib compressed
+    """
+
+    name: str
+    entry_id: Optional[str]
+    buffer: bytes
+    compressed: bytes
+    etag: str
+    # time.time() after which the next pull advances the panel
+    due: float
+
+
+@dataclass
+class Panel:
+    name: str
+    frame: Optional[PanelFrame] = None
+    last_seen: float = 0.0
+    pulls: int = 0
+    not_modified: int = 0
+    # serializes rendering, concurrent pulls of one panel advance it once
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+class Fleet:
+    """
+    The current frame of every panel pulling from this server. A panel
+    advances to its next frame on the first pull after the frame is due.
+    """
+
+    def __init__(self, max_panels: int = 64):
+        self.max_panels = max_panels
+        self._lock = Lock()
+        self._panels: dict[str, Panel] = {}
+
+    def panel(self, name: str) -> Panel:
+        """
+        The panel called `name`, registered on its first pull
+        """
+        with self._lock:
+            panel = self._panels.get(name)
+            if panel is None:
+                if len(self._panels) >= self.max_panels:
+                    raise FleetFull(f"{self.max_panels} panels are already registered")
+                panel = self._panels[name] = Panel(name)
+            panel.last_seen = time.time()
+            panel.pulls += 1
+            return panel
+
+    def panels(self) -> list[Panel]:
+        with self._lock:
+            return sorted(self._panels.values(), key=lambda panel: panel.name)
+
+    @staticmethod
+    def due(panel: Panel) -> bool:
+        return panel.frame is None or time.time() >= panel.frame.due
+
+    def publish(
+        self,
+        panel: Panel,
+        name: str,
+        entry_id: Optional[str],
+        buffer: bytes,
+        compressed: bytes,
+        interval: Optional[float],
+    ) -> PanelFrame:
+        """
+        Make `buffer` the current frame of `panel` for `interval` seconds, forever with None
+        """
+        # content addressed, picking the same image again is not modified for the panel
+        etag = f'"{zlib.crc32(buffer):08x}"'
+        due = time.time() + interval if interval is not None else math.inf
+        frame = PanelFrame(name, entry_id, buffer, compressed, etag, due)
+        with self._lock:
+            panel.frame = frame
+        return frame
+
+    def postpone(self, panel: Panel, due: float):
+        """
+        Keep the current frame of `panel` until `due`
+        """
+        with self._lock:
+            if panel.frame is not None:
+                panel.frame.due = due
+
+    def invalidate_all(self):
+        """
+        Advance every panel on its next pull, after settings that choose the frames changed
+        """
+        with self._lock:
+            for panel in self._panels.values():
+                if panel.frame is not None:
+                    panel.frame.due = 0.0
+
+    def invalidate(self, entry_id: str):
+        """
+        Advance the panels showing `entry_id` on their next pull
+        """
+        with self._lock:
+            for panel in self._panels.values():
+                if panel.frame is not None and panel.frame.entry_id == entry_id:
+                    panel.frame.due = 0.0
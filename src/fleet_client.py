@@ -0,0 +1,200 @@
+"""
+Thin client for fleet mode. Pulls the packed frames a central prismberry
+server renders for this panel and only drives the display, it needs
+neither the web app, the database nor Pillow.
+
+    python src/fleet_client.py --server http://192.168.1.10:8000 --panel kitchen
+
+Received frames are cached on disk. While the server is unreachable the
+panel keeps cycling through the cached frames every --offline-interval seconds.
+Set PRISMBERRY_DISPLAY=dummy to run it without a panel.
+"""
+
+from http.client import HTTPMessage
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote, unquote
+import argparse
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+from display import Display, load_display
+from frame_ingest import InvalidFrame, decompress, validate_packed
+
+
+class FrameCache:
+    """
+    Compressed frames by ETag, the most recently shown one has the newest mtime
+    """
+
+    def __init__(self, directory: Path, keep: int = 16):
+        self.directory = directory
+        self.keep = keep
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, etag: str) -> Path:
+        name = etag.strip('"')
+        # the server sends hex digests, anything else must not become a path
+        if not name.isalnum():
+            raise InvalidFrame(f"Unexpected ETag {etag}")
+        return self.directory / f"{name}.frame"
+
+    def etags(self) -> list[str]:
+        """
+        Cached frames, most recently shown last
+        """
+        paths = sorted(self.directory.glob("*.frame"), key=lambda path: path.stat().st_mtime)
+        return [f'"{path.stem}"' for path in paths]
+
+    def latest(self) -> Optional[str]:
+        etags = self.etags()
+        return etags[-1] if etags else None
+
+    def put(self, etag: str, compressed: bytes):
+        path = self._path(etag)
+        partial = path.with_suffix(".partial")
+        partial.write_bytes(compressed)
+        # a frame is either complete or missing after a power cut
+        os.replace(partial, path)
+        for old in self.etags()[: -self.keep]:
+            self._path(old).unlink(missing_ok=True)
+
+    def get(self, etag: str) -> bytes:
+        return zlib.decompress(self._path(etag).read_bytes())
+
+    def touch(self, etag: str):
+        os.utime(self._path(etag))
+
+
+class FleetClient:
+    def __init__(
+        self,
+        server: str,
+        panel: str,
+        display: Display,
+        cache: FrameCache,
+        poll: float = 60.0,
+        offline_interval: float = 1800.0,
+        timeout: float = 30.0,
+    ):
+        self.url = f"{server.rstrip('/')}/fleet/{quote(panel, safe='')}/frame"
+        self.display = display
+        self.cache = cache
+        self.poll_interval = poll
+        self.offline_interval = offline_interval
+        self.timeout = timeout
+        # the panel keeps its image without power, after a restart it still shows the latest frame
+        self.etag = cache.latest()
+        self.shown_at = time.monotonic()
+
+    @property
+    def frame_size(self) -> int:
+        return self.display.width * self.display.height // 2
+
+    def fetch(self) -> tuple[int, Optional[str], Optional[bytes], HTTPMessage]:
+        """
+        Status, ETag, compressed body and headers of one pull
+        """
+        request = urllib.request.Request(self.url)
+        request.add_header("Accept-Encoding", "deflate")
+        if self.etag:
+            request.add_header("If-None-Match", self.etag)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                # looked up case insensitively, uvicorn sends lowercase names
+                headers = response.headers
+                status = response.status
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            return 304, self.etag, None, e.headers
+        if status != 200:
+            return status, None, None, headers
+        if headers.get("Content-Encoding") != "deflate":
+            body = zlib.compress(body, 6)
+        return status, headers.get("ETag"), body, headers
+
+    def show(self, etag: str, buffer: bytes, name: str):
+        logging.info(f"Displaying {name} ({etag})")
+        self.display.init()
+        self.display.display(buffer)
+        self.display.sleep()
+        self.cache.touch(etag)
+        self.etag = etag
+        self.shown_at = time.monotonic()
+
+    def offline(self):
+        """
+        Cycle through the cached frames while the server is unreachable
+        """
+        if time.monotonic() - self.shown_at < self.offline_interval:
+            return
+        etags = self.cache.etags()
+        # the least recently shown frame other than the current one
+        etags = [etag for etag in etags if etag != self.etag]
+        if etags:
+            self.show(etags[0], self.cache.get(etags[0]), "cached frame")
+
+    def poll(self) -> float:
+        """
+        Pull once, returns the seconds until the next pull
+        """
+        try:
+            status, etag, compressed, headers = self.fetch()
+        except (urllib.error.URLError, OSError) as e:
+            # includes server errors, the panel is better off with its cached frames
+            logging.warning(f"Server unreachable: {e}")
+            self.offline()
+            return self.poll_interval
+        if status == 200 and etag and compressed is not None:
+            try:
+                buffer = decompress(compressed, self.frame_size)
+                validate_packed(buffer, self.display.width, self.display.height)
+                self.cache.put(etag, compressed)
+            except InvalidFrame as e:
+                logging.error(f"Invalid frame from server: {e}")
+                return self.poll_interval
+            self.show(etag, buffer, unquote(headers.get("X-Frame-Name", "frame")))
+        elif status == 304:
+            logging.info(f"Frame not modified ({self.etag})")
+        elif status == 204:
+            logging.info("Nothing to show yet")
+        refresh = headers.get("X-Refresh-After")
+        return min(float(refresh), self.poll_interval) if refresh else self.poll_interval
+
+    def run(self):
+        while True:
+            time.sleep(self.poll())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--server", required=True, help="URL of the prismberry server")
+    parser.add_argument("--panel", required=True, help="Name of this panel")
+    parser.add_argument(
+        "--cache", type=Path, default=Path.home() / ".cache" / "prismberry", help="Frame cache directory"
+    )
+    parser.add_argument("--keep", type=int, default=16, help="Number of frames to cache")
+    parser.add_argument("--poll", type=float, default=60.0, help="Longest time between pulls in seconds")
+    parser.add_argument("--offline-interval", type=float, default=1800.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    client = FleetClient(
+        args.server,
+        args.panel,
+        load_display(),
+        FrameCache(args.cache / args.panel, args.keep),
+        poll=args.poll,
+        offline_interval=args.offline_interval,
+    )
+    client.run()
+
+
+if __name__ == "__main__":
+    main()
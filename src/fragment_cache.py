@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Awaitable, Callable, Optional
+from fasthtml.common import NotStr, Request, Response, to_xml
+from metrics import CACHE_REQUESTS
+import gzip
+import uuid
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@dataclass
+class CachedPage:
+    version: int
+    body: bytes
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    def encode(self, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return self.body
+        if encoding not in self.encoded:
+            if encoding == "br":
+                self.encoded[encoding] = brotli.compress(self.body, quality=5)
+            else:
+                self.encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+        return self.encoded[encoding]
+
+
+def negotiate_encoding(accept_encoding: str, size: int, minimum_size: int = 500) -> Optional[str]:
+    if size < minimum_size:
+        return None
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+
+class FragmentCache:
+    """
+    Caches serialized HTML of single entries and whole pages. Every page has
+    a version counter which is bumped on changes and used as its ETag. The
+    least recently used entries are evicted beyond `max_fragments` entries or
+    about `max_bytes` of HTML, a large library is never held in memory as a whole.
+    """
+
+    def __init__(self, max_fragments: int = 1000, max_bytes: int = 8 * 2**20):
+        self.max_fragments = max_fragments
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        # part of the ETag so tags from before a restart never match
+        self._boot = uuid.uuid4().hex[:8]
+        self._versions: dict[str, int] = {}
+        self._fragments: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self._pages: dict[str, CachedPage] = {}
+
+    def version(self, page: str) -> int:
+        return self._versions.get(page, 0)
+
+    def cached(self, id: str) -> bool:
+        return id in self._fragments
+
+    def invalidate(self, page: str, id: Optional[str] = None):
+        with self._lock:
+            self._versions[page] = self.version(page) + 1
+            self._pages.pop(page, None)
+            if id is not None:
+                self._bytes -= len(self._fragments.pop(id, ""))
+
+    def _store(self, id: str, html: str):
+        self._bytes += len(html) - len(self._fragments.pop(id, ""))
+        self._fragments[id] = html
+        while len(self._fragments) > self.max_fragments or self._bytes > self.max_bytes:
+            _, evicted = self._fragments.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def fragment(
+        self, page: str, version: int, id: str, render: Callable[[], Any]
+    ) -> NotStr:
+        """
+        Cached HTML of a single entry, `version` is the page version read before loading the entry
+        """
+        with self._lock:
+            html = self._fragments.get(id)
+            if html is not None:
+                self._fragments.move_to_end(id)
+        CACHE_REQUESTS.inc(cache="fragment", result="miss" if html is None else "hit")
+        if html is None:
+            html = to_xml(render())
+            with self._lock:
+                if self.version(page) == version:
+                    self._store(id, html)
+        return NotStr(html)
+
+    def etag(self, page: str, version: int) -> str:
+        return f'W/"{self._boot}-{page}-{version}"'
+
+    async def respond(
+        self, request: Request, page: str, render: Callable[[], Awaitable[Any]]
+    ) -> Response:
+        version = self.version(page)
+        headers = {
+            "ETag": self.etag(page, version),
+            # always revalidate, unchanged pages are answered with a 304
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            CACHE_REQUESTS.inc(cache="etag", result="hit")
+            return Response(status_code=304, headers=headers)
+
+        cached = self._pages.get(page)
+        hit = cached is not None and cached.version == version
+        CACHE_REQUESTS.inc(cache="page", result="hit" if hit else "miss")
+        if not hit:
+            cached = CachedPage(version, to_xml(await render()).encode())
+            with self._lock:
+                if self.version(page) == version:
+                    self._pages[page] = cached
+
+        encoding = negotiate_encoding(
+            request.headers.get("accept-encoding", ""), len(cached.body)
+        )
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(
+            cached.encode(encoding),
+            media_type="text/html; charset=utf-8",
+            headers=headers,
+        )
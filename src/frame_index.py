@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+import logging
+import shutil
+from sqlalchemy import delete
+from sqlmodel import Session, select
+from models import ImageFrame
+
+logger = logging.getLogger("uvicorn.error")
+
+# Pillow is imported by the workers only
+if TYPE_CHECKING:
+    from PIL import Image
+
+# modes a frame can be stored in as PNG, anything else is converted to RGB
+PNG_MODES = {"1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16"}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# frames are stored at most this large, the panel is 800x480 and rotating can swap its sides
+MAX_FRAME_SIZE = (800, 800)
+# frames beyond this are dropped, a long video-like GIF would fill the SD card
+MAX_FRAMES = 500
+# frames of one original take at most this much space, later frames are dropped
+MAX_FRAME_BYTES = 64 * 2**20
+# left free on the SD card for the database and other uploads
+MIN_FREE_BYTES = 256 * 2**20
+
+
+@dataclass
+class FrameInfo:
+    offset: int
+    length: int
+    # how long the source shows the frame in milliseconds
+    duration: int
+
+
+def frame_budget(path: str) -> int:
+    """
+    Bytes the frames of an original stored at `path` may take
+    """
+    free = shutil.disk_usage(Path(path).parent).free
+    return max(0, min(MAX_FRAME_BYTES, free - MIN_FREE_BYTES))
+
+
+def store_frames(image: "Image.Image", path: str) -> list[FrameInfo]:
+    """
+    Write the frames of a multi-frame image to `path` as PNGs back to back
+    and return where each one is. Frames are stored composited, so any of
+    them decodes on its own, and the file reads as a PNG of the first frame.
+    Frames larger than the panel are scaled down, at most MAX_FRAMES frames
+    within the frame_budget are kept, the first frame always is.
+    """
+    from itertools import islice
+    from PIL import Image, ImageSequence
+    from image_processor import fit_size
+
+    exif = image.getexif()
+    budget = frame_budget(path)
+    frames = []
+    with open(path, "wb") as f:
+        for frame in islice(ImageSequence.Iterator(image), MAX_FRAMES):
+            duration = int(frame.info.get("duration") or 0)
+            if frame.width > MAX_FRAME_SIZE[0] or frame.height > MAX_FRAME_SIZE[1]:
+                # palette images only resize with nearest neighbour
+                if frame.mode in ("1", "P"):
+                    frame = frame.convert("RGBA" if frame.has_transparency_data else "RGB")
+                frame = frame.resize(fit_size(frame.size, MAX_FRAME_SIZE), Image.Resampling.LANCZOS)
+            if frame.mode not in PNG_MODES:
+                frame = frame.convert("RGB")
+            offset = f.tell()
+            # the frames are written once and decoded often, favour encoding speed
+            frame.save(f, format="PNG", exif=exif, compress_level=1)
+            if frames and f.tell() > budget:
+                f.truncate(offset)
+                logger.warning(f"Kept {len(frames)} frames of {path}, the rest exceed {budget} bytes")
+                break
+            frames.append(FrameInfo(offset, f.tell() - offset, duration))
+    return frames
+
+
+def open_frame(path: str, offset: int, length: int) -> "Image.Image":
+    """
+    Open a single frame stored by `store_frames`, only its bytes are read
+    """
+    from PIL import Image
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return Image.open(BytesIO(data))
+
+
+def scan_frames(path: str) -> list[FrameInfo]:
+    """
+    Rebuild the index of a file written by `store_frames` from its PNG
+    chunks, the durations are not stored in the file and are lost
+    """
+    frames = []
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            if f.read(8) != PNG_SIGNATURE:
+                break
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return frames
+                # chunk data and its CRC
+                f.seek(int.from_bytes(header[:4], "big") + 4, 1)
+                if header[4:] == b"IEND":
+                    break
+            frames.append(FrameInfo(offset, f.tell() - offset, 0))
+    return frames
+
+
+def set_frames(session: Session, id: str, frames: list[FrameInfo]):
+    """
+    Replace the frame index of an entry, an empty list for single frame originals
+    """
+    remove_frames(session, id)
+    for index, frame in enumerate(frames):
+        session.add(
+            ImageFrame(
+                image_id=id,
+                frame=index,
+                offset=frame.offset,
+                length=frame.length,
+                duration=frame.duration,
+            )
+        )
+
+
+def remove_frames(session: Session, id: str):
+    session.execute(delete(ImageFrame).where(ImageFrame.image_id == id))
+
+
+def frame_span(session: Session, id: str, frame: int) -> Optional[tuple[int, int]]:
+    """
+    Offset and length of a frame in the original, None if it has no frame index
+    """
+    row = session.exec(
+        select(ImageFrame.offset, ImageFrame.length).where(
+            ImageFrame.image_id == id, ImageFrame.frame == frame
+        )
+    ).first()
+    return tuple(row) if row else None
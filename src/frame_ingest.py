@@ -0,0 +1,78 @@
+from collections import deque
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional, Union
+import zlib
+
+# every byte holds two pixels, valid pixels are palette indices below 7
+_VALID_BYTES = bytes(high << 4 | low for high in range(7) for low in range(7))
+
+
+class InvalidFrame(Exception):
+    pass
+
+
+@dataclass
+class RawFrame:
+    name: str
+    buffer: Union[bytes, memoryview]
+
+
+def decompress(data: Union[bytes, bytearray, memoryview], limit: int) -> bytes:
+    """
+    Inflate zlib `data`, refusing output larger than `limit`
+    """
+    inflater = zlib.decompressobj()
+    try:
+        buffer = inflater.decompress(data, limit)
+    except zlib.error as e:
+        raise InvalidFrame(f"Invalid zlib data: {e}")
+    if inflater.unconsumed_tail:
+        raise InvalidFrame(f"Decompressed frame is larger than {limit} bytes")
+    return buffer
+
+
+def validate_packed(buffer: Union[bytes, bytearray, memoryview], width: int, height: int):
+    """
+    Check a buffer of 4 bit palette indices, two pixels per byte with the first in the high nibble
+    """
+    if len(buffer) != width * height // 2:
+        raise InvalidFrame(
+            f"Packed frame must be {width * height // 2} bytes for {width}x{height}, got {len(buffer)}"
+        )
+    if isinstance(buffer, memoryview):
+        # memoryviews can't translate, use the bytes or bytearray they cover without copying it
+        whole = isinstance(buffer.obj, (bytes, bytearray)) and buffer.nbytes == len(buffer.obj)
+        buffer = buffer.obj if whole else buffer.tobytes()
+    # deleting all valid bytes leaves only the invalid ones, done in C
+    invalid = buffer.translate(None, _VALID_BYTES)
+    if invalid:
+        raise InvalidFrame(f"Packed frame contains invalid palette indices in byte 0x{invalid[0]:02x}")
+
+
+class PendingFrames:
+    """
+    Bounded queue of ingested frames shown by the next scheduled refreshes
+    """
+
+    def __init__(self, capacity: int = 8):
+        self.capacity = capacity
+        self._lock = Lock()
+        self._frames: deque[RawFrame] = deque()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def put(self, frame: RawFrame) -> int:
+        """
+        Queue `frame` and return its position, raises IndexError when full
+        """
+        with self._lock:
+            if len(self._frames) >= self.capacity:
+                raise IndexError(f"{self.capacity} frames are already queued")
+            self._frames.append(frame)
+            return len(self._frames)
+
+    def take(self) -> Optional[RawFrame]:
+        with self._lock:
+            return self._frames.popleft() if self._frames else None
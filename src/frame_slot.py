@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
+from models import ImageEntry
+
+
+@dataclass
+class PreparedFrame:
+    entry_id: str
+    options: tuple
+    buffer: list[int]
+
+
+class FrameSlot:
+    """
+    One-slot buffer holding the packed frame of the next scheduled entry
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._frame: Optional[PreparedFrame] = None
+
+    def put(self, entry: ImageEntry, buffer: list[int]):
+        with self._lock:
+            self._frame = PreparedFrame(entry.id, entry.options_key(), buffer)
+
+    def take(self, entry: ImageEntry) -> Optional[list[int]]:
+        """
+        Return the prepared buffer if it was rendered for this entry with its current options
+        """
+        with self._lock:
+            frame, self._frame = self._frame, None
+        if (
+            frame is not None
+            and frame.entry_id == entry.id
+            and frame.options == entry.options_key()
+        ):
+            return frame.buffer
+        return None
+
+    def discard(self, entry_id: Optional[str] = None):
+        with self._lock:
+            if entry_id is None or (
+                self._frame is not None and self._frame.entry_id == entry_id
+            ):
+                self._frame = None
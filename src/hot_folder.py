@@ -0,0 +1,325 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+logger = logging.getLogger("uvicorn.error")
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+class Inotify:
+    """
+    Minimal inotify binding through libc, Linux only
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def remove_watch(self, wd: int):
+        # fails if the kernel already dropped the watch
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> list[tuple[int, int, int, str]]:
+        """
+        Pending events as (watch, mask, cookie, name)
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+@dataclass
+class _Pending:
+    last_event: float
+    # closed after writing or moved in, an open file may still be written to
+    closed: bool
+
+
+class HotFolder:
+    """
+    Imports the images dropped into `directory` and its subdirectories.
+    A file is imported once it was closed and saw no writes for `settle`
+    seconds, files kept open are imported after `stale` seconds of silence.
+    Work runs on `workers` threads, at most `backlog` files wait for one,
+    beyond that the watcher stops reading events and the kernel queues them.
+
+    Files are identified by their path relative to `directory`:
+    `ingest(source, path)` for new and overwritten files, `remove(source)`
+    for deleted ones and `rename(old, new)` for moves within the folder.
+    Renaming a subdirectory renames the sources below it, moving it out of
+    the folder removes them. `known()` returns the sources already imported,
+    files added or removed while not watching are reconciled with them.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        known: Callable[[], set[str]],
+        ingest: Callable[[str, Path], None],
+        remove: Callable[[str], None],
+        rename: Callable[[str, str], None],
+        settle: float = 2.0,
+        stale: float = 60.0,
+        workers: int = 2,
+        backlog: int = 16,
+    ):
+        self.directory = directory
+        self.known = known
+        self.ingest = ingest
+        self.remove = remove
+        self.rename = rename
+        self.settle = settle
+        self.stale = stale
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._inotify: Optional[Inotify] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake_read, self._wake_write = os.pipe()
+        self._stopped = False
+        self._watches: dict[int, Path] = {}
+        self._pending: dict[Path, _Pending] = {}
+        # cookie -> path, time and whether it was still pending of a move whose destination is not known yet
+        self._moved: dict[int, tuple[Path, float, bool]] = {}
+        # cookie -> path and time of a directory moved away
+        self._moved_dirs: dict[int, tuple[Path, float]] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._inotify = Inotify()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="hot-folder")
+        self._thread = threading.Thread(target=self._run, name="hot-folder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        os.write(self._wake_write, b"\0")
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def source(self, path: Path) -> str:
+        return path.relative_to(self.directory).as_posix()
+
+    @staticmethod
+    def _under(path: Path, directory: Path) -> bool:
+        return path == directory or directory in path.parents
+
+    @staticmethod
+    def wanted(path: Path) -> bool:
+        # skips hidden files, including the ._ files of macOS clients
+        return path.suffix.lower() in IMAGE_SUFFIXES and not path.name.startswith((".", "~"))
+
+    def _watch_tree(self, directory: Path) -> list[Path]:
+        """
+        Watch `directory` and its subdirectories, returns the files in them.
+        Watching a directory twice returns its existing watch.
+        """
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            try:
+                wd = self._inotify.add_watch(Path(root), WATCH_MASK)
+            except OSError as e:
+                logger.error(f"Cannot watch {root}: {e}")
+                continue
+            self._watches[wd] = Path(root)
+            files.extend(Path(root) / name for name in names)
+        return [path for path in files if self.wanted(path)]
+
+    def _reconcile(self):
+        known = self.known()
+        files = {self.source(path): path for path in self._watch_tree(self.directory)}
+        now = time.monotonic()
+        for source, path in files.items():
+            if source not in known:
+                self._pending[path] = _Pending(now - self.settle, True)
+        for source in known - files.keys():
+            self._submit(self.remove, source)
+
+    def _submit(self, fn: Callable, *args):
+        # blocks the watcher while the workers are behind, bounding the backlog
+        self._slots.acquire()
+        future = self._executor.submit(self._call, fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+
+    @staticmethod
+    def _call(fn: Callable, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"Hot folder {fn.__name__}{args} failed: {e}")
+
+    def _timeout(self, now: float) -> Optional[float]:
+        deadlines = [
+            pending.last_event + (self.settle if pending.closed else self.stale)
+            for pending in self._pending.values()
+        ]
+        deadlines.extend(moved + self.settle for _, moved, _ in self._moved.values())
+        deadlines.extend(moved + self.settle for _, moved in self._moved_dirs.values())
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._inotify.fd, select.POLLIN)
+        poller.register(self._wake_read, select.POLLIN)
+        # on this thread, removing many entries waits for the workers and must not hold up startup
+        self._reconcile()
+        while not self._stopped:
+            timeout = self._timeout(time.monotonic())
+            # sleeps until an event arrives or a pending file is due, no polling
+            poller.poll(None if timeout is None else int(timeout * 1000) + 1)
+            for wd, mask, cookie, name in self._inotify.read():
+                self._handle(wd, mask, cookie, name)
+            self._flush(time.monotonic())
+
+    def _handle(self, wd: int, mask: int, cookie: int, name: str):
+        now = time.monotonic()
+        if mask & IN_Q_OVERFLOW:
+            # events were lost, catch up with the state of the folder
+            logger.warning("Hot folder event queue overflowed, rescanning")
+            self._reconcile()
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        path = directory / name
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self._moved_dirs[cookie] = (path, now)
+            elif mask & IN_MOVED_TO and cookie in self._moved_dirs:
+                old, _ = self._moved_dirs.pop(cookie)
+                self._rename_tree(old, path)
+            elif mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith("."):
+                for file in self._watch_tree(path):
+                    self._pending[file] = _Pending(now, True)
+            return
+        if not self.wanted(path) and not mask & IN_MOVED_FROM:
+            return
+        if mask & IN_MOVED_FROM:
+            if self.wanted(path):
+                self._moved[cookie] = (path, now, self._pending.pop(path, None) is not None)
+        elif mask & IN_MOVED_TO and cookie in self._moved:
+            old, _, pending = self._moved.pop(cookie)
+            if pending:
+                # not imported yet, import it under the new name
+                self._pending[path] = _Pending(now, True)
+            else:
+                self._submit(self.rename, self.source(old), self.source(path))
+        elif mask & IN_DELETE:
+            self._pending.pop(path, None)
+            self._submit(self.remove, self.source(path))
+        elif mask & (IN_CREATE | IN_MODIFY):
+            self._pending[path] = _Pending(now, False)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._pending[path] = _Pending(now, True)
+
+    def _rename_tree(self, old: Path, new: Path):
+        """
+        Follow a directory renamed within the folder, its watches stay valid
+        """
+        for wd, directory in self._watches.items():
+            if self._under(directory, old):
+                self._watches[wd] = new / directory.relative_to(old)
+        for path in [path for path in self._pending if self._under(path, old)]:
+            self._pending[new / path.relative_to(old)] = self._pending.pop(path)
+        for source in sorted(self.known()):
+            path = self.directory / source
+            if self._under(path, old):
+                self._submit(self.rename, source, self.source(new / path.relative_to(old)))
+
+    def _remove_tree(self, old: Path):
+        """
+        Forget a directory moved out of the folder, its watches would follow it
+        """
+        for wd, directory in list(self._watches.items()):
+            if self._under(directory, old):
+                del self._watches[wd]
+                self._inotify.remove_watch(wd)
+        for path in [path for path in self._pending if self._under(path, old)]:
+            del self._pending[path]
+        for source in sorted(self.known()):
+            if self._under(self.directory / source, old):
+                self._submit(self.remove, source)
+
+    def _flush(self, now: float):
+        due = [
+            path
+            for path, pending in self._pending.items()
+            if now >= pending.last_event + (self.settle if pending.closed else self.stale)
+        ]
+        for path in due:
+            del self._pending[path]
+            if path.is_file():
+                self._submit(self.ingest, self.source(path), path)
+        # moved out of the folder, there was no matching move into it
+        for cookie, (path, moved, pending) in list(self._moved.items()):
+            if now >= moved + self.settle:
+                del self._moved[cookie]
+                if not pending:
+                    self._submit(self.remove, self.source(path))
+        for cookie, (path, moved) in list(self._moved_dirs.items()):
+            if now >= moved + self.settle:
+                del self._moved_dirs[cookie]
+                self._remove_tree(path)
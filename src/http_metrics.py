@@ -0,0 +1,68 @@
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+from metrics import HTTP_SECONDS
+from profiling import Profiler
+import time
+
+
+def route_template(scope: Scope) -> str:
+    for route in getattr(scope.get("app"), "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unknown")
+    return "unmatched"
+
+
+class HttpMetricsMiddleware:
+    """
+    Records request latency labelled by the route template, not the raw path.
+    Event streams are left out, they last as long as the page is open.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not HTTP_SECONDS.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = dict(message.get("headers", ()))
+                streaming = headers.get(b"content-type", b"").startswith(b"text/event-stream")
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if not streaming:
+                HTTP_SECONDS.observe(
+                    time.perf_counter() - started,
+                    method=scope["method"],
+                    route=route_template(scope),
+                    status=str(status),
+                )
+
+
+class ProfilingMiddleware:
+    """
+    Samples requests to routes armed in the profiler
+    """
+
+    def __init__(self, app: ASGIApp, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.profiler.armed:
+            await self.app(scope, receive, send)
+            return
+        with self.profiler.profile(route_template(scope)):
+            await self.app(scope, receive, send)
@@ -1,6 +1,10 @@
-from PIL import Image, ImageOps
-from PIL.Image import Quantize, Dither
-from models import BackgroundColor, ImageEntry, Rotation
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from PIL import Image, ImageChops
+from PIL.Image import Quantize, Dither, Resampling, Transpose
+from models import BackgroundColor, DitherMode, ImageEntry, Rotation
+import os
+from metrics import stage_timer
 
 PALETTE = (
     0,
@@ -25,40 +29,271 @@ PALETTE = (
     128,
     0,
 ) + (0, 0, 0) * 249
+# colors the panel can show, the rest of the palette is padding
+PANEL_COLORS = 7
+
+
+# transposes as the matrix (a, b, c, d) mapping x, y to a*x + b*y, c*x + d*y with y pointing down
+TRANSPOSES = {
+    (1, 0, 0, 1): None,
+    (-1, 0, 0, 1): Transpose.FLIP_LEFT_RIGHT,
+    (1, 0, 0, -1): Transpose.FLIP_TOP_BOTTOM,
+    (-1, 0, 0, -1): Transpose.ROTATE_180,
+    (0, 1, -1, 0): Transpose.ROTATE_90,
+    (0, -1, 1, 0): Transpose.ROTATE_270,
+    (0, 1, 1, 0): Transpose.TRANSPOSE,
+    (0, -1, -1, 0): Transpose.TRANSVERSE,
+}
+MATRICES = {transpose: matrix for matrix, transpose in TRANSPOSES.items()}
+
+# the transpose which puts an image upright for each EXIF orientation
+EXIF_ORIENTATION = {
+    2: Transpose.FLIP_LEFT_RIGHT,
+    3: Transpose.ROTATE_180,
+    4: Transpose.FLIP_TOP_BOTTOM,
+    5: Transpose.TRANSPOSE,
+    6: Transpose.ROTATE_270,
+    7: Transpose.TRANSVERSE,
+    8: Transpose.ROTATE_90,
+}
+ROTATIONS = {
+    Rotation._90: Transpose.ROTATE_90,
+    Rotation._180: Transpose.ROTATE_180,
+    Rotation._270: Transpose.ROTATE_270,
+}
+BAYER_SIZE = 8
+# bands are at least this high, the halo rows are quantized twice
+MIN_BAND_HEIGHT = 64
+BAND_HALO = 16
+
+BACKGROUND_RGB = {
+    BackgroundColor.Black: (0, 0, 0),
+    BackgroundColor.White: (255, 255, 255),
+}
+
+
+def compose(first: Optional[Transpose], then: Optional[Transpose]) -> Optional[Transpose]:
+    """
+    The single transpose equivalent to applying `first` and then `then`
+    """
+    a1, b1, c1, d1 = MATRICES[first]
+    a2, b2, c2, d2 = MATRICES[then]
+    return TRANSPOSES[
+        (
+            a2 * a1 + b2 * c1,
+            a2 * b1 + b2 * d1,
+            c2 * a1 + d2 * c1,
+            c2 * b1 + d2 * d1,
+        )
+    ]
+
+
+def bayer_matrix(size: int) -> list[list[int]]:
+    """
+    Bayer threshold matrix with the values 0 to size * size - 1, `size` a power of two
+    """
+    if size == 1:
+        return [[0]]
+    smaller = bayer_matrix(size // 2)
+    return [
+        [4 * value + offset for offset in offsets for value in row]
+        for offsets in ((0, 2), (3, 1))
+        for row in smaller
+    ]
+
+
+def fit_size(size: tuple[int, int], target: tuple[int, int]) -> tuple[int, int]:
+    """
+    Size of `size` scaled to fit `target` keeping the aspect ratio, rounded like ImageOps.contain
+    """
+    width, height = size
+    image_ratio = width / height
+    target_ratio = target[0] / target[1]
+    if image_ratio > target_ratio:
+        return target[0], round(height / width * target[0])
+    if image_ratio < target_ratio:
+        return round(width / height * target[1]), target[1]
+    return target
 
 
 class ImageProcessor:
-    def __init__(self, target_size: tuple[int, int] = (800, 480)):
+    def __init__(
+        self,
+        target_size: tuple[int, int] = (800, 480),
+        threads: Optional[int] = None,
+        reducing_gap: Optional[float] = None,
+    ):
         self.target_size = target_size
+        # trades resize quality for speed, see Image.resize
+        self.reducing_gap = reducing_gap
         self.color_image = Image.new("P", (1, 1))
         self.color_image.putpalette(PALETTE)
 
         self.gray_image = Image.new("P", (1, 1))
         self.gray_image.putpalette((0, 0, 0, 255, 255, 255) + (0, 0, 0) * 254)
 
-    def __call__(self, image: Image, entry: ImageEntry) -> Image:
-        if entry.rotation != Rotation._None:
-            image = image.rotate(entry.rotation.value, expand=True)
+        # blank frames per palette and background, copied instead of filled on every call
+        self._canvases: dict[tuple[bool, BackgroundColor], Image.Image] = {}
+        self._thresholds: dict[tuple[int, int], Image.Image] = {}
 
-        image = ImageOps.contain(image, self.target_size)
+        self.threads = threads or os.cpu_count() or 1
+        # created on first use, the processor lives in forked render workers
+        self._pool: Optional[ThreadPoolExecutor] = None
 
-        palette = self.gray_image if entry.grayscale else self.color_image
-        quanitzed = image.convert("RGB").quantize(
+    def canvas(self, grayscale: bool, background: BackgroundColor) -> Image.Image:
+        key = (grayscale, background)
+        if key not in self._canvases:
+            palette = (self.gray_image if grayscale else self.color_image).getpalette()
+            colors = list(zip(palette[0::3], palette[1::3], palette[2::3]))
+            canvas = Image.new("P", self.target_size, colors.index(BACKGROUND_RGB[background]))
+            canvas.putpalette(palette)
+            self._canvases[key] = canvas
+        return self._canvases[key].copy()
+
+    def threshold_map(self, size: tuple[int, int]) -> Image.Image:
+        """
+        RGB image of the tiled Bayer matrix as offsets around 128, spanning
+        one palette step so every level between two colors is reachable
+        """
+        if size not in self._thresholds:
+            tile = Image.new("L", (BAYER_SIZE, BAYER_SIZE))
+            tile.putdata(
+                [
+                    128 + round(255 * ((value + 0.5) / BAYER_SIZE**2 - 0.5))
+                    for row in bayer_matrix(BAYER_SIZE)
+                    for value in row
+                ]
+            )
+            threshold = Image.new("L", size)
+            for top in range(0, size[1], BAYER_SIZE):
+                for left in range(0, size[0], BAYER_SIZE):
+                    threshold.paste(tile, (left, top))
+            self._thresholds[size] = Image.merge("RGB", (threshold,) * 3)
+        return self._thresholds[size]
+
+    def _quantize(self, image: Image.Image, palette: Image.Image, dither: Dither) -> Image.Image:
+        return image.quantize(
             palette=palette,
             method=Quantize.FASTOCTREE,
-            dither=Dither.FLOYDSTEINBERG if entry.dither else Dither.NONE,
+            dither=dither,
             kmeans=32,
         )
 
-        left_padding = (self.target_size[0] - quanitzed.width) // 2
-        top_padding = (self.target_size[1] - quanitzed.height) // 2
-        right_padding = self.target_size[0] - quanitzed.width - left_padding
-        bottom_padding = self.target_size[1] - quanitzed.height - top_padding
+    def _banded(
+        self,
+        image: Image.Image,
+        palette: Image.Image,
+        quantize: Callable[[tuple[int, int, int, int]], Image.Image],
+        halo: int = 0,
+    ) -> Image.Image:
+        """
+        Quantize horizontal bands of `image` on the thread pool, Pillow releases
+        the GIL while converting. Each band starts `halo` rows early so the
+        diffused error has settled when its first own row is reached.
+        """
+        bands = max(1, min(self.threads, image.height // MIN_BAND_HEIGHT))
+        if bands == 1:
+            return quantize((0, 0, image.width, image.height))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="dither")
+        bounds = [image.height * band // bands for band in range(bands + 1)]
 
-        # Pad the image
-        quanitzed = ImageOps.expand(
-            quanitzed,
-            (left_padding, top_padding, right_padding, bottom_padding),
-            fill=entry.background_color.value,
-        )
-        return quanitzed
+        def work(band: int) -> Image.Image:
+            top, bottom = bounds[band], bounds[band + 1]
+            start = max(0, top - halo)
+            quantized = quantize((0, start, image.width, bottom))
+            if start == top:
+                return quantized
+            return quantized.crop((0, top - start, image.width, bottom - start))
+
+        frame = Image.new("P", image.size)
+        frame.putpalette(palette.getpalette())
+        for top, quantized in zip(bounds, self._pool.map(work, range(bands))):
+            frame.paste(quantized, (0, top))
+        return frame
+
+    def dither(self, image: Image.Image, entry: ImageEntry) -> Image.Image:
+        palette = self.gray_image if entry.grayscale else self.color_image
+        if not entry.dither:
+            return self._quantize(image, palette, Dither.NONE)
+        if entry.dither_mode == DitherMode.Parallel:
+            return self._banded(
+                image,
+                palette,
+                lambda box: self._quantize(image.crop(box), palette, Dither.FLOYDSTEINBERG),
+                halo=BAND_HALO,
+            )
+        if entry.dither_mode == DitherMode.Ordered:
+            threshold = self.threshold_map(image.size)
+            return self._banded(
+                image,
+                palette,
+                lambda box: self._quantize(
+                    ImageChops.add(image.crop(box), threshold.crop(box), offset=-128),
+                    palette,
+                    Dither.NONE,
+                ),
+            )
+        return self._quantize(image, palette, Dither.FLOYDSTEINBERG)
+
+    def geometry(self, image: Image.Image, rotation: Rotation) -> tuple[tuple[int, int], Optional[Transpose]]:
+        """
+        The size to resize `image` to and the transpose to apply afterwards,
+        combining the EXIF orientation with the rotation chosen by the user
+        """
+        orientation = EXIF_ORIENTATION.get(image.getexif().get(0x0112))
+        transpose = compose(orientation, ROTATIONS.get(rotation))
+        swaps = MATRICES[transpose][0] == 0
+        width, height = image.size
+        oriented = (height, width) if swaps else (width, height)
+        fitted = fit_size(oriented, self.target_size)
+        return (fitted[::-1] if swaps else fitted), transpose
+
+    def __call__(
+        self,
+        image: Image,
+        entry: ImageEntry,
+        timings: Optional[dict[str, float]] = None,
+        consume: bool = False,
+    ) -> Image:
+        """
+        With `consume` the input image is closed as soon as it is no longer needed
+        and intermediates are released right away instead of at the end of the call
+        """
+        with stage_timer(timings, "decode"):
+            image.load()
+
+        def replace(old: Image, new: Image) -> Image:
+            if new is not old and (consume or old is not source):
+                old.close()
+            return new
+
+        source = image
+        # resize first and transpose the reduced image, the transpose is lossless
+        with stage_timer(timings, "geometry"):
+            size, transpose = self.geometry(image, entry.rotation)
+            image = replace(
+                image,
+                image.resize(size, resample=Resampling.BICUBIC, reducing_gap=self.reducing_gap),
+            )
+            if transpose is not None:
+                image = replace(image, image.transpose(transpose))
+
+        with stage_timer(timings, "quantize"):
+            image = replace(image, image.convert("RGB"))
+            quanitzed = self.dither(image, entry)
+            replace(image, quanitzed)
+
+        if quanitzed.size == self.target_size:
+            return quanitzed
+        with stage_timer(timings, "pad"):
+            frame = self.canvas(entry.grayscale, entry.background_color)
+            frame.paste(
+                quanitzed,
+                (
+                    (self.target_size[0] - quanitzed.width) // 2,
+                    (self.target_size[1] - quanitzed.height) // 2,
+                ),
+            )
+            replace(quanitzed, frame)
+        return frame
@@ -0,0 +1,297 @@
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Iterable, Optional
+import random
+import re
+from sqlalchemy import and_, delete, text, tuple_
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+from models import Album, AlbumImage, ImageEntry, ImageTag, Tag
+from storage import FTS5, SEARCH_TABLE
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    # words that prefix match on names and tags
+    words: tuple[str, ...] = ()
+    # tags an entry must have, matched exactly through imagetag
+    tags: tuple[str, ...] = ()
+
+
+@dataclass
+class Labels:
+    tags: list[str] = field(default_factory=list)
+    albums: list[str] = field(default_factory=list)
+
+
+def split_labels(value: Optional[str]) -> list[str]:
+    """
+    Comma separated names from a form field, without duplicates and blanks
+    """
+    names = (name.strip() for name in (value or "").split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def normalize_tag(name: str) -> str:
+    # tags are typed as a single word in searches
+    return re.sub(r"\s+", "-", name.strip().lower())
+
+
+def search_query(value: str) -> Optional[SearchQuery]:
+    """
+    Query for the text typed into the search field. Words are prefix matches
+    on names and tags, `tag:word` matches a tag exactly, all have to match.
+    """
+    words = []
+    tags = []
+    for word in value.split():
+        if word.startswith("tag:"):
+            if word[4:]:
+                tags.append(normalize_tag(word[4:]))
+        else:
+            words.append(word)
+    if not words and not tags:
+        return None
+    return SearchQuery(tuple(words), tuple(dict.fromkeys(tags)))
+
+
+def _search_clause(query: SearchQuery):
+    clauses = [
+        ImageEntry.id.in_(
+            select(ImageTag.image_id).join(Tag, Tag.id == ImageTag.tag_id).where(Tag.name == tag)
+        )
+        for tag in query.tags
+    ]
+    if query.words and FTS5:
+        clauses.append(
+            text(
+                f"imageentry.rowid IN (SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query)"
+            ).bindparams(query=" ".join('"' + word.replace('"', '""') + '"*' for word in query.words))
+        )
+    elif query.words:
+        # without FTS5 the words match anywhere in the names and tags, case insensitive for ASCII
+        for index, word in enumerate(query.words):
+            pattern = "%" + re.sub(r"([%_\\])", r"\\\1", word) + "%"
+            clauses.append(
+                text(
+                    f"imageentry.rowid IN (SELECT rowid FROM {SEARCH_TABLE} "
+                    f"WHERE name || ' ' || tags LIKE :word{index} ESCAPE '\\')"
+                ).bindparams(**{f"word{index}": pattern})
+            )
+    return and_(*clauses)
+
+
+def index_entry(session: Session, id: str):
+    """
+    Update the search index row of an entry after its name or tags changed
+    """
+    unindex_entry(session, id)
+    session.execute(
+        text(
+            f"""
+            INSERT INTO {SEARCH_TABLE}(rowid, name, tags)
+            SELECT imageentry.rowid, imageentry.name, coalesce(
+                (SELECT group_concat(tag.name, ' ') FROM imagetag
+                 JOIN tag ON tag.id = imagetag.tag_id
+                 WHERE imagetag.image_id = imageentry.id), '')
+            FROM imageentry WHERE imageentry.id = :id
+            """
+        ),
+        {"id": id},
+    )
+
+
+def unindex_entry(session: Session, id: str):
+    """
+    Remove an entry from the search index, before the entry itself is deleted
+    """
+    session.execute(
+        text(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = (SELECT rowid FROM imageentry WHERE id = :id)"
+        ),
+        {"id": id},
+    )
+
+
+def remove_labels(session: Session, id: str):
+    session.execute(delete(ImageTag).where(ImageTag.image_id == id))
+    session.execute(delete(AlbumImage).where(AlbumImage.image_id == id))
+
+
+def _get_or_create(session: Session, model: type, names: list[str]) -> list[int]:
+    existing = {
+        row.name: row.id for row in session.exec(select(model).where(model.name.in_(names)))
+    }
+    for name in names:
+        if name not in existing:
+            row = model(name=name)
+            session.add(row)
+            session.flush()
+            existing[name] = row.id
+    return [existing[name] for name in names]
+
+
+def set_labels(session: Session, id: str, tags: list[str], albums: list[str]):
+    """
+    Replace the tags and albums of an entry, missing ones are created
+    """
+    tags = list(dict.fromkeys(normalize_tag(tag) for tag in tags))
+    remove_labels(session, id)
+    for tag_id in _get_or_create(session, Tag, tags):
+        session.add(ImageTag(image_id=id, tag_id=tag_id))
+    for album_id in _get_or_create(session, Album, albums):
+        session.add(AlbumImage(album_id=album_id, image_id=id))
+    session.flush()
+    index_entry(session, id)
+
+
+def load_labels(session: Session, ids: list[str]) -> dict[str, Labels]:
+    """
+    Tags and albums of many entries with one query each
+    """
+    labels = {id: Labels() for id in ids}
+    if not ids:
+        return labels
+    tags = session.exec(
+        select(ImageTag.image_id, Tag.name)
+        .join(Tag, Tag.id == ImageTag.tag_id)
+        .where(ImageTag.image_id.in_(ids))
+        .order_by(Tag.name)
+    )
+    for id, name in tags:
+        labels[id].tags.append(name)
+    albums = session.exec(
+        select(AlbumImage.image_id, Album.name)
+        .join(Album, Album.id == AlbumImage.album_id)
+        .where(AlbumImage.image_id.in_(ids))
+        .order_by(Album.name)
+    )
+    for id, name in albums:
+        labels[id].albums.append(name)
+    return labels
+
+
+def load_albums(session: Session) -> list[Album]:
+    return session.exec(select(Album).order_by(Album.name)).all()
+
+
+def gallery_page(
+    session: Session,
+    query: Optional[SearchQuery] = None,
+    album: Optional[int] = None,
+    after: Optional[tuple[str, str]] = None,
+    limit: int = 48,
+) -> list[ImageEntry]:
+    """
+    Entries ordered by name and id, starting after the (name, id) of the last
+    entry of the previous page so deep pages don't scan the skipped rows
+    """
+    statement = select(ImageEntry)
+    if album is not None:
+        statement = statement.join(AlbumImage, AlbumImage.image_id == ImageEntry.id).where(
+            AlbumImage.album_id == album
+        )
+    if query:
+        statement = statement.where(_search_clause(query))
+    if after is not None:
+        statement = statement.where(tuple_(ImageEntry.name, ImageEntry.id) > tuple_(*after))
+    return session.exec(statement.order_by(ImageEntry.name, ImageEntry.id).limit(limit)).all()
+
+
+class CandidateSet:
+    """
+    Ids of the entries cycling picks from, restricted to an album and a search
+    query. The set is loaded once per scope and then kept up to date from the
+    changes of single entries, picking is O(1) instead of a query per refresh.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._lock = Lock()
+        self._scope: tuple[Optional[int], Optional[SearchQuery]] = (None, None)
+        self._loaded = False
+        self._ids: list[str] = []
+        self._positions: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids)
+
+    def set_scope(self, album: Optional[int], query: Optional[str]):
+        scope = (album, search_query(query) if query else None)
+        with self._lock:
+            if scope != self._scope:
+                self._scope = scope
+                self._loaded = False
+
+    def _statement(self, ids: Optional[Iterable[str]] = None):
+        album, query = self._scope
+        statement = select(ImageEntry.id)
+        if album is not None:
+            statement = statement.join(AlbumImage, AlbumImage.image_id == ImageEntry.id).where(
+                AlbumImage.album_id == album
+            )
+        if query:
+            statement = statement.where(_search_clause(query))
+        if ids is not None:
+            statement = statement.where(ImageEntry.id.in_(list(ids)))
+        return statement
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with Session(self.engine) as session:
+            self._ids = list(session.exec(self._statement()).all())
+        self._positions = {id: index for index, id in enumerate(self._ids)}
+        self._loaded = True
+
+    def _add(self, id: str):
+        if id not in self._positions:
+            self._positions[id] = len(self._ids)
+            self._ids.append(id)
+
+    def _remove(self, id: str):
+        index = self._positions.pop(id, None)
+        if index is None:
+            return
+        # move the last id into the gap, keeps removal O(1)
+        last = self._ids.pop()
+        if last != id:
+            self._ids[index] = last
+            self._positions[last] = index
+
+    def changed(self, id: str):
+        """
+        Re-check a single entry after it was added or its labels changed
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            if self._scope == (None, None):
+                self._add(id)
+                return
+            with Session(self.engine) as session:
+                matches = session.exec(self._statement([id])).first() is not None
+            if matches:
+                self._add(id)
+            else:
+                self._remove(id)
+
+    def removed(self, id: str):
+        with self._lock:
+            self._remove(id)
+
+    def pick(self, exclude: Optional[str] = None) -> Optional[str]:
+        """
+        A random candidate, other than `exclude` if there is a choice
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if not self._ids:
+                return None
+            id = random.choice(self._ids)
+            if id == exclude and len(self._ids) > 1:
+                index = (self._positions[id] + random.randrange(1, len(self._ids))) % len(self._ids)
+                id = self._ids[index]
+            return id
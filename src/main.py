@@ -1,94 +1,410 @@
-from typing import Any
-from fastapi_utils.tasks import repeat_every
+from typing import Any, Callable, Optional, Sequence
+import asyncio
+from datetime import datetime
+from concurrent.futures.process import BrokenProcessPool
 import base64
+import os
 from io import BytesIO
-from shutil import rmtree
-from fasthtml.common import (
-    Style,
-    Link,
-    UploadFile,
-    fast_app,
-    Title,
-    Header,
-    Nav,
-    Ul,
-    Li,
-    H1,
-    H2,
-    I,
-    Main,
-    Footer,
-    Small,
-    Div,
-    Article,
-    Grid,
-    Figure,
-    Img,
-    Form,
-    Label,
-    Input,
-    Select,
-    Option,
-    Fieldset,
-    Legend,
-    Strong,
-    A,
-    Button,
-    P,
-    Dialog,
-    FileResponse,
-    picolink,
-)
-from typing import Optional
-from sqlmodel import SQLModel, Session, create_engine, select
 import uuid
 from pathlib import Path
-from PIL import Image
-import random
+from urllib.parse import quote, urlencode
+import math
 import logging
-from models import ImageEntry, BackgroundColor, Settings, Rotation
-from image_processor import ImageProcessor
-from display import Display
+import threading
+import time
+import zlib
+from startup import StartupTimer
+
+STARTUP = StartupTimer(budget=10.0)
+
+with STARTUP.timed_import("fasthtml"):
+    from fasthtml.common import (
+        Style,
+        Link,
+        UploadFile,
+        fast_app,
+        Beforeware,
+        Title,
+        Header,
+        Nav,
+        Ul,
+        Li,
+        H1,
+        H2,
+        I,
+        Main,
+        Footer,
+        Small,
+        Div,
+        Article,
+        Grid,
+        Figure,
+        Figcaption,
+        Img,
+        Form,
+        Label,
+        Input,
+        Select,
+        Option,
+        Fieldset,
+        Legend,
+        Strong,
+        A,
+        Button,
+        P,
+        Dialog,
+        Table,
+        Thead,
+        Tbody,
+        Tr,
+        Th,
+        Td,
+        FileResponse,
+        Request,
+        Response,
+        Script,
+        Span,
+        EventStream,
+        sse_message,
+        Meta,
+    )
+with STARTUP.timed_import("sqlmodel"):
+    from sqlmodel import Session, select
+    from sqlalchemy import update
+
+with STARTUP.timed_import("app modules"):
+    from models import Album, ImageEntry, BackgroundColor, DitherMode, Settings, Rotation
+    from render_pool import (
+        RenderCoordinator,
+        RenderPool,
+        RenderPoolFull,
+        hash_original,
+        ingest_png,
+        render_buffer,
+        render_packed,
+        render_png,
+        render_quick_png,
+        store_upload,
+    )
+    from memory_budget import MemoryBudget, MemoryBudgetExceeded
+    from scheduler import Scheduler
+    from settings_service import SettingsService
+    from storage import create_storage_engine, init_db
+    from frame_slot import FrameSlot
+    from events import EventBus, EventBusFull
+    from dashboard import Dashboards
+    from fleet import Fleet, FleetFull, Panel, PanelFrame
+    from hot_folder import HotFolder
+    from frame_index import FrameInfo, frame_span, remove_frames, scan_frames, set_frames
+    from perceptual_hash import DuplicateIndex
+    from library import (
+        CandidateSet,
+        Labels,
+        gallery_page,
+        index_entry,
+        load_albums,
+        load_labels,
+        remove_labels,
+        SearchQuery,
+        search_query,
+        set_labels,
+        split_labels,
+        unindex_entry,
+    )
+    from frame_ingest import (
+        InvalidFrame,
+        PendingFrames,
+        RawFrame,
+        decompress,
+        validate_packed,
+    )
+    from fragment_cache import FragmentCache
+    from assets import Assets
+    from http_metrics import HttpMetricsMiddleware, ProfilingMiddleware
+    from profiling import TRACES, Profiler, record_stage, span
+    from metrics import (
+        REGISTRY,
+        REFRESHES,
+        DISPLAY_FAILURES,
+        CACHE_REQUESTS,
+        UPLOADS,
+    )
+    from starlette.middleware import Middleware
+    from starlette.routing import Route
+    from starlette.responses import JSONResponse
+    from display import Display, load_display
 
-try:
-    from display.edp import EPD7IN3F as DisplayToUse
+# The display is initialized in the background after startup, opening
+# the GPIO pins must not delay serving the web UI
+DISPLAY: Optional[Display] = None
+DISPLAY_INIT_LOCK = threading.Lock()
 
-    DISPLAY: Display = DisplayToUse()
-except Exception as e:
-    print(f"Error loading display: {e}")
-    from display import DummyDisplay as DisplayToUse
 
-    DISPLAY: Display = DisplayToUse()
+def get_display() -> Display:
+    global DISPLAY
+    with DISPLAY_INIT_LOCK:
+        if DISPLAY is None:
+            DISPLAY = load_display()
+            STARTUP.mark("display ready")
+        return DISPLAY
+
 
 IMAGE_EXTENSION = "png"
-ROOT = Path(__file__).parent.parent
+ROOT = Path(os.environ.get("PRISMBERRY_ROOT", Path(__file__).parent.parent))
 IMAGE_DIR = ROOT / "images"
-IMAGE_DIR.mkdir(exist_ok=True)
+IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 ORIGINAL_DIR = IMAGE_DIR / "original"
-ORIGINAL_DIR.mkdir(exist_ok=True)
+ORIGINAL_DIR.mkdir(parents=True, exist_ok=True)
 DB_DIR = ROOT / "db"
 DB_DIR.mkdir(exist_ok=True)
 DB_FILE = DB_DIR / "database.db"
+PROFILE_DIR = ROOT / "profiles"
+DASHBOARD_DIR = ROOT / "dashboards"
+# a data directory outside the checkout starts without dashboards, use the bundled ones
+if not any(DASHBOARD_DIR.glob("*.json")):
+    DASHBOARD_DIR = Path(__file__).parent.parent / "dashboards"
+ASSET_DIR = ROOT / "assets" / "dist"
 
-GLOGAL_COUNTER: int = 0
+NEXT_ENTRY_ID: Optional[str] = None
 
 MODAL_CONTAINER: str = "modal-container"
 
 
-ENGINE = create_engine(f"sqlite:///{DB_FILE}")
+ENGINE = create_storage_engine(DB_FILE)
+
+SETTINGS = SettingsService(ENGINE)
 
-IMAGE_PROCESSOR = ImageProcessor()
+RENDER_POOL = RenderPool(budget=MemoryBudget.from_env())
+RENDERS = RenderCoordinator.from_env(RENDER_POOL)
+FRAME_SLOT = FrameSlot()
+FRAGMENTS = FragmentCache()
+SETTINGS.subscribe(lambda _: FRAGMENTS.invalidate("settings"))
+DISPLAY_LOCK = threading.Lock()
+PROFILER = Profiler(PROFILE_DIR)
+EVENTS = EventBus()
+PENDING_FRAMES = PendingFrames()
+DASHBOARDS = Dashboards(DASHBOARD_DIR)
+FLEET = Fleet()
+SETTINGS.subscribe(lambda _: FLEET.invalidate_all())
+CANDIDATES = CandidateSet(ENGINE)
+SETTINGS.subscribe(lambda settings: CANDIDATES.set_scope(settings.cycle_album, settings.cycle_query))
+DUPLICATES = DuplicateIndex(lambda: load_phashes())
+GALLERY_PAGE_SIZE = 48
+# state of the panel and the name of the entry it concerns
+DISPLAY_STATE: tuple[str, Optional[str]] = ("idle", None)
 
-css = Style(".fa { margin-right: 6px; } .fa-brands { margin-right: 6px; }")
-fontawesome = Link(
-    rel="stylesheet",
-    href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css",
+ASSETS = Assets(ASSET_DIR)
+css = Style(
+    ":root { --pico-font-size: 100%; } .fa { margin-right: 6px; } .fa-brands { margin-right: 6px; }"
+)
+# FastHTML's default headers load from CDNs, the UI must also work without internet access
+hdrs = (
+    Meta(charset="utf-8"),
+    Meta(name="viewport", content="width=device-width, initial-scale=1, viewport-fit=cover"),
+    Link(rel="stylesheet", href=ASSETS.url("pico.css")),
+    Link(rel="stylesheet", href=ASSETS.url("fontawesome.css")),
+    *(
+        Link(rel="preload", href=ASSETS.url(font), _as="font", type="font/woff2", crossorigin="")
+        for font in ("fa-solid-900.woff2", "fa-brands-400.woff2")
+        if ASSETS.built
+    ),
+    Script(src=ASSETS.url("htmx.js")),
+    Script(src=ASSETS.url("sse.js")),
+    css,
 )
-app, rt = fast_app(live=False, hdrs=(picolink, fontawesome, css), pico=True)
+
+
+async def asset(request: Request):
+    """
+    Built UI assets, fingerprinted so browsers can keep them forever
+    """
+    found = ASSETS.resolve(request.path_params["file"], request.headers.get("accept-encoding", ""))
+    if found is None:
+        return Response(status_code=404)
+    path, media_type, encoding = found
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+def record_first_request(req):
+    STARTUP.first_request()
+
+
+app, rt = fast_app(
+    live=False,
+    hdrs=hdrs,
+    default_hdrs=False,
+    pico=False,
+    before=Beforeware(record_first_request),
+    # ahead of FastHTML's static file route, which matches the same extensions
+    routes=[Route("/assets/{file}", asset)],
+    middleware=[
+        Middleware(HttpMetricsMiddleware),
+        Middleware(ProfilingMiddleware, profiler=PROFILER),
+    ],
+)
+
+
+def publish(event: str, element: Any, key: Optional[str] = None):
+    """
+    Push an HTML fragment to all connected browsers, `key` defaults to the event name
+    """
+    EVENTS.publish(sse_message(element, event=event), key or event)
+
+
+DISPLAY_ICONS = {
+    "idle": "fa-moon",
+    "rendering": "fa-spinner fa-spin",
+    "refreshing": "fa-sync fa-spin",
+    "shown": "fa-check",
+    "failed": "fa-exclamation-triangle",
+}
+
+
+def render_display_status():
+    state, name = DISPLAY_STATE
+    return Span(I(cls=f"fa {DISPLAY_ICONS[state]}"), f"Display: {state}", f" ({name})" if name else "")
+
+
+def render_queue_status(in_flight: int):
+    return Span(I(cls="fa fa-layer-group"), f"{in_flight} render jobs") if in_flight else Span()
+
+
+def render_job_status():
+    running = TRACES.running()
+    if not running:
+        return Span()
+    return Span(I(cls="fa fa-cogs"), ", ".join(trace.name for trace in running))
+
+
+def set_display_state(state: str, name: Optional[str] = None):
+    global DISPLAY_STATE
+    DISPLAY_STATE = (state, name)
+    publish("display", render_display_status())
+
+
+RENDER_POOL.subscribe(lambda in_flight: publish("queue", render_queue_status(in_flight)))
+TRACES.subscribe(lambda _: publish("jobs", render_job_status()))
+
+
+@app.get("/events")
+async def events(request: Request):
+    """
+    Server-sent events with display state, render queue, running jobs and new images
+    """
+    try:
+        stream = EVENTS.stream(
+            request.is_disconnected,
+            initial=[
+                sse_message(render_display_status(), event="display"),
+                sse_message(render_queue_status(RENDER_POOL.in_flight), event="queue"),
+                sse_message(render_job_status(), event="jobs"),
+            ],
+        )
+    except EventBusFull as e:
+        return Response(str(e), status_code=503)
+    return EventStream(stream)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(
+        REGISTRY.exposition(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def render_profiling():
+    targets = ["display"] + sorted(
+        {route.path for route in app.routes if hasattr(route, "path")}
+    )
+    armed = PROFILER.armed
+    return Div(
+        H1(I(cls="fa fa-stopwatch"), "Profiling"),
+        Form(
+            Grid(
+                Label(
+                    "Target",
+                    Select(*[Option(target, value=target) for target in targets], name="target"),
+                ),
+                Label("Count", Input(type="number", name="count", value=1, min=1)),
+            ),
+            Input(type="submit", value="Arm"),
+            hx_post="/profiling",
+            hx_trigger="submit",
+            target_id="content",
+        ),
+        P(
+            Strong("Armed: "),
+            ", ".join(f"{target} ({count})" for target, count in armed.items()),
+        )
+        if armed
+        else None,
+        P(
+            Strong("Renders: "),
+            f"{RENDERS.in_flight} running, {RENDERS.queued} queued, "
+            f"{RENDERS.deduplicated} shared, {RENDERS.rejected} rejected",
+        ),
+        H2("Profiles"),
+        Ul(
+            *[
+                Li(A(path.name, href=f"/profiling/{path.name}"))
+                for path in PROFILER.files()
+            ]
+        ),
+        H2("Recent Jobs"),
+        Table(
+            Thead(
+                Tr(Th("Started"), Th("Job"), Th("Duration"), Th("Peak Memory"), Th("Stages"))
+            ),
+            Tbody(
+                *[
+                    Tr(
+                        Td(trace.started.strftime("%H:%M:%S")),
+                        Td(trace.name),
+                        Td(f"{trace.duration:.2f}s"),
+                        Td(
+                            f"{trace.peak_memory / 2**20:.0f} MiB"
+                            if trace.peak_memory
+                            else ""
+                        ),
+                        Td(
+                            ", ".join(
+                                f"{stage} {duration * 1000:.0f}ms"
+                                for stage, duration in trace.spans
+                            )
+                        ),
+                    )
+                    for trace in TRACES.recent()
+                ]
+            ),
+        ),
+    )
+
+
+@app.get("/profiling")
+async def profiling():
+    return render_profiling()
+
+
+@app.post("/profiling")
+async def arm_profiler(target: str, count: int = 1):
+    if count > 0:
+        PROFILER.arm(target, count)
+    return render_profiling()
+
+
+@app.get("/profiling/{name}")
+async def download_profile(name: str):
+    path = PROFILER.file(name)
+    if path is None:
+        return Response("Profile not found", status_code=404)
+    return FileResponse(path, filename=path.name)
 
 
 @app.get("/")
-def root():
+async def root():
     content = Div(id="content", cls="modal-is-opening")
     return (
         Title("PrismBerry"),
@@ -106,6 +422,16 @@ def root():
                     )
                 ),
                 Ul(
+                    Li(
+                        A(
+                            I(cls="fa fa-clone"),
+                            "Duplicates",
+                            cls="contrast",
+                            hx_get="/duplicates",
+                            hx_trigger="click",
+                            target_id="content",
+                        )
+                    ),
                     Li(
                         A(
                             I(cls="fa fa-cog"),
@@ -130,15 +456,23 @@ def root():
             cls="container",
         ),
         Main(
+            Div(
+                Small(render_display_status(), id="display-status", sse_swap="display"),
+                Small(id="queue-status", sse_swap="queue"),
+                Small(id="job-status", sse_swap="jobs"),
+                style="display: flex; gap: 1rem;",
+            ),
             Div(hx_get="/images", hx_trigger="load", target_id="content"),
             content,
             cls="container",
+            hx_ext="sse",
+            sse_connect="/events",
         ),
         Footer(Small("Build with love <3"), cls="container"),
     )
 
 
-def render_settings(settings: Settings):
+def render_settings(settings: Settings, albums: list[Album]):
     return Div(
         H1(I(cls="fa fa-cog"), "Settings"),
         Form(
@@ -151,8 +485,76 @@ def render_settings(settings: Settings):
             ),
             Label(
                 "Cycle Time",
-                Input(value=settings.cycle_time, type="number", name="cycle_time"),
-                data_tooltip="Cycle time in Minutes",
+                Input(
+                    value=settings.cycle_seconds,
+                    type="number",
+                    min=1,
+                    name="cycle_seconds",
+                ),
+                data_tooltip="Cycle time in Seconds",
+            ),
+            Label(
+                "Schedule",
+                Input(
+                    value=settings.cron or "",
+                    type="text",
+                    name="cron",
+                    placeholder="*/30 * * * *",
+                ),
+                data_tooltip="Cron expression, overrides the cycle time if set",
+            ),
+            Grid(
+                Label(
+                    "Quiet Hours Start",
+                    Input(
+                        value=settings.quiet_start or "",
+                        type="time",
+                        name="quiet_start",
+                    ),
+                ),
+                Label(
+                    "Quiet Hours End",
+                    Input(
+                        value=settings.quiet_end or "",
+                        type="time",
+                        name="quiet_end",
+                    ),
+                ),
+            ),
+            Label(
+                "Dashboard",
+                Select(
+                    Option("None, show images", value="", selected=not settings.dashboard),
+                    *[
+                        Option(name, value=name, selected=settings.dashboard == name)
+                        for name in DASHBOARDS.names()
+                    ],
+                    name="dashboard",
+                ),
+                data_tooltip=f"Shows a dashboard from {DASHBOARD_DIR} instead of the images",
+            ),
+            Grid(
+                Label(
+                    "Cycle Album",
+                    Select(
+                        Option("All images", value="", selected=settings.cycle_album is None),
+                        *[
+                            Option(album.name, value=album.id, selected=settings.cycle_album == album.id)
+                            for album in albums
+                        ],
+                        name="cycle_album",
+                    ),
+                ),
+                Label(
+                    "Cycle Search",
+                    Input(
+                        value=settings.cycle_query or "",
+                        type="search",
+                        name="cycle_query",
+                        placeholder="tag:beach",
+                    ),
+                    data_tooltip="Only cycle through images matching this search",
+                ),
             ),
             Input(type="submit", value="Save"),
             hx_post="/settings",
@@ -162,29 +564,47 @@ def render_settings(settings: Settings):
     )
 
 
-@app.get("/settings")
-def settings():
+def load_album_list() -> list[Album]:
     with Session(ENGINE) as session:
-        settings = session.exec(select(Settings)).first()
-        if settings:
-            return render_settings(settings)
+        return load_albums(session)
+
+
+async def build_settings():
+    return render_settings(SETTINGS.get(), await asyncio.to_thread(load_album_list))
+
+
+@app.get("/settings")
+async def settings(request: Request):
+    return await FRAGMENTS.respond(request, "settings", build_settings)
 
 
 @app.post("/settings")
-def update_settings(cycle: Optional[bool] = None, cycle_time: Optional[int] = None):
-    with Session(ENGINE) as session:
-        settings = session.exec(select(Settings)).first()
-        if settings:
-            if cycle is not None:
-                settings.cycle = True
-            else:
-                settings.cycle = False
-
-            if cycle_time and int(cycle_time) > 0:
-                settings.cycle_time = cycle_time
-            session.add(settings)
-            session.commit()
-            return render_settings(settings)
+async def update_settings(
+    cycle: Optional[bool] = None,
+    cycle_seconds: Optional[int] = None,
+    cron: Optional[str] = None,
+    quiet_start: Optional[str] = None,
+    quiet_end: Optional[str] = None,
+    dashboard: Optional[str] = None,
+    cycle_album: Optional[str] = None,
+    cycle_query: Optional[str] = None,
+):
+    changes = dict(
+        cycle=cycle is not None,
+        cron=cron or None,
+        quiet_start=quiet_start or None,
+        quiet_end=quiet_end or None,
+        dashboard=dashboard or None,
+        cycle_album=int(cycle_album) if cycle_album else None,
+        cycle_query=cycle_query or None,
+    )
+    if cycle_seconds is not None:
+        changes["cycle_seconds"] = cycle_seconds
+    try:
+        settings = await asyncio.to_thread(SETTINGS.update, **changes)
+    except ValueError as e:
+        return message_modal("Error", P(str(e)), content_route="/settings")
+    return render_settings(settings, await asyncio.to_thread(load_album_list))
 
 
 def render_image_options(entry: ImageEntry):
@@ -205,6 +625,27 @@ def render_image_options(entry: ImageEntry):
             ),
             "Dithering",
         ),
+        Label(
+            "Dithering Mode",
+            Select(
+                Option(
+                    "Floyd-Steinberg",
+                    selected=entry.dither_mode == DitherMode.FloydSteinberg,
+                    value="floyd-steinberg",
+                ),
+                Option(
+                    "Floyd-Steinberg (parallel)",
+                    selected=entry.dither_mode == DitherMode.Parallel,
+                    value="parallel",
+                ),
+                Option(
+                    "Ordered",
+                    selected=entry.dither_mode == DitherMode.Ordered,
+                    value="ordered",
+                ),
+                name="dither_mode",
+            ),
+        ),
         Label(
             "Background Color",
             Select(
@@ -247,26 +688,105 @@ def render_image_options(entry: ImageEntry):
                 name="rotation",
             ),
         ),
+        Label(
+            f"Frame (of {entry.frame_count})",
+            Input(
+                type="number",
+                name="frame",
+                value=entry.frame + 1,
+                min=1,
+                max=entry.frame_count,
+            ),
+        )
+        if entry.frame_count > 1
+        else None,
         id=f"options-{entry.id}",
-        hx_trigger=f"change from:#options-{entry.id}",
-        hx_include=f"#options-{entry.id} *",
+        # wait for a pause in edits and drop a pending update when the next one starts
+        hx_trigger=f"change delay:400ms from:#options-{entry.id}",
+        hx_sync="this:replace",
+        hx_include=f"#options-{entry.id} *, #preview-{entry.id} input",
         hx_patch=f"/update/{entry.id}",
         hx_swap="outerHTML",
     )
 
 
-def render_image(entry: ImageEntry):
+def preview_loader(entry: ImageEntry, exact: bool, oob: bool = False) -> Div:
+    """
+    Requests the next preview step as soon as it is swapped in
+    """
+    return Div(
+        id=f"preview-loader-{entry.id}",
+        hx_get=f"/preview/{entry.id}?key={entry.options_token()}"
+        + ("&exact=true" if exact else ""),
+        hx_trigger="load",
+        hx_target=f"#preview-{entry.id}",
+        hx_swap="outerHTML",
+        hx_swap_oob="true" if oob else None,
+    )
+
+
+def render_preview(
+    id: str,
+    png: Optional[bytes] = None,
+    status: str = "",
+    loader: Optional[Div] = None,
+) -> Div:
+    """
+    Inline preview next to the options, while it is shown option changes re-render it
+    """
+    return Div(
+        Img(
+            src=f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}",
+            style="width: 100%; height: auto;",
+        )
+        if png
+        else None,
+        Small(status),
+        A(
+            "Close Preview",
+            href="#",
+            hx_get=f"/preview/{id}/close",
+            target_id=f"preview-{id}",
+            hx_swap="outerHTML",
+        ),
+        Input(type="hidden", name="live", value="true"),
+        loader or Div(id=f"preview-loader-{id}"),
+        id=f"preview-{id}",
+    )
+
+
+def render_labels(id: str, labels: Labels):
+    return Form(
+        Grid(
+            Label(
+                "Tags",
+                Input(value=", ".join(labels.tags), type="text", name="tags", placeholder="beach, family"),
+            ),
+            Label(
+                "Albums",
+                Input(value=", ".join(labels.albums), type="text", name="albums", placeholder="Holidays"),
+            ),
+        ),
+        id=f"labels-{id}",
+        hx_post=f"/labels/{id}",
+        hx_trigger="change",
+        hx_swap="outerHTML",
+    )
+
+
+def render_image(entry: ImageEntry, labels: Optional[Labels] = None):
     return Article(
         H2(entry.name),
         Grid(
             Figure(
                 Img(
-                    src=f"/images/original/{entry.id}.{IMAGE_EXTENSION}",
+                    src=f"/originals/{entry.id}",
                     style="width: 100%; height: auto;",
                 )
             ),
             Div(
                 render_image_options(entry),
+                render_labels(entry.id, labels or Labels()),
                 Label(
                     Strong(
                         A(
@@ -274,10 +794,12 @@ def render_image(entry: ImageEntry):
                             href="#",
                             hx_get=f"/preview/{entry.id}",
                             hx_trigger="click",
-                            target_id=MODAL_CONTAINER,
+                            target_id=f"preview-{entry.id}",
+                            hx_swap="outerHTML",
                         )
                     )
                 ),
+                Div(id=f"preview-{entry.id}"),
                 Grid(
                     Button(
                         I(cls="fa fa-image"),
@@ -303,24 +825,157 @@ def render_image(entry: ImageEntry):
     )
 
 
+def load_gallery_page(
+    query: Optional[SearchQuery],
+    album: Optional[int],
+    after: Optional[tuple[str, str]],
+    uncached: Callable[[str], bool],
+) -> tuple[list[ImageEntry], dict[str, Labels]]:
+    """
+    A page of entries and the labels of those whose fragment has to be rendered
+    """
+    with Session(ENGINE) as session:
+        entries = gallery_page(session, query, album, after, GALLERY_PAGE_SIZE)
+        labels = load_labels(session, [entry.id for entry in entries if uncached(entry.id)])
+        return entries, labels
+
+
+def load_entry(id: str) -> Optional[ImageEntry]:
+    with Session(ENGINE) as session:
+        return session.get(ImageEntry, id)
+
+
+async def gallery_articles(
+    q: Optional[str], album: Optional[int], after: Optional[tuple[str, str]] = None
+) -> tuple[list[Any], Any]:
+    """
+    The articles of one gallery page and the button loading the next one,
+    which replaces the previous button out of band on the following pages
+    """
+    version = FRAGMENTS.version("images")
+    entries, labels = await asyncio.to_thread(
+        load_gallery_page,
+        search_query(q) if q else None,
+        album,
+        after,
+        lambda id: not FRAGMENTS.cached(id),
+    )
+    articles = [
+        FRAGMENTS.fragment(
+            "images", version, entry.id, lambda e=entry: render_image(e, labels.get(e.id))
+        )
+        for entry in entries
+    ]
+    oob = "true" if after else None
+    more = Div(id="gallery-more", hx_swap_oob=oob)
+    if len(entries) == GALLERY_PAGE_SIZE:
+        last = entries[-1]
+        params = urlencode(
+            {"q": q or "", "album": album or "", "after_name": last.name, "after_id": last.id}
+        )
+        more = Div(
+            Button(
+                "Load more",
+                cls="secondary",
+                hx_get=f"/images/more?{params}",
+                hx_target="#gallery",
+                hx_swap="beforeend",
+            ),
+            id="gallery-more",
+            hx_swap_oob=oob,
+        )
+    return articles, more
+
+
+def render_gallery_filter(albums: list[Album]):
+    return Form(
+        Grid(
+            Input(type="search", name="q", placeholder="Search names and tags, tag:beach"),
+            Select(
+                Option("All albums", value=""),
+                *[Option(album.name, value=album.id) for album in albums],
+                name="album",
+            ),
+        ),
+        hx_get="/images/results",
+        hx_trigger="input changed delay:300ms, change, submit",
+        hx_target="#gallery-results",
+        hx_sync="this:replace",
+    )
+
+
+async def build_gallery():
+    articles, more = await gallery_articles(None, None)
+    return Div(
+        reset_modal(),
+        render_gallery_filter(await asyncio.to_thread(load_album_list)),
+        Div(
+            # new images are appended in place when they are added
+            Div(*articles, id="gallery", sse_swap="images", hx_swap="beforeend"),
+            more,
+            id="gallery-results",
+        ),
+        hx_swap="innerHTML",
+    )
+
+
 @app.get("/images")
-def render_images():
-    articles = []
+async def render_images(request: Request):
+    return await FRAGMENTS.respond(request, "images", build_gallery)
+
+
+@app.get("/images/results")
+async def filter_images(q: Optional[str] = None, album: Optional[str] = None):
+    """
+    The first page of the gallery matching the filter, not page cached
+    """
+    articles, more = await gallery_articles(q, int(album) if album else None)
+    unfiltered = not q and not album
+    return (
+        Div(*articles, id="gallery", sse_swap="images" if unfiltered else None, hx_swap="beforeend"),
+        more,
+    )
+
+
+@app.get("/images/more")
+async def more_images(
+    after_name: str, after_id: str, q: Optional[str] = None, album: Optional[str] = None
+):
+    articles, more = await gallery_articles(
+        q, int(album) if album else None, (after_name, after_id)
+    )
+    return (*articles, more)
+
+
+def update_labels(id: str, tags: list[str], albums: list[str]) -> Optional[Labels]:
     with Session(ENGINE) as session:
-        for entry in session.exec(select(ImageEntry)):
-            articles.append(render_image(entry))
+        if session.get(ImageEntry, id) is None:
+            return None
+        set_labels(session, id, tags, albums)
+        session.commit()
+        return load_labels(session, [id])[id]
+
 
-    return Div(reset_modal(), *articles, hx_swap="innerHTML")
+@app.post("/labels/{id}")
+async def labels(id: str, tags: Optional[str] = None, albums: Optional[str] = None):
+    updated = await asyncio.to_thread(update_labels, id, split_labels(tags), split_labels(albums))
+    if updated is None:
+        return
+    CANDIDATES.changed(id)
+    FRAGMENTS.invalidate("images", id)
+    # new albums show up in the gallery filter and the settings
+    FRAGMENTS.invalidate("settings")
+    return render_labels(id, updated)
 
 
 # For images, CSS, etc.
 @app.get("/{fname:path}.{ext:static}")
-def static(fname: str, ext: str):
+async def static(fname: str, ext: str):
     return FileResponse(f"{fname}.{ext}")
 
 
 @app.get("/add")
-def build_add_dialogue():
+async def build_add_dialogue():
     return Dialog(
         Article(
             Header(H2("Add Image")),
@@ -406,8 +1061,56 @@ def message_modal(
     )
 
 
+def insert_entry(entry: ImageEntry, frames: Sequence[FrameInfo] = ()):
+    with Session(ENGINE) as session:
+        entry.frame_count = max(1, len(frames))
+        session.add(entry)
+        session.flush()
+        set_frames(session, entry.id, list(frames))
+        index_entry(session, entry.id)
+        session.commit()
+        # the caller keeps using the entry once the session is closed
+        session.refresh(entry)
+    CANDIDATES.changed(entry.id)
+
+
+def add_entry(entry: ImageEntry, frames: Sequence[FrameInfo] = ()):
+    """
+    Insert an entry whose original is stored and append it to open galleries
+    """
+    insert_entry(entry, frames)
+    if entry.phash:
+        DUPLICATES.add(entry.id, entry.phash)
+    FRAGMENTS.invalidate("images")
+    publish("images", render_image(entry), key=f"image-{entry.id}")
+
+
+def load_phashes() -> list[tuple[str, str]]:
+    with Session(ENGINE) as session:
+        return list(
+            session.exec(select(ImageEntry.id, ImageEntry.phash).where(ImageEntry.phash.is_not(None)))
+        )
+
+
+def load_names(ids: list[str]) -> dict[str, str]:
+    with Session(ENGINE) as session:
+        # a Result has keys(), dict() would take it for a mapping
+        return dict(session.exec(select(ImageEntry.id, ImageEntry.name).where(ImageEntry.id.in_(ids))).all())
+
+
+def find_duplicates(entry: ImageEntry) -> list[str]:
+    """
+    Names of the entries that look like near-duplicates of `entry`
+    """
+    if not entry.phash:
+        return []
+    ids = [id for _, id in DUPLICATES.similar(entry.phash, exclude=entry.id)]
+    names = load_names(ids)
+    return [names[id] for id in ids if id in names]
+
+
 @app.post("/add")
-def add_image(
+async def add_image(
     name: str,
     file: UploadFile,
     grayscale: Optional[bool] = None,
@@ -415,7 +1118,7 @@ def add_image(
     background_color: BackgroundColor = BackgroundColor.Black,
 ):
     try:
-        image = Image.open(file.file)
+        data = await file.read()
         id = str(uuid.uuid4())
         new_entry = ImageEntry(
             name=name,
@@ -424,40 +1127,86 @@ def add_image(
             dither=True if dithering else False,
             background_color=background_color,
         )
-        with Session(ENGINE) as session:
-            session.add(new_entry)
-            image.save(ORIGINAL_DIR / f"{id}.{IMAGE_EXTENSION}")
-            session.commit()
+        hashes, frames = await RENDER_POOL.run(
+            store_upload, data, str(ORIGINAL_DIR / f"{id}.{IMAGE_EXTENSION}")
+        )
+        for key, value in hashes.items():
+            setattr(new_entry, key, value)
+        await asyncio.to_thread(add_entry, new_entry, frames)
+        UPLOADS.inc(result="success")
+        duplicates = await asyncio.to_thread(find_duplicates, new_entry)
+        if duplicates:
+            return message_modal(
+                "Success",
+                Div(
+                    P("Image added successfully!"),
+                    P(f"It looks like a duplicate of {', '.join(duplicates)}."),
+                ),
+            )
         return message_modal("Success", P("Image added successfully!"))
 
     except Exception as e:
+        UPLOADS.inc(result="error")
         return message_modal("Error", P(str(e)))
 
 
-@app.patch("/update/{id}")
-def update_image(
-    id: str,
-    grayscale: Optional[bool] = None,
-    dithering: Optional[bool] = None,
-    background_color: BackgroundColor = BackgroundColor.Black,
-    rotation: str = "None",
-):
+def update_entry(id: str, **changes: Any) -> Optional[ImageEntry]:
     with Session(ENGINE) as session:
         statement = select(ImageEntry).where(ImageEntry.id == id)
         result = session.exec(statement)
         entry = result.one_or_none()
         if entry:
-            entry.grayscale = True if grayscale else False
-            entry.dither = True if dithering else False
-            entry.background_color = background_color
-            entry.rotation = Rotation.from_str(rotation)
+            for key, value in changes.items():
+                setattr(entry, key, value)
+            entry.frame %= entry.frame_count
             session.add(entry)
+            if "name" in changes:
+                session.flush()
+                index_entry(session, entry.id)
             session.commit()
-            return render_image_options(entry)
+            session.refresh(entry)
+            FRAME_SLOT.discard(entry.id)
+            FLEET.invalidate(entry.id)
+            FRAGMENTS.invalidate("images", entry.id)
+            if "name" in changes:
+                # the name may move the entry into or out of a search scoped cycle
+                CANDIDATES.changed(entry.id)
+        return entry
 
 
-@app.delete("/delete/{id}")
-def delete(id: str):
+@app.patch("/update/{id}")
+async def update_image(
+    id: str,
+    grayscale: Optional[bool] = None,
+    dithering: Optional[bool] = None,
+    dither_mode: DitherMode = DitherMode.FloydSteinberg,
+    background_color: BackgroundColor = BackgroundColor.Black,
+    rotation: str = "None",
+    frame: Optional[int] = None,
+    live: Optional[bool] = None,
+):
+    changes = dict(
+        grayscale=True if grayscale else False,
+        dither=True if dithering else False,
+        dither_mode=dither_mode,
+        background_color=background_color,
+        rotation=Rotation.from_str(rotation),
+    )
+    if frame is not None:
+        # numbered from 1 in the form, update_entry wraps out of range numbers around
+        changes["frame"] = frame - 1
+    entry = await asyncio.to_thread(update_entry, id, **changes)
+    if entry and live:
+        # restart the open preview with the new options, the current image stays until then
+        return render_image_options(entry), preview_loader(entry, exact=False, oob=True)
+    if entry:
+        return render_image_options(entry)
+
+
+def delete_entry(id: str) -> Optional[ImageEntry]:
+    """
+    Delete the entry and its image, returns the entry if deleting failed
+    """
     with Session(ENGINE) as session:
         statement = select(ImageEntry).where(ImageEntry.id == id)
         result = session.exec(statement)
@@ -465,99 +1214,685 @@ def delete(id: str):
 
         try:
             if entry_to_delete:
+                unindex_entry(session, entry_to_delete.id)
+                remove_labels(session, entry_to_delete.id)
+                remove_frames(session, entry_to_delete.id)
                 # Delete the record
                 session.delete(entry_to_delete)
                 # Commit the transaction
                 session.commit()
+                FRAME_SLOT.discard(entry_to_delete.id)
+                FLEET.invalidate(entry_to_delete.id)
+                CANDIDATES.removed(entry_to_delete.id)
+                DUPLICATES.remove(entry_to_delete.id)
+                FRAGMENTS.invalidate("images", entry_to_delete.id)
                 # Delete the image
                 if (ORIGINAL_DIR / f"{entry_to_delete.id}.{IMAGE_EXTENSION}").exists():
                     (ORIGINAL_DIR / f"{entry_to_delete.id}.{IMAGE_EXTENSION}").unlink()
                 return None
 
         except Exception:
-            return render_image(entry_to_delete)
+            return entry_to_delete
 
 
-@app.get("/preview/{id}")
-def get_preview(id: str):
+HOT_FOLDER_DIR = os.environ.get("PRISMBERRY_HOT_FOLDER")
+
+
+def load_sources() -> set[str]:
+    with Session(ENGINE) as session:
+        return set(session.exec(select(ImageEntry.source).where(ImageEntry.source.is_not(None))))
+
+
+def load_source_entry(source: str) -> Optional[ImageEntry]:
+    with Session(ENGINE) as session:
+        return session.exec(select(ImageEntry).where(ImageEntry.source == source)).first()
+
+
+def store_original(data: bytes, id: str) -> tuple[dict[str, str], list[FrameInfo]]:
+    # the hot folder runs on its own workers, wait for room in the render pool
+    while True:
+        try:
+            return RENDER_POOL.call(store_upload, data, str(ORIGINAL_DIR / f"{id}.{IMAGE_EXTENSION}"))
+        except RenderPoolFull:
+            time.sleep(1)
+
+
+def restore_entries() -> int:
+    """
+    Add an entry for every original without one, after the database had to
+    be recreated. Names and options are lost, hashes are computed again.
+    """
+    with Session(ENGINE) as session:
+        known = set(session.exec(select(ImageEntry.id)))
+    restored = 0
+    for path in sorted(ORIGINAL_DIR.glob(f"*.{IMAGE_EXTENSION}")):
+        if path.stem in known:
+            continue
+        frames = scan_frames(str(path))
+        insert_entry(ImageEntry(id=path.stem, name=path.stem), frames if len(frames) > 1 else ())
+        restored += 1
+    return restored
+
+
+def replace_frames(id: str, frames: list[FrameInfo]):
     with Session(ENGINE) as session:
-        entry = session.get(ImageEntry, id)
+        set_frames(session, id, frames)
+        session.commit()
+
+
+def ingest_hot_file(source: str, path: Path):
+    """
+    Import a file from the hot folder like an upload, or replace the original of its entry
+    """
+    data = path.read_bytes()
+    entry = load_source_entry(source)
+    try:
         if entry is None:
-            return message_modal(
-                "Preview",
-                P("Image not found!"),
-                content_route="/reset_modal",
-                target=MODAL_CONTAINER,
+            id = str(uuid.uuid4())
+            hashes, frames = store_original(data, id)
+            add_entry(ImageEntry(id=id, name=path.stem, source=source, **hashes), frames)
+        else:
+            hashes, frames = store_original(data, entry.id)
+            replace_frames(entry.id, frames)
+            update_entry(entry.id, frame=0, frame_count=max(1, len(frames)), **hashes)
+            DUPLICATES.add(entry.id, hashes["phash"])
+    except Exception:
+        UPLOADS.inc(result="error")
+        raise
+    UPLOADS.inc(result="success")
+    logging.info(f"Imported {source} from the hot folder")
+
+
+def remove_hot_file(source: str):
+    entry = load_source_entry(source)
+    if entry is None:
+        return
+    if delete_entry(entry.id) is None:
+        publish("images", Div(id=f"article-{entry.id}", hx_swap_oob="delete"), key=f"image-{entry.id}")
+        logging.info(f"Removed {source}, it was deleted from the hot folder")
+
+
+def rename_hot_file(old: str, new: str):
+    entry = load_source_entry(old)
+    if entry is not None:
+        update_entry(entry.id, source=new, name=Path(new).stem)
+
+
+HOT_FOLDER = (
+    HotFolder(Path(HOT_FOLDER_DIR), load_sources, ingest_hot_file, remove_hot_file, rename_hot_file)
+    if HOT_FOLDER_DIR
+    else None
+)
+
+
+def load_duplicate_groups() -> list[list[ImageEntry]]:
+    groups = DUPLICATES.groups()
+    with Session(ENGINE) as session:
+        entries = {
+            entry.id: entry
+            for entry in session.exec(
+                select(ImageEntry).where(ImageEntry.id.in_([id for group in groups for id in group]))
+            )
+        }
+    groups = [[entries[id] for id in group if id in entries] for group in groups]
+    return [sorted(group, key=lambda entry: entry.name) for group in groups if len(group) > 1]
+
+
+def render_duplicate(entry: ImageEntry):
+    return Figure(
+        Img(
+            src=f"/originals/{entry.id}",
+            style="width: 100%; height: auto;",
+        ),
+        Figcaption(
+            entry.name,
+            Button(
+                I(cls="fa fa-trash"),
+                "Delete",
+                cls="secondary outline",
+                hx_delete=f"/delete/{entry.id}",
+                hx_confirm=f"Delete {entry.name}?",
+                target_id=f"duplicate-{entry.id}",
+                hx_swap="delete",
+            ),
+            style="display: flex; justify-content: space-between; align-items: center;",
+        ),
+        id=f"duplicate-{entry.id}",
+    )
+
+
+@app.get("/duplicates")
+async def duplicates():
+    groups = await asyncio.to_thread(load_duplicate_groups)
+    if not groups:
+        return Div(H1(I(cls="fa fa-clone"), "Duplicates"), P("No near-duplicates found."))
+    return Div(
+        H1(I(cls="fa fa-clone"), "Duplicates"),
+        *(
+            Article(
+                Grid(*(render_duplicate(entry) for entry in group)),
+            )
+            for group in groups
+        ),
+    )
+
+
+@app.delete("/delete/{id}")
+async def delete(id: str):
+    failed = await asyncio.to_thread(delete_entry, id)
+    if failed:
+        return render_image(failed)
+
+
+def render_options(entry: ImageEntry) -> dict:
+    """
+    Options of the render jobs, with the byte range of the shown frame of multi-frame originals
+    """
+    options = entry.model_dump()
+    if entry.frame_count > 1:
+        with Session(ENGINE) as session:
+            options["frame_span"] = frame_span(session, entry.id, entry.frame)
+    return options
+
+
+def read_first_frame(path: Path, id: str) -> Optional[bytes]:
+    """
+    The bytes of the first frame of a multi-frame original, None for single frame originals
+    """
+    with Session(ENGINE) as session:
+        span = frame_span(session, id, 0)
+    if span is None:
+        return None
+    offset, length = span
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+@app.get("/originals/{id}")
+async def original(id: str):
+    """
+    The stored original for thumbnails, of multi-frame originals only the first frame
+    """
+    path = ORIGINAL_DIR / f"{id}.{IMAGE_EXTENSION}"
+    if path.parent != ORIGINAL_DIR or not path.is_file():
+        return Response(status_code=404)
+    data = await asyncio.to_thread(read_first_frame, path, id)
+    if data is None:
+        return FileResponse(path)
+    return Response(data, media_type="image/png")
+
+
+@app.get("/preview/{id}")
+async def get_preview(id: str, key: Optional[str] = None, exact: bool = False):
+    """
+    A fast undithered approximation first, which then loads the exact frame
+    """
+    entry = await asyncio.to_thread(load_entry, id)
+    if entry is None:
+        return render_preview(id, status="Image not found!")
+    if key is not None and key != entry.options_token():
+        # the options changed since this was requested, a newer request follows
+        return Response(status_code=204)
+
+    render = render_png if exact else render_quick_png
+    try:
+        with TRACES.job(f"{'preview' if exact else 'quick preview'} {entry.name}"):
+            png = await RENDERS.run_latest(
+                f"{render.__name__}-{entry.id}",
+                (render.__name__, entry.id, entry.options_key()),
+                render,
+                str(ORIGINAL_DIR / f"{entry.id}.{IMAGE_EXTENSION}"),
+                await asyncio.to_thread(render_options, entry),
             )
+    except (RenderPoolFull, MemoryBudgetExceeded) as e:
+        return render_preview(entry.id, status=str(e))
+    if png is None:
+        # superseded by a request with newer options
+        return Response(status_code=204)
+    if exact:
+        return render_preview(entry.id, png, "Exact preview")
+    return render_preview(
+        entry.id,
+        png,
+        "Approximate preview, rendering the exact frame...",
+        preview_loader(entry, exact=True),
+    )
+
+
+@app.get("/preview/{id}/close")
+async def close_preview(id: str):
+    return Div(id=f"preview-{id}")
+
+
+def render_frame(entry: ImageEntry) -> list[int]:
+    # the scheduler, prepared frames and users displaying the same entry share one render
+    return RENDERS.call(
+        ("render_buffer", entry.id, entry.options_key()),
+        render_buffer,
+        str(ORIGINAL_DIR / f"{entry.id}.{IMAGE_EXTENSION}"),
+        render_options(entry),
+        get_display().buffer_packer(),
+    )
+
+
+def prepare_frame(id: str):
+    try:
+        with Session(ENGINE) as session:
+            entry = session.get(ImageEntry, id)
+            if entry is None:
+                return
+            with TRACES.job(f"prepare {entry.name}"):
+                FRAME_SLOT.put(entry, render_frame(entry))
+            logging.info(f"Prepared next frame: {entry.name}")
+    except Exception as e:
+        logging.error(f"Error preparing frame for {id}: {e}")
+
+
+def prepare_frame_in_background(id: str):
+    threading.Thread(target=prepare_frame, args=(id,), daemon=True).start()
+
+
+def show_entry(entry: ImageEntry, prepare_next: Optional[str] = None):
+    with TRACES.job(f"display {entry.name}"), PROFILER.profile("display"):
+        _show_entry(entry, prepare_next)
+
+
+def _show_entry(entry: ImageEntry, prepare_next: Optional[str] = None):
+    started = time.perf_counter()
+    buffer = FRAME_SLOT.take(entry)
+    CACHE_REQUESTS.inc(cache="frame", result="miss" if buffer is None else "hit")
+    if buffer is None:
+        set_display_state("rendering", entry.name)
+        try:
+            buffer = render_frame(entry)
+        except Exception:
+            DISPLAY_FAILURES.inc()
+            set_display_state("failed", entry.name)
+            raise
+    write_frame(buffer, entry.name, started, prepare_next)
+
+
+def write_frame(
+    buffer: Sequence[int],
+    name: str,
+    started: float,
+    prepare_next: Optional[str] = None,
+) -> dict[str, float]:
+    """
+    Send a packed frame to the panel, returns the duration of init and refresh
+    """
+    timings = {}
+    logging.info(f"Displaying image: {name}")
+    try:
+        display = get_display()
+        with DISPLAY_LOCK:
+            with span("init"):
+                display.init()
+            time_to_first_byte = time.perf_counter() - started
+            timings["init"] = time_to_first_byte
+            record_stage("time_to_first_byte", time_to_first_byte)
+            logging.info(f"Time to first SPI byte: {time_to_first_byte:.3f}s")
+            # Render the following entry while the panel is busy refreshing
+            if prepare_next:
+                prepare_frame_in_background(prepare_next)
+            set_display_state("refreshing", name)
+            display.display(buffer)
+            display.sleep()
+            timings["refresh"] = time.perf_counter() - started - time_to_first_byte
+    except Exception:
+        DISPLAY_FAILURES.inc()
+        set_display_state("failed", name)
+        raise
+    REFRESHES.inc()
+    set_display_state("shown", name)
+    logging.info("Display was put back to sleep.")
+    return timings
+
+
+# frames are at most a few hundred KiB, anything much larger is not a frame
+MAX_FRAME_BODY = 4 * 1024 * 1024
+
+
+def frame_error(message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+@app.post("/frames")
+async def ingest_frame(request: Request, mode: str = "display", name: str = "External frame"):
+    """
+    Show a frame rendered elsewhere without server-side processing. The body is
+    either a palette PNG in the panel palette (image/png) or packed 4 bit indices
+    (application/octet-stream), optionally zlib compressed with Content-Encoding: deflate.
+    `mode` is `display` to show it right away or `enqueue` for the next scheduled refresh.
+    """
+    if mode not in ("display", "enqueue"):
+        return frame_error("mode must be display or enqueue")
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return frame_error("Content-Length must be a number")
+    if content_length > MAX_FRAME_BODY:
+        return frame_error(f"Frames are limited to {MAX_FRAME_BODY} bytes", 413)
+
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
+    # chunked uploads have no Content-Length, enforce the limit while reading
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_FRAME_BODY:
+            return frame_error(f"Frames are limited to {MAX_FRAME_BODY} bytes", 413)
+    # a view, the body is not copied again on its way to the panel
+    data = memoryview(body)
+    timings["receive"] = time.perf_counter() - started
+    # waits while the display is still being initialized
+    display = await asyncio.to_thread(get_display)
+    try:
+        if request.headers.get("content-encoding") == "deflate":
+            decompress_started = time.perf_counter()
+            data = decompress(data, MAX_FRAME_BODY)
+            timings["decompress"] = time.perf_counter() - decompress_started
+        content_type = request.headers.get("content-type", "").split(";")[0]
+        if content_type == "image/png":
+            with TRACES.job(f"ingest {name}"):
+                # memoryviews can't be pickled for the worker, the bytearray can
+                payload = data.obj if isinstance(data, memoryview) else data
+                result = await RENDER_POOL.run_timed(
+                    ingest_png, payload, (display.width, display.height)
+                )
+            timings.update(result.timings)
+            buffer = result.value
+        elif content_type == "application/octet-stream":
+            validate_started = time.perf_counter()
+            validate_packed(data, display.width, display.height)
+            timings["validate"] = time.perf_counter() - validate_started
+            buffer = data
+        else:
+            return frame_error("Content-Type must be image/png or application/octet-stream", 415)
+    except InvalidFrame as e:
+        return frame_error(str(e))
+    except (RenderPoolFull, MemoryBudgetExceeded) as e:
+        return frame_error(str(e), 503)
+
+    if mode == "enqueue":
+        try:
+            position = PENDING_FRAMES.put(RawFrame(name, buffer))
+        except IndexError as e:
+            return frame_error(str(e), 503)
+        return JSONResponse({"queued": position, "timings": timings})
+
+    try:
+        with TRACES.job(f"display {name}"):
+            timings.update(await asyncio.to_thread(write_frame, buffer, name, started))
+    except Exception as e:
+        return frame_error(f"Display failed: {e}", 500)
+    return JSONResponse({"displayed": True, "timings": timings})
+
+
+def dashboard_png(name: str) -> bytes:
+    buffered = BytesIO()
+    DASHBOARDS.render(name).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+@app.get("/dashboards/{name}/preview")
+async def preview_dashboard(name: str):
+    try:
+        png = await asyncio.to_thread(dashboard_png, name)
+    except KeyError as e:
+        return Response(str(e), status_code=404)
+    return Response(png, media_type="image/png")
+
+
+@app.post("/dashboards/{name}/display")
+async def display_dashboard(name: str):
+    if name not in DASHBOARDS.names():
+        return frame_error(f"No dashboard named {name}", 404)
+    timings = await asyncio.to_thread(show_dashboard, name)
+    return JSONResponse({"displayed": True, "timings": timings})
+
+
+# shortest refresh hint for panels, also while a due frame could not be replaced
+MIN_FLEET_REFRESH = 5
+# dashboards show the time and live data, they are redrawn at least this often
+DASHBOARD_REFRESH = 300
+
 
-        image = Image.open(ORIGINAL_DIR / f"{entry.id}.{IMAGE_EXTENSION}")
-        processed_image = IMAGE_PROCESSOR(image, entry)
-        buffered = BytesIO()
-        processed_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue())
-        return message_modal(
-            "Preview",
-            Img(src=f"data:image/png;base64,{img_str.decode('utf-8')}"),
-            content_route="/reset_modal",
-            target=MODAL_CONTAINER,
+def fleet_dashboard(name: str) -> tuple[bytes, bytes]:
+    buffer = DASHBOARDS.render_buffer(name)
+    return buffer, zlib.compress(buffer, 6)
+
+
+def pick_fleet_entry(exclude: Optional[str]) -> Optional[ImageEntry]:
+    """
+    A random entry, other than the one the panel shows if there is a choice
+    """
+    id = CANDIDATES.pick(exclude)
+    return load_entry(id) if id else None
+
+
+async def advance_panel(panel: Panel) -> Optional[PanelFrame]:
+    now = datetime.now()
+    # panels follow the quiet hours and the cron schedule of the local display
+    held = SCHEDULER.held_until(now)
+    if held is not None:
+        FLEET.postpone(panel, held.timestamp())
+        return None
+    settings = SETTINGS.get()
+    interval = SCHEDULER.interval(now)
+    if settings.dashboard:
+        name = f"Dashboard {settings.dashboard}"
+        with TRACES.job(f"fleet {panel.name} {name}"):
+            buffer, compressed = await asyncio.to_thread(fleet_dashboard, settings.dashboard)
+        interval = min(interval or math.inf, DASHBOARD_REFRESH)
+        return FLEET.publish(panel, name, None, buffer, compressed, interval)
+    entry = await asyncio.to_thread(
+        pick_fleet_entry, panel.frame.entry_id if panel.frame else None
+    )
+    if entry is None:
+        return None
+    with TRACES.job(f"fleet {panel.name} {entry.name}"):
+        buffer, compressed = await RENDERS.run(
+            ("render_packed", entry.id, entry.options_key()),
+            render_packed,
+            str(ORIGINAL_DIR / f"{entry.id}.{IMAGE_EXTENSION}"),
+            await asyncio.to_thread(render_options, entry),
         )
+    return FLEET.publish(panel, entry.name, entry.id, buffer, compressed, interval)
+
+
+@app.get("/fleet")
+async def fleet_panels():
+    now = time.time()
+    return JSONResponse(
+        [
+            {
+                "panel": panel.name,
+                "frame": panel.frame.name if panel.frame else None,
+                "etag": panel.frame.etag if panel.frame else None,
+                "last_seen": round(now - panel.last_seen, 1),
+                "pulls": panel.pulls,
+                "not_modified": panel.not_modified,
+            }
+            for panel in FLEET.panels()
+        ]
+    )
+
+
+@app.get("/fleet/{panel}/frame")
+async def fleet_frame(request: Request, panel: str):
+    """
+    The current packed frame of `panel` for thin clients, see fleet_client.py.
+    Answers 304 when If-None-Match matches and 204 while there is nothing to show.
+    The body is zlib compressed when the client accepts deflate.
+    """
+    try:
+        state = FLEET.panel(panel)
+    except FleetFull as e:
+        return frame_error(str(e), 503)
+    async with state.lock:
+        frame = state.frame
+        if Fleet.due(state):
+            try:
+                frame = await advance_panel(state) or frame
+            except Exception as e:
+                # the panel keeps its current frame and retries on a later pull
+                logging.error(f"Error rendering the next frame for panel {panel}: {e}")
+                if frame is None:
+                    status_code = 503 if isinstance(e, (RenderPoolFull, MemoryBudgetExceeded)) else 500
+                    return frame_error(str(e), status_code)
+    if frame is None:
+        return Response(status_code=204)
+
+    headers = {
+        "ETag": frame.etag,
+        "Cache-Control": "no-cache",
+        "X-Frame-Name": quote(frame.name),
+    }
+    if frame.due != math.inf:
+        headers["X-Refresh-After"] = str(max(MIN_FLEET_REFRESH, math.ceil(frame.due - time.time())))
+    if request.headers.get("if-none-match") == frame.etag:
+        state.not_modified += 1
+        CACHE_REQUESTS.inc(cache="fleet", result="hit")
+        return Response(status_code=304, headers=headers)
+    CACHE_REQUESTS.inc(cache="fleet", result="miss")
+    if "deflate" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "deflate"
+        return Response(frame.compressed, media_type="application/octet-stream", headers=headers)
+    return Response(frame.buffer, media_type="application/octet-stream", headers=headers)
 
 
 @app.post("/display/{id}")
-def display_image(id: str):
+async def display_image(id: str):
+    entry = await asyncio.to_thread(load_entry, id)
+    if entry is not None:
+        try:
+            await asyncio.to_thread(show_entry, entry)
+        except (RenderPoolFull, MemoryBudgetExceeded, BrokenProcessPool) as e:
+            return Response(str(e), status_code=503, headers={"Retry-After": "5"})
+        except Exception as e:
+            # decode and display errors, counted in DISPLAY_FAILURES and shown as the failed state
+            logging.error(f"Error displaying {entry.name}: {e}")
+            return Response(f"Display failed: {e}", status_code=503)
+
+
+def pick_next_entry_id(exclude: Optional[str] = None) -> Optional[str]:
+    return CANDIDATES.pick(exclude)
+
+
+def show_dashboard(name: str) -> dict[str, float]:
+    with TRACES.job(f"dashboard {name}"):
+        started = time.perf_counter()
+        with span("dashboard"):
+            buffer = DASHBOARDS.render_buffer(name)
+        return write_frame(buffer, f"Dashboard {name}", started)
+
+
+def cycle_images():
+    global NEXT_ENTRY_ID
+    frame = PENDING_FRAMES.take()
+    if frame is not None:
+        with TRACES.job(f"display {frame.name}"):
+            write_frame(frame.buffer, frame.name, time.perf_counter())
+        return
+    dashboard = SETTINGS.get().dashboard
+    if dashboard:
+        show_dashboard(dashboard)
+        return
+    # no session is held during the render and the refresh, it would hold off WAL checkpoints
+    entry = load_entry(NEXT_ENTRY_ID) if NEXT_ENTRY_ID else None
+    if entry is None:
+        id = pick_next_entry_id()
+        entry = load_entry(id) if id else None
+    if entry is None:
+        return
+    NEXT_ENTRY_ID = pick_next_entry_id(exclude=entry.id)
+    show_entry(entry, prepare_next=NEXT_ENTRY_ID)
+    if entry.frame_count > 1:
+        # every frame is an item of its own, the next time the following one is shown
+        update_entry(entry.id, frame=(entry.frame + 1) % entry.frame_count)
+
+
+SCHEDULER = Scheduler(ENGINE, SETTINGS, cycle_images)
+
+
+def hash_missing_originals():
+    """
+    Hash the originals stored before hashes were computed on upload, then
+    build the duplicate index so the first upload doesn't wait for it
+    """
     with Session(ENGINE) as session:
-        entry: ImageEntry = session.get(ImageEntry, id)
-        image = Image.open(ORIGINAL_DIR / f"{entry.id}.{IMAGE_EXTENSION}")
-        processed_image = IMAGE_PROCESSOR(image, entry)
-        logging.info(f"Displaying image: {entry.name}")
-        global DISPLAY
-        DISPLAY.init()
-        DISPLAY.display(DISPLAY.get_buffer(processed_image))
-        DISPLAY.sleep()
-        logging.info("Display was put back to sleep.")
+        ids = session.exec(select(ImageEntry.id).where(ImageEntry.phash.is_(None))).all()
+    for id in ids:
+        path = ORIGINAL_DIR / f"{id}.{IMAGE_EXTENSION}"
+        if not path.exists():
+            continue
+        try:
+            while True:
+                try:
+                    hashes = RENDER_POOL.call(hash_original, str(path))
+                    break
+                except RenderPoolFull:
+                    time.sleep(1)
+        except Exception as e:
+            logging.error(f"Hashing {path} failed: {e}")
+            continue
+        # the hashes don't change how the entry renders, keep the prepared frame and the panels
+        with Session(ENGINE) as session:
+            session.execute(update(ImageEntry).where(ImageEntry.id == id).values(**hashes))
+            session.commit()
+        DUPLICATES.add(id, hashes["phash"])
+    if ids:
+        logging.info(f"Hashed {len(ids)} stored originals")
+    DUPLICATES.build()
 
 
 @app.on_event("startup")
-@repeat_every(seconds=60, wait_first=True)
-def cycle_background_task() -> None:
-    with Session(ENGINE) as session:
-        settings = session.exec(select(Settings)).first()
-        if settings.cycle:
-            global GLOGAL_COUNTER
-            GLOGAL_COUNTER -= 1
-            if GLOGAL_COUNTER <= 0:
-                GLOGAL_COUNTER = settings.cycle_time
-                entries = session.exec(select(ImageEntry)).all()
-                if len(entries) > 0:
-                    entry = random.choice(entries)
-                    display_image(entry.id)
+def start_scheduler() -> None:
+    global NEXT_ENTRY_ID
+    RENDER_POOL.start()
+    threading.Thread(target=get_display, name="display-init", daemon=True).start()
+    settings = SETTINGS.get()
+    CANDIDATES.set_scope(settings.cycle_album, settings.cycle_query)
+    NEXT_ENTRY_ID = pick_next_entry_id()
+    if HOT_FOLDER is not None:
+        HOT_FOLDER.start()
+    threading.Thread(target=hash_missing_originals, name="hash-originals", daemon=True).start()
+    if NEXT_ENTRY_ID is not None:
+        prepare_frame_in_background(NEXT_ENTRY_ID)
+    SCHEDULER.start()
+    STARTUP.mark("startup complete")
+
+
+@app.on_event("shutdown")
+def close_event_streams() -> None:
+    EVENTS.close()
+    if HOT_FOLDER is not None:
+        HOT_FOLDER.stop()
 
 
 if __name__ == "__main__":
-    import uvicorn
+    with STARTUP.timed_import("uvicorn"):
+        import uvicorn
 
     try:
-        SQLModel.metadata.create_all(ENGINE)
-        # try to execute a query to see if the database is working
-        with Session(ENGINE) as session:
-            session.exec(select(ImageEntry))
+        init_db(ENGINE)
 
     except Exception as e:
         print(f"Error creating database: {e}")
         print("Creating new database")
-        rmtree(DB_DIR, ignore_errors=True)  # remove the directory with
-        rmtree(IMAGE_DIR, ignore_errors=True)
-        print("Created new database")
-        ENGINE = create_engine(f"sqlite:///{DB_FILE}")
-        SQLModel.metadata.create_all(ENGINE)
+        # the same engine is used by the services created above, only its file is replaced
+        ENGINE.dispose()
+        for path in (DB_FILE, DB_FILE.with_name(DB_FILE.name + "-wal"), DB_FILE.with_name(DB_FILE.name + "-shm")):
+            if path.exists():
+                path.replace(path.with_name(path.name + ".broken"))
+        init_db(ENGINE)
+        restored = restore_entries()
+        print(f"Created new database with {restored} images from {ORIGINAL_DIR}")
 
     # ensure that the settings table is populated
-    with Session(ENGINE) as session:
-        if not session.exec(select(Settings)).first():
-            session.add(Settings())
-            session.commit()
-
-        settigns = session.exec(select(Settings)).first()
-        GLOGAL_COUNTER = settigns.cycle_time
+    SETTINGS.load()
+    STARTUP.mark("database ready")
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PRISMBERRY_PORT", 8000)))
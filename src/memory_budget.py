@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import multiprocessing
+import os
+
+# Pillow keeps RGB, RGBA and 32 bit images at 4 bytes per pixel, everything else at 1 or 2
+BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16B": 2, "LA": 4, "PA": 4}
+# quantizing, padding and encoding the 800x480 frame plus the decoder's own buffers
+FRAME_OVERHEAD = 16 * 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def image_cost(size: tuple[int, int], mode: str, copies: int = 1) -> int:
+    """
+    Estimated peak memory of a job that holds `copies` full size copies of the image at once
+    """
+    width, height = size
+    return width * height * BYTES_PER_PIXEL.get(mode, 4) * copies + FRAME_OVERHEAD
+
+
+class MemoryBudget:
+    """
+    Admission control for image work across the render workers. A job
+    reserves its estimated peak memory before decoding and waits while
+    the budget is used up. Create it before the workers are forked.
+    """
+
+    def __init__(self, limit: int, timeout: float = 60.0):
+        self.limit = limit
+        self.timeout = timeout
+        context = multiprocessing.get_context("fork")
+        self._used = context.Value("q", 0, lock=False)
+        self._condition = context.Condition()
+
+    @classmethod
+    def from_env(cls) -> Optional["MemoryBudget"]:
+        """
+        Budget from PRISMBERRY_MEMORY_BUDGET in MiB, no budget if unset
+        """
+        value = os.environ.get("PRISMBERRY_MEMORY_BUDGET")
+        return cls(int(value) * 1024 * 1024) if value else None
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
+    def max_pixels(self, mode: str = "RGB", copies: int = 1) -> int:
+        return max(0, self.limit - FRAME_OVERHEAD) // (BYTES_PER_PIXEL.get(mode, 4) * copies)
+
+    @contextmanager
+    def reserve(self, cost: int) -> Iterator[None]:
+        if cost > self.limit:
+            raise MemoryBudgetExceeded(
+                f"Image needs about {cost // 2**20} MiB, the limit is {self.limit // 2**20} MiB"
+            )
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._used.value + cost <= self.limit, self.timeout
+            ):
+                raise MemoryBudgetExceeded("Too many images are being processed, try again later")
+            self._used.value += cost
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used.value -= cost
+                self._condition.notify_all()
+
+
+def reset_peak_memory():
+    """
+    Reset the peak resident memory (VmHWM) of this process, Linux only
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
@@ -0,0 +1,255 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Iterator, Optional
+import os
+import time
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = Lock()
+        self.enabled = True
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """
+        Exposition lines of the current values
+        """
+        pass
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Gauge whose value is read from `function` when the metrics are scraped
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function: Callable[[], float] = lambda: 0):
+        super().__init__(name, help)
+        self.function = function
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {self.function()}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # per label set: bucket counts (last one is +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def set_enabled(self, enabled: bool):
+        for metric in self.metrics:
+            metric.enabled = enabled
+
+    def exposition(self) -> str:
+        return "\n".join(metric.exposition() for metric in self.metrics) + "\n"
+
+
+@contextmanager
+def stage_timer(timings: Optional[dict[str, float]], stage: str) -> Iterator[None]:
+    """
+    Record the duration of a pipeline stage into `timings` if given.
+    Used in worker processes which send their timings back with the result.
+    """
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
+def resident_memory() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+REGISTRY = Registry()
+
+PIPELINE_SECONDS: Histogram = REGISTRY.register(
+    Histogram(
+        "prismberry_pipeline_stage_seconds",
+        "Duration of image pipeline and display stages",
+        ("stage",),
+    )
+)
+HTTP_SECONDS: Histogram = REGISTRY.register(
+    Histogram(
+        "prismberry_http_request_seconds",
+        "HTTP request latency per route",
+        ("method", "route", "status"),
+    )
+)
+REFRESHES: Counter = REGISTRY.register(
+    Counter("prismberry_refreshes_total", "Completed display refreshes")
+)
+DISPLAY_FAILURES: Counter = REGISTRY.register(
+    Counter("prismberry_display_failures_total", "Failed display refreshes")
+)
+CACHE_REQUESTS: Counter = REGISTRY.register(
+    Counter(
+        "prismberry_cache_requests_total",
+        "Cache lookups by cache and result",
+        ("cache", "result"),
+    )
+)
+UPLOADS: Counter = REGISTRY.register(
+    Counter("prismberry_uploads_total", "Image uploads by result", ("result",))
+)
+QUEUE_DEPTH: Gauge = REGISTRY.register(
+    Gauge("prismberry_render_queue_depth", "Render jobs running or waiting")
+)
+RENDERS_IN_FLIGHT: Gauge = REGISTRY.register(
+    Gauge("prismberry_renders_in_flight", "Frame and preview renders running")
+)
+RENDERS_QUEUED: Gauge = REGISTRY.register(
+    Gauge("prismberry_renders_queued", "Frame and preview renders waiting for a slot")
+)
+RENDERS_DEDUPLICATED: Counter = REGISTRY.register(
+    Counter(
+        "prismberry_renders_deduplicated_total",
+        "Render requests that joined an identical render in flight",
+    )
+)
+RENDERS_REJECTED: Counter = REGISTRY.register(
+    Counter("prismberry_renders_rejected_total", "Render requests rejected while overloaded")
+)
+RESIDENT_MEMORY: Gauge = REGISTRY.register(
+    Gauge(
+        "prismberry_resident_memory_bytes",
+        "Resident set size of the server process",
+        resident_memory,
+    )
+)
+JOB_PEAK_MEMORY: Histogram = REGISTRY.register(
+    Histogram(
+        "prismberry_job_peak_memory_bytes",
+        "Peak resident memory of a render worker during a job",
+        ("job",),
+        tuple(2**20 * mib for mib in (32, 64, 96, 128, 192, 256, 384, 512, 1024)),
+    )
+)
+MEMORY_BUDGET_USED: Gauge = REGISTRY.register(
+    Gauge(
+        "prismberry_memory_budget_used_bytes",
+        "Memory reserved by image jobs in flight",
+    )
+)
+
+REGISTRY.set_enabled(os.environ.get("PRISMBERRY_METRICS", "1") != "0")
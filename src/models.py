@@ -1,5 +1,8 @@
+from datetime import datetime
 from enum import Enum
-from sqlmodel import Field, SQLModel
+from typing import Optional
+from sqlmodel import Field, Index, SQLModel
+import zlib
 
 
 class BackgroundColor(str, Enum):
@@ -7,6 +10,14 @@ class BackgroundColor(str, Enum):
     Black = "black"
 
 
+class DitherMode(str, Enum):
+    FloydSteinberg = "floyd-steinberg"
+    # Floyd-Steinberg on row bands in parallel, the bands overlap to carry the error across
+    Parallel = "parallel"
+    # Bayer threshold map, every pixel is independent
+    Ordered = "ordered"
+
+
 class Rotation(int, Enum):
     _None = 0
     _90 = 90
@@ -15,19 +26,96 @@ class Rotation(int, Enum):
 
     @classmethod
     def from_str(cls, value: str) -> "Rotation":
+        # the options form sends 0 for no rotation
+        if value in ("None", "0"):
+            return cls._None
         return getattr(cls, f"_{value}")
 
 
 class ImageEntry(SQLModel, table=True):
+    # the gallery pages through entries ordered by name and id
+    __table_args__ = (Index("ix_imageentry_name_id", "name", "id"),)
+
     id: str = Field(..., primary_key=True)
     dither: bool = True
+    dither_mode: DitherMode = DitherMode.FloydSteinberg
     grayscale: bool = False
     background_color: BackgroundColor = BackgroundColor.Black
     rotation: Rotation = Rotation._None
-    name: str
+    name: str = Field(index=True)
+    # path relative to the hot folder for entries imported from it
+    source: Optional[str] = Field(default=None, index=True)
+    # perceptual hashes of the original as 16 digit hex, see perceptual_hash.py
+    ahash: Optional[str] = None
+    dhash: Optional[str] = None
+    phash: Optional[str] = None
+    # frame of a multi-frame original that is shown, see frame_index.py
+    frame: int = 0
+    frame_count: int = 1
+
+    def options_key(self) -> tuple:
+        return (
+            self.dither,
+            self.dither_mode,
+            self.grayscale,
+            self.background_color,
+            self.rotation,
+            self.frame,
+        )
+
+    def options_token(self) -> str:
+        """
+        Short token of the display options to detect stale requests
+        """
+        return f"{zlib.crc32(repr(self.options_key()).encode()):08x}"
+
+
+class ImageFrame(SQLModel, table=True):
+    # where a frame is stored in a multi-frame original, see frame_index.py
+    image_id: str = Field(foreign_key="imageentry.id", primary_key=True)
+    frame: int = Field(primary_key=True)
+    offset: int
+    length: int
+    duration: int = 0
+
+
+class Tag(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True, index=True)
+
+
+class ImageTag(SQLModel, table=True):
+    # the primary key serves lookups by image, the index lookups by tag
+    image_id: str = Field(foreign_key="imageentry.id", primary_key=True)
+    tag_id: int = Field(foreign_key="tag.id", primary_key=True, index=True)
+
+
+class Album(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True, index=True)
+
+
+class AlbumImage(SQLModel, table=True):
+    # the primary key serves lookups by album, the index lookups by image
+    album_id: int = Field(foreign_key="album.id", primary_key=True)
+    image_id: str = Field(foreign_key="imageentry.id", primary_key=True, index=True)
 
 
 class Settings(SQLModel, table=True):
     id: int = Field(1, primary_key=True)
     cycle: bool = True
-    cycle_time: int = 30
+    cycle_seconds: int = 1800
+    cron: Optional[str] = None
+    quiet_start: Optional[str] = None
+    quiet_end: Optional[str] = None
+    # name of a dashboard template shown instead of the images
+    dashboard: Optional[str] = None
+    # cycle only through the images in this album and matching this search
+    cycle_album: Optional[int] = None
+    cycle_query: Optional[str] = None
+
+
+class SchedulerState(SQLModel, table=True):
+    id: int = Field(1, primary_key=True)
+    last_run: Optional[datetime] = None
+    next_due: Optional[datetime] = None
@@ -0,0 +1,211 @@
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, Thread, enumerate as threads, get_ident
+from typing import Callable, Iterator, Optional
+from metrics import PIPELINE_SECONDS
+import re
+import sys
+import time
+
+
+@dataclass
+class Trace:
+    name: str
+    started: datetime
+    spans: list[tuple[str, float]] = field(default_factory=list)
+    duration: Optional[float] = None
+    peak_memory: Optional[int] = None
+
+
+class TraceLog:
+    """
+    Always-on ring buffer of the most recent jobs with the duration of their stages
+    """
+
+    def __init__(self, maxlen: int = 100):
+        self._traces: deque[Trace] = deque(maxlen=maxlen)
+        self._current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+        self._running: list[Trace] = []
+        self._subscribers: list[Callable[[Trace], None]] = []
+
+    def subscribe(self, callback: Callable[[Trace], None]):
+        """
+        Called when a job starts and when it finishes, `duration` is set once it finished
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, trace: Trace):
+        for callback in self._subscribers:
+            callback(trace)
+
+    @contextmanager
+    def job(self, name: str) -> Iterator[Trace]:
+        trace = Trace(name, datetime.now())
+        token = self._current.set(trace)
+        started = time.perf_counter()
+        self._running.append(trace)
+        self._notify(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - started
+            self._current.reset(token)
+            self._running.remove(trace)
+            self._traces.append(trace)
+            self._notify(trace)
+
+    def add(self, stage: str, duration: float):
+        trace = self._current.get()
+        if trace is not None:
+            trace.spans.append((stage, duration))
+
+    def peak_memory(self, value: int):
+        trace = self._current.get()
+        if trace is not None:
+            trace.peak_memory = max(trace.peak_memory or 0, value)
+
+    def running(self) -> list[Trace]:
+        return list(self._running)
+
+    def recent(self) -> list[Trace]:
+        return list(reversed(self._traces))
+
+
+TRACES = TraceLog()
+
+
+def record_stage(stage: str, duration: float):
+    PIPELINE_SECONDS.observe(duration, stage=stage)
+    TRACES.add(stage, duration)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a stage into the pipeline histogram and the trace of the current job
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+class Sampler:
+    """
+    Samples the stacks of every thread but its own each `interval` seconds.
+    Unlike cProfile it sees the work handed to threads, costs nothing in the
+    sampled threads and never clashes with another profiler.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own = get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path: Path):
+        """
+        Write the samples as collapsed stacks, as read by flamegraph.pl and speedscope
+        """
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+
+
+class Profiler:
+    """
+    Samples all threads for the next `count` runs of an armed target, a
+    route template like `/preview/{id}` or `display` for display jobs.
+    One run is profiled at a time, runs overlapping it are not counted.
+    Work in the render workers shows up as the stages of the job traces.
+    """
+
+    def __init__(self, directory: Path, keep: int = 50):
+        self.directory = directory
+        self.keep = keep
+        self._lock = Lock()
+        self._armed: dict[str, int] = {}
+        self._active = False
+
+    @property
+    def armed(self) -> dict[str, int]:
+        return dict(self._armed)
+
+    def arm(self, target: str, count: int = 1):
+        with self._lock:
+            self._armed[target] = self._armed.get(target, 0) + count
+
+    def _take(self, target: str) -> bool:
+        if target not in self._armed:
+            return False
+        with self._lock:
+            remaining = self._armed.get(target, 0)
+            if remaining <= 0 or self._active:
+                return False
+            self._active = True
+            if remaining == 1:
+                del self._armed[target]
+            else:
+                self._armed[target] = remaining - 1
+            return True
+
+    @contextmanager
+    def profile(self, target: str) -> Iterator[None]:
+        if not self._take(target):
+            yield
+            return
+        sampler = Sampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            try:
+                self._save(sampler, target)
+            finally:
+                with self._lock:
+                    self._active = False
+
+    def _save(self, sampler: Sampler, target: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^a-zA-Z0-9]+", "-", target).strip("-") or "root"
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        sampler.dump(self.directory / f"{timestamp}-{slug}.folded")
+        for old in self.files()[self.keep :]:
+            old.unlink(missing_ok=True)
+
+    def files(self) -> list[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.folded"), reverse=True)
+
+    def file(self, name: str) -> Optional[Path]:
+        for path in self.files():
+            if path.name == name:
+                return path
+        return None
@@ -0,0 +1,538 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterator, Optional
+from frame_ingest import InvalidFrame
+from frame_index import open_frame, store_frames
+from models import ImageEntry
+from memory_budget import (
+    MemoryBudget,
+    MemoryBudgetExceeded,
+    image_cost,
+    peak_memory,
+    reset_peak_memory,
+)
+from metrics import (
+    JOB_PEAK_MEMORY,
+    MEMORY_BUDGET_USED,
+    QUEUE_DEPTH,
+    RENDERS_DEDUPLICATED,
+    RENDERS_IN_FLIGHT,
+    RENDERS_QUEUED,
+    RENDERS_REJECTED,
+    stage_timer,
+)
+from profiling import TRACES, record_stage
+import asyncio
+import multiprocessing
+import os
+import zlib
+
+# Pillow is imported by the workers only, it is not needed to start serving
+if TYPE_CHECKING:
+    from PIL import Image
+    from image_processor import ImageProcessor
+
+_PROCESSORS: dict[bool, "ImageProcessor"] = {}
+# set before the workers are forked, shared by all of them
+_BUDGET: Optional[MemoryBudget] = None
+_WORKERS = 1
+
+
+@dataclass
+class RenderResult:
+    """
+    Result of a worker job with the duration of each pipeline stage
+    """
+
+    value: Any
+    timings: dict[str, float] = field(default_factory=dict)
+    peak_memory: int = 0
+
+
+@contextmanager
+def _admit(
+    image: "Image", copies: int, draft: Optional[tuple[int, int]] = None
+) -> Iterator[None]:
+    """
+    Reserve the memory `image` needs from the budget. With `draft` JPEGs that
+    would not fit are decoded at a reduced scale instead of being rejected.
+    """
+    if _BUDGET is None:
+        yield
+        return
+    if draft and image.width * image.height > _BUDGET.max_pixels(image.mode, copies):
+        image.draft("RGB", draft)
+    with _BUDGET.reserve(image_cost(image.size, image.mode, copies)):
+        yield
+
+
+@contextmanager
+def _job(result: RenderResult) -> Iterator[RenderResult]:
+    reset_peak_memory()
+    try:
+        yield result
+    finally:
+        result.peak_memory = peak_memory()
+
+
+def _processor(quick: bool) -> "ImageProcessor":
+    if quick not in _PROCESSORS:
+        from image_processor import ImageProcessor
+
+        # the workers dither concurrently, split the cores between them instead of oversubscribing
+        threads = max(1, (os.cpu_count() or 1) // _WORKERS)
+        # the quick processor renders a half size frame with a fast resize
+        _PROCESSORS[quick] = (
+            ImageProcessor((400, 240), threads=threads, reducing_gap=2.0)
+            if quick
+            else ImageProcessor(threads=threads)
+        )
+    return _PROCESSORS[quick]
+
+
+def _process(
+    path: str, options: dict, timings: dict[str, float], quick: bool = False
+) -> "Image":
+    from PIL import Image
+
+    processor = _processor(quick)
+    options = dict(options)
+    # the byte range of the shown frame of a multi-frame original
+    span = options.pop("frame_span", None)
+    entry = ImageEntry(**options)
+    image = open_frame(path, *span) if span else Image.open(path)
+    # any rotation has to fit the frame after the reduced decode
+    side = max(processor.target_size)
+    with _admit(image, 1, (side, side)):
+        return processor(image, entry, timings, consume=True)
+
+
+def render_png(path: str, options: dict) -> RenderResult:
+    with _job(RenderResult(None)) as result:
+        buffered = BytesIO()
+        image = _process(path, options, result.timings)
+        with stage_timer(result.timings, "encode"):
+            image.save(buffered, format="PNG")
+        result.value = buffered.getvalue()
+    return result
+
+
+def render_quick_png(path: str, options: dict) -> RenderResult:
+    """
+    Undithered half size approximation of `render_png` for previews
+    """
+    with _job(RenderResult(None)) as result:
+        buffered = BytesIO()
+        image = _process(path, {**options, "dither": False}, result.timings, quick=True)
+        with stage_timer(result.timings, "encode"):
+            image.save(buffered, format="PNG")
+        result.value = buffered.getvalue()
+    return result
+
+
+def render_buffer(
+    path: str, options: dict, packer: Callable[["Image"], list[int]]
+) -> RenderResult:
+    with _job(RenderResult(None)) as result:
+        image = _process(path, options, result.timings)
+        with stage_timer(result.timings, "pack"):
+            result.value = packer(image)
+    return result
+
+
+def render_packed(path: str, options: dict) -> RenderResult:
+    """
+    The frame packed to 4 bits per pixel, raw and zlib compressed, for panels pulling from a fleet server
+    """
+    with _job(RenderResult(None)) as result:
+        image = _process(path, options, result.timings)
+        with stage_timer(result.timings, "pack"):
+            packed = image.tobytes("raw", "P;4")
+        with stage_timer(result.timings, "compress"):
+            result.value = (packed, zlib.compress(packed, 6))
+    return result
+
+
+def ingest_png(data: bytes, size: tuple[int, int]) -> RenderResult:
+    """
+    Validate a palette image in the panel palette and pack it to 4 bits per pixel
+    """
+    from PIL import Image
+    from image_processor import PALETTE, PANEL_COLORS
+
+    with _job(RenderResult(None)) as result:
+        with stage_timer(result.timings, "decode"):
+            image = Image.open(BytesIO(data))
+            if image.size != size:
+                raise InvalidFrame(
+                    f"Frame must be {size[0]}x{size[1]}, got {image.width}x{image.height}"
+                )
+            if image.mode != "P":
+                raise InvalidFrame(f"Frame must be a palette image, got mode {image.mode}")
+            image.load()
+        with stage_timer(result.timings, "validate"):
+            used = [index for _, index in image.getcolors(256)]
+            if max(used) >= PANEL_COLORS:
+                raise InvalidFrame(
+                    f"Frame uses palette index {max(used)}, the panel has {PANEL_COLORS} colors"
+                )
+            palette = image.getpalette()
+            for index in used:
+                if palette[3 * index : 3 * index + 3] != list(PALETTE[3 * index : 3 * index + 3]):
+                    raise InvalidFrame(f"Palette entry {index} does not match the panel palette")
+        with stage_timer(result.timings, "pack"):
+            # two pixels per byte, high nibble first like display.edp.pack_image
+            result.value = image.tobytes("raw", "P;4")
+    return result
+
+
+def store_upload(data: bytes, path: str) -> RenderResult:
+    """
+    Store an uploaded original, returns its perceptual hashes and for
+    multi-frame images the frame index, an empty list otherwise
+    """
+    from PIL import Image
+    from perceptual_hash import image_hashes
+
+    with _job(RenderResult(None)) as result:
+        with Image.open(BytesIO(data)) as image:
+            if _BUDGET is not None and image.width * image.height > _BUDGET.max_pixels(image.mode):
+                raise MemoryBudgetExceeded(
+                    f"Image has {image.width}x{image.height} pixels, "
+                    f"the limit is {_BUDGET.max_pixels(image.mode)} pixels"
+                )
+            multi_frame = getattr(image, "n_frames", 1) > 1
+            # composited frames are built on top of the previous one
+            with _admit(image, 2 if multi_frame else 1):
+                with stage_timer(result.timings, "hash"):
+                    hashes = image_hashes(image)
+                frames = []
+                if multi_frame:
+                    with stage_timer(result.timings, "frames"):
+                        frames = store_frames(image, path)
+                else:
+                    # keep the orientation, it is applied when rendering
+                    image.save(path, exif=image.getexif())
+                result.value = (hashes, frames)
+    return result
+
+
+def hash_original(path: str) -> RenderResult:
+    """
+    Perceptual hashes of a stored original, for entries from before they were computed on upload
+    """
+    from PIL import Image
+    from perceptual_hash import image_hashes
+
+    with _job(RenderResult(None)) as result:
+        with Image.open(path) as image:
+            image.draft("RGB", (512, 512))
+            with _admit(image, 1):
+                result.value = image_hashes(image)
+    return result
+
+
+def _warm_up():
+    import image_processor  # noqa: F401
+
+
+class RenderPoolFull(Exception):
+    pass
+
+
+class RenderPool:
+    """
+    Small process pool for decode/quantize/pack work so it doesn't hold
+    the GIL of the web server. Rejects work once `max_pending` jobs are waiting.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 4,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        global _BUDGET, _WORKERS
+        self.max_workers = _WORKERS = max_workers
+        self.max_pending = max_pending
+        self.budget = _BUDGET = budget
+        MEMORY_BUDGET_USED.set_function(lambda: budget.used if budget else 0)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = Lock()
+        self._in_flight = 0
+        self._subscribers: list[Callable[[int], None]] = []
+        QUEUE_DEPTH.set_function(lambda: self._in_flight)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def worker_pids(self) -> list[int]:
+        """
+        Process ids of the running workers, empty before the first job
+        """
+        executor = self._executor
+        if executor is None or executor._processes is None:
+            return []
+        return list(executor._processes)
+
+    def start(self):
+        """
+        Fork the workers, call this before other threads are started
+        """
+        with self._lock:
+            if self._executor is None:
+                # fork instead of spawn, spawn would re-import main.py and re-initialize the display
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                )
+        # with fork all workers are started on the first submit, the
+        # imports of the warm up job then run in the background
+        self._executor.submit(_warm_up)
+
+    def subscribe(self, callback: Callable[[int], None]):
+        """
+        Called with the number of jobs in flight whenever it changes
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, in_flight: int):
+        for callback in self._subscribers:
+            callback(in_flight)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def submit(self, fn: Callable, *args: Any) -> Future:
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_pending:
+                raise RenderPoolFull("Too many images are being processed, try again later")
+            self._in_flight += 1
+            in_flight = self._in_flight
+        self._notify(in_flight)
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _: Future):
+        with self._lock:
+            self._in_flight -= 1
+            in_flight = self._in_flight
+        self._notify(in_flight)
+
+    @staticmethod
+    def _unwrap(fn: Callable, result: Any) -> Any:
+        if isinstance(result, RenderResult):
+            for stage, duration in result.timings.items():
+                record_stage(stage, duration)
+            if result.peak_memory:
+                JOB_PEAK_MEMORY.observe(result.peak_memory, job=fn.__name__)
+                TRACES.peak_memory(result.peak_memory)
+            return result.value
+        return result
+
+    def call(self, fn: Callable, *args: Any) -> Any:
+        return self._unwrap(fn, self.submit(fn, *args).result())
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        return self._unwrap(fn, await asyncio.wrap_future(self.submit(fn, *args)))
+
+    async def run_timed(self, fn: Callable, *args: Any) -> RenderResult:
+        """
+        Like `run`, but returns the whole RenderResult including the stage timings
+        """
+        result = await asyncio.wrap_future(self.submit(fn, *args))
+        self._unwrap(fn, result)
+        return result
+
+
+class RenderCoordinator:
+    """
+    Single-flight front of the render pool for frames and previews.
+    Concurrent requests with the same key, e.g. the entry and its options,
+    share one job. At most `max_concurrent` jobs run in the pool and
+    `max_queued` wait for a slot, beyond that requests fail right away with
+    RenderPoolFull instead of piling up.
+    """
+
+    def __init__(self, pool: RenderPool, max_concurrent: int = 2, max_queued: int = 8):
+        self.pool = pool
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.deduplicated = 0
+        self.rejected = 0
+        self._lock = Lock()
+        self._running = 0
+        self._jobs: dict[Hashable, Future] = {}
+        self._waiting: deque[tuple[Hashable, Future, Callable, tuple]] = deque()
+        self._latest: dict[str, Hashable] = {}
+        # callers waiting for the job of each key, a job they share is only dropped by the last one
+        self._waiters: dict[Hashable, int] = {}
+        # callers of each slot still waiting for the job of its latest key
+        self._latest_waiting: dict[str, int] = {}
+        RENDERS_IN_FLIGHT.set_function(lambda: self._running)
+        RENDERS_QUEUED.set_function(lambda: len(self._waiting))
+
+    @classmethod
+    def from_env(cls, pool: RenderPool) -> "RenderCoordinator":
+        """
+        Limits from PRISMBERRY_RENDER_CONCURRENCY and PRISMBERRY_RENDER_QUEUE if set
+        """
+        return cls(
+            pool,
+            int(os.environ.get("PRISMBERRY_RENDER_CONCURRENCY", 2)),
+            int(os.environ.get("PRISMBERRY_RENDER_QUEUE", 8)),
+        )
+
+    @property
+    def in_flight(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any) -> tuple[Future, bool]:
+        """
+        The job for `key` and whether this call started it. Its result is
+        the raw result of `fn`, only the starter records its timings. Every
+        call is counted as a waiter until it calls `_release`.
+        """
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                RENDERS_DEDUPLICATED.inc()
+                self._waiters[key] = self._waiters.get(key, 0) + 1
+                return future, False
+            start = self._running < self.max_concurrent
+            if not start and len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                RENDERS_REJECTED.inc()
+                raise RenderPoolFull("Too many images are being rendered, try again later")
+            future = Future()
+            self._jobs[key] = future
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            if start:
+                self._running += 1
+            else:
+                self._waiting.append((key, future, fn, args))
+        if start:
+            self._start(key, future, fn, args)
+        return future, True
+
+    def _start(self, key: Hashable, future: Future, fn: Callable, args: tuple):
+        try:
+            job = self.pool.submit(fn, *args)
+        except Exception as e:
+            self._finish(key, future, None, e)
+            return
+        job.add_done_callback(lambda job: self._finish(key, future, job, None))
+
+    def _finish(
+        self, key: Hashable, future: Future, job: Optional[Future], error: Optional[Exception]
+    ):
+        with self._lock:
+            if self._jobs.get(key) is future:
+                del self._jobs[key]
+            # the slot goes straight to the next waiting job
+            following = self._waiting.popleft() if self._waiting else None
+            if following is None:
+                self._running -= 1
+        if job is not None:
+            try:
+                future.set_result(job.result())
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future.set_exception(error)
+        if following is not None:
+            self._start(*following)
+
+    def _release(self, key: Hashable):
+        with self._lock:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _drop(self, key: Hashable, superseded: int):
+        """
+        Cancel the job for `key` if it is still waiting for a slot and no
+        caller other than the `superseded` ones waits for it
+        """
+        if self._waiters.get(key, 0) > superseded:
+            return
+        for waiting in self._waiting:
+            if waiting[0] == key:
+                self._waiting.remove(waiting)
+                del self._jobs[key]
+                waiting[1].cancel()
+                return
+
+    @staticmethod
+    def _value(fn: Callable, result: Any, started: bool) -> Any:
+        if started:
+            return RenderPool._unwrap(fn, result)
+        return result.value if isinstance(result, RenderResult) else result
+
+    def call(self, key: Hashable, fn: Callable, *args: Any) -> Any:
+        future, started = self.submit(key, fn, *args)
+        try:
+            return self._value(fn, future.result(), started)
+        finally:
+            self._release(key)
+
+    async def run(self, key: Hashable, fn: Callable, *args: Any) -> Any:
+        future, started = self.submit(key, fn, *args)
+        try:
+            # shielded, a waiter that goes away must not cancel the job of the others
+            return self._value(fn, await asyncio.shield(asyncio.wrap_future(future)), started)
+        finally:
+            self._release(key)
+
+    async def run_latest(self, slot: str, key: Hashable, fn: Callable, *args: Any) -> Any:
+        """
+        Like `run`, but a newer key for the same slot supersedes this one.
+        A superseded job is dropped if it has not started yet and no other
+        caller shares it, the superseded callers return None.
+        """
+        with self._lock:
+            previous = self._latest.get(slot)
+            self._latest[slot] = key
+            if previous is not None and previous != key:
+                self._drop(previous, self._latest_waiting.pop(slot, 0))
+        future, started = self.submit(key, fn, *args)
+        with self._lock:
+            if self._latest.get(slot) == key:
+                self._latest_waiting[slot] = self._latest_waiting.get(slot, 0) + 1
+        try:
+            result = await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return None
+            raise
+        finally:
+            self._release(key)
+            with self._lock:
+                if self._latest.get(slot) == key:
+                    if slot in self._latest_waiting:
+                        self._latest_waiting[slot] -= 1
+                        if not self._latest_waiting[slot]:
+                            del self._latest_waiting[slot]
+                    # kept while the job is queued, a newer key then drops it
+                    if future.done():
+                        del self._latest[slot]
+        latest = self._latest.get(slot)
+        if latest is not None and latest != key:
+            return None
+        return self._value(fn, result, started)
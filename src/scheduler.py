@@ -0,0 +1,233 @@
+from datetime import datetime, time, timedelta
+from typing import TYPE_CHECKING, Callable, Optional
+from sqlmodel import Session
+from sqlalchemy.engine import Engine
+from models import Settings, SchedulerState
+import threading
+import logging
+
+if TYPE_CHECKING:
+    from settings_service import SettingsService
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> set[int]:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        has_step = "/" in part
+        if has_step:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if has_step else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Minimal 5-field cron expression (minute hour day month weekday)
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        try:
+            self.minutes = _parse_cron_field(fields[0], 0, 59)
+            self.hours = _parse_cron_field(fields[1], 0, 23)
+            self.days = _parse_cron_field(fields[2], 1, 31)
+            self.months = _parse_cron_field(fields[3], 1, 12)
+            # 0 and 7 both mean sunday
+            self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}
+        except ValueError as e:
+            raise ValueError(f"Invalid cron expression '{expression}': {e}")
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=4 * 366)
+        while dt < limit:
+            if dt.month not in self.months or not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError("Cron expression never matches")
+
+
+class QuietHours:
+    def __init__(self, start: time, end: time):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Optional["QuietHours"]:
+        if not settings.quiet_start or not settings.quiet_end:
+            return None
+        return cls(
+            time.fromisoformat(settings.quiet_start),
+            time.fromisoformat(settings.quiet_end),
+        )
+
+    def contains(self, dt: datetime) -> bool:
+        t = dt.time()
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        # window wraps around midnight
+        return t >= self.start or t < self.end
+
+    def end_after(self, dt: datetime) -> datetime:
+        end = datetime.combine(dt.date(), self.end)
+        if end <= dt:
+            end += timedelta(days=1)
+        return end
+
+
+def compute_next_due(settings: Settings, after: datetime) -> datetime:
+    if settings.cron:
+        due = CronSchedule(settings.cron).next_after(after)
+    else:
+        due = after + timedelta(seconds=settings.cycle_seconds)
+    return skip_quiet_hours(settings, due)
+
+
+def skip_quiet_hours(settings: Settings, due: datetime) -> datetime:
+    """
+    Move a due time inside the quiet hours to their end, or the first cron match after it
+    """
+    cron = CronSchedule(settings.cron) if settings.cron else None
+    quiet = QuietHours.from_settings(settings)
+    for _ in range(8):
+        if quiet is None or not quiet.contains(due):
+            break
+        resume = quiet.end_after(due)
+        due = cron.next_after(resume - timedelta(minutes=1)) if cron else resume
+    return due
+
+
+class Scheduler:
+    """
+    Runs `job` whenever the next refresh is due and sleeps in between.
+    Call `wake` after the settings changed to recompute the due time.
+    """
+
+    # Re-check the wall clock periodically, it may jump when NTP syncs after boot
+    MAX_SLEEP = 300
+
+    def __init__(
+        self, engine: Engine, settings: "SettingsService", job: Callable[[], None]
+    ):
+        self.engine = engine
+        self.settings = settings
+        self.job = job
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self.next_due: Optional[datetime] = None
+        settings.subscribe(lambda _: self.wake())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def held_until(self, now: datetime) -> Optional[datetime]:
+        """
+        When refreshes may run again if the quiet hours hold them at `now`,
+        None if a refresh may run now. Panels refreshed elsewhere ask too.
+        """
+        resume = skip_quiet_hours(self.settings.get(), now)
+        return resume if resume > now else None
+
+    def interval(self, now: datetime) -> Optional[float]:
+        """
+        Seconds from a refresh at `now` until the next one, None while cycling is off
+        """
+        settings = self.settings.get()
+        if not settings.cycle:
+            return None
+        return (compute_next_due(settings, now) - now).total_seconds()
+
+    def _load(self) -> tuple[Settings, SchedulerState]:
+        with Session(self.engine) as session:
+            state = session.get(SchedulerState, 1) or SchedulerState()
+        return self.settings.get(), state
+
+    def _save(self, state: SchedulerState):
+        with Session(self.engine) as session:
+            session.merge(state)
+            session.commit()
+
+    def _reschedule(self, settings: Settings, state: SchedulerState):
+        if settings.cycle:
+            state.next_due = compute_next_due(
+                settings, state.last_run or datetime.now()
+            )
+        else:
+            state.next_due = None
+        self._save(state)
+        self.next_due = state.next_due
+        logger.info(f"Next refresh due: {state.next_due}")
+
+    def _run(self):
+        settings, state = self._load()
+        if settings.cycle and state.next_due is None:
+            self._reschedule(settings, state)
+        elif settings.cycle:
+            # a refresh that came due while the Pi was off runs now, unless now is quiet
+            due = skip_quiet_hours(settings, max(state.next_due, datetime.now()))
+            if due != state.next_due:
+                state.next_due = due
+                self._save(state)
+        self.next_due = state.next_due if settings.cycle else None
+
+        while not self._stopped:
+            now = datetime.now()
+            if self.next_due is None:
+                self._wake.wait()
+            elif self.next_due > now:
+                timeout = (self.next_due - now).total_seconds()
+                self._wake.wait(min(timeout, self.MAX_SLEEP))
+            else:
+                try:
+                    self.job()
+                except Exception as e:
+                    logger.error(f"Scheduled refresh failed: {e}")
+                state.last_run = datetime.now()
+                self._reschedule(settings, state)
+                continue
+
+            if self._wake.is_set():
+                self._wake.clear()
+                if self._stopped:
+                    break
+                settings = self.settings.get()
+                self._reschedule(settings, state)
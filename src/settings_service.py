@@ -0,0 +1,75 @@
+from datetime import time
+from threading import Lock
+from typing import Any, Callable, Optional
+from sqlmodel import Session, select
+from sqlalchemy.engine import Engine
+from models import Settings
+from scheduler import CronSchedule
+
+
+def validate_settings(settings: Settings):
+    """
+    Raise a ValueError if the settings can't be used by the scheduler
+    """
+    if not isinstance(settings.cycle_seconds, int) or settings.cycle_seconds <= 0:
+        raise ValueError("Cycle time must be a positive number of seconds")
+    if settings.cron:
+        CronSchedule(settings.cron)
+    if bool(settings.quiet_start) != bool(settings.quiet_end):
+        raise ValueError("Quiet hours need both a start and an end")
+    for value in (settings.quiet_start, settings.quiet_end):
+        if value:
+            try:
+                time.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Invalid time for quiet hours: {value}")
+
+
+class SettingsService:
+    """
+    In-memory copy of the settings row. Reads never touch the database,
+    writes go through `update` which commits and notifies subscribers.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._lock = Lock()
+        self._settings: Optional[Settings] = None
+        self._subscribers: list[Callable[[Settings], None]] = []
+
+    def load(self) -> Settings:
+        with self._lock:
+            with Session(self.engine) as session:
+                settings = session.exec(select(Settings)).first()
+                if settings is None:
+                    settings = Settings()
+                    session.add(settings)
+                    session.commit()
+                    session.refresh(settings)
+                self._settings = Settings(**settings.model_dump())
+            return self._settings
+
+    def get(self) -> Settings:
+        """
+        Return the current settings, the returned object must be treated as read-only
+        """
+        if self._settings is None:
+            return self.load()
+        return self._settings
+
+    def update(self, **changes: Any) -> Settings:
+        self.get()
+        with self._lock:
+            updated = Settings(**{**self._settings.model_dump(), **changes})
+            validate_settings(updated)
+            with Session(self.engine) as session:
+                session.merge(updated)
+                session.commit()
+            self._settings = updated
+
+        for callback in self._subscribers:
+            callback(updated)
+        return updated
+
+    def subscribe(self, callback: Callable[[Settings], None]):
+        self._subscribers.append(callback)
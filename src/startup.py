@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import logging
+import os
+import time
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def process_age() -> Optional[float]:
+    """
+    Seconds since the process was started, including interpreter startup
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # the command name may contain spaces, fields start after the closing paren
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """
+    Collects import times and milestones until the first request is served
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.offset = process_age() or 0.0
+        self.imports: dict[str, float] = {}
+        self.marks: dict[str, float] = {}
+
+    def elapsed(self) -> float:
+        return self.offset + time.perf_counter() - self.started
+
+    @contextmanager
+    def timed_import(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        yield
+        self.imports[name] = time.perf_counter() - started
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = self.elapsed()
+
+    def report(self) -> str:
+        lines = ["Startup timing:"]
+        for name, duration in sorted(self.imports.items(), key=lambda i: -i[1]):
+            lines.append(f"  import {name:<16} {duration * 1000:8.1f}ms")
+        for name, at in self.marks.items():
+            lines.append(f"  {name:<23} {at * 1000:8.1f}ms")
+        return "\n".join(lines)
+
+    def first_request(self):
+        if "first request" in self.marks:
+            return
+        self.mark("first request")
+        logger.info(self.report())
+        if self.marks["first request"] > self.budget:
+            logger.warning(
+                f"Startup took {self.marks['first request']:.2f}s, budget is {self.budget:.2f}s"
+            )
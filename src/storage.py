@@ -0,0 +1,198 @@
+from enum import Enum
+from pathlib import Path
+from typing import Any
+import sqlite3
+import zlib
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import SQLModel, Session, create_engine, select
+from models import ImageEntry, Settings
+
+# Tuned for SD cards: WAL avoids rewriting the journal on every commit and
+# lets readers run while the scheduler writes, NORMAL skips the fsync per commit
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -8000,
+    "temp_store": "MEMORY",
+}
+
+# Full text index of the entry names and tags, the rowids are those of
+# imageentry. They are stable since the database is never VACUUMed, after
+# doing so manually drop the table and it is rebuilt on the next start.
+SEARCH_TABLE = "image_search"
+
+
+def _has_fts5() -> bool:
+    """
+    Whether the SQLite library Python uses was built with FTS5
+    """
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(text)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+# Older SQLite builds lack FTS5, the table then is a plain copy of the names
+# and tags that is searched with LIKE, see library._search_clause
+FTS5 = _has_fts5()
+SEARCH_SCHEMA = (
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(name, tags, tokenize='unicode61 remove_diacritics 2')"
+    if FTS5
+    else f"CREATE TABLE {SEARCH_TABLE} (name TEXT, tags TEXT)"
+)
+# ALTER TABLE ... DROP COLUMN came with SQLite 3.35, before that the table is copied
+DROP_COLUMN = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Columns replaced by newer ones: table, old column, new column and the SQL
+# expression computing the new value from the old one
+REPLACED_COLUMNS = [
+    # the cycle interval was stored in minutes
+    ("settings", "cycle_time", "cycle_seconds", "cycle_time * 60"),
+]
+
+POOL_SIZE = 4
+MAX_OVERFLOW = 4
+
+
+def create_storage_engine(db_file: Path, pragmas: dict[str, Any] = SQLITE_PRAGMAS) -> Engine:
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(
+        f"sqlite:///{db_file}",
+        connect_args={"check_same_thread": False, "timeout": 5},
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=10,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def _sql_literal(value: Any) -> str:
+    if isinstance(value, Enum):
+        value = value.name
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def add_missing_columns(engine: Engine):
+    """
+    Add columns and indexes introduced by newer model versions to existing tables
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    statement += f" DEFAULT {_sql_literal(column.default.arg)}"
+                connection.execute(text(statement))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def migrate_replaced_columns(engine: Engine):
+    """
+    Carry the values of replaced columns over to their successors and drop the old columns
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table, old, new, value in REPLACED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            if old not in {column["name"] for column in inspector.get_columns(table)}:
+                continue
+            connection.exec_driver_sql(f"UPDATE {table} SET {new} = {value} WHERE {old} IS NOT NULL")
+            if DROP_COLUMN:
+                connection.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN {old}")
+            else:
+                copy_table(connection, table)
+
+
+def copy_table(connection: Connection, name: str):
+    """
+    Recreate a table from its model and copy the model's columns over, drops
+    every other column on SQLite versions without DROP COLUMN
+    """
+    model = SQLModel.metadata.tables[name]
+    connection.exec_driver_sql(f"ALTER TABLE {name} RENAME TO {name}_old")
+    # the indexes moved along with the renamed table but keep their names
+    for index in inspect(connection).get_indexes(f"{name}_old"):
+        connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+    model.create(connection)
+    columns = ", ".join(model.columns.keys())
+    connection.exec_driver_sql(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {name}_old")
+    connection.exec_driver_sql(f"DROP TABLE {name}_old")
+
+
+def create_search_index(engine: Engine):
+    """
+    Create and fill the full text index if it does not exist yet
+    """
+    with engine.begin() as connection:
+        if inspect(connection).has_table(SEARCH_TABLE):
+            return
+        connection.exec_driver_sql(SEARCH_SCHEMA)
+        connection.exec_driver_sql(
+            f"""
+            INSERT INTO {SEARCH_TABLE}(rowid, name, tags)
+            SELECT imageentry.rowid, imageentry.name, coalesce(
+                (SELECT group_concat(tag.name, ' ') FROM imagetag
+                 JOIN tag ON tag.id = imagetag.tag_id
+                 WHERE imagetag.image_id = imageentry.id), '')
+            FROM imageentry
+            """
+        )
+
+
+def schema_version() -> int:
+    """
+    Fingerprint of the model tables, columns and indexes
+    """
+    fingerprint = ";".join(
+        f"{table.name}:{','.join(table.columns.keys())}:{','.join(sorted(index.name for index in table.indexes))}"
+        for table in SQLModel.metadata.sorted_tables
+    )
+    fingerprint += f";{SEARCH_SCHEMA};{REPLACED_COLUMNS}"
+    return zlib.crc32(fingerprint.encode()) & 0x7FFFFFFF
+
+
+def init_db(engine: Engine):
+    version = schema_version()
+    with engine.connect() as connection:
+        # the schema is stamped into user_version, if it matches there is nothing to migrate
+        if connection.exec_driver_sql("PRAGMA user_version").scalar() == version:
+            return
+
+    SQLModel.metadata.create_all(engine)
+    add_missing_columns(engine)
+    migrate_replaced_columns(engine)
+    create_search_index(engine)
+    # try to execute a query to see if the database is working
+    with Session(engine) as session:
+        session.exec(select(ImageEntry.id).limit(1)).first()
+        session.exec(select(Settings.id).limit(1)).first()
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")